@@ -5,20 +5,30 @@
 # external imports
 import logging
 import json
+import asyncio
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import urllib.parse
 import xml.etree.ElementTree as ET
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from enum import Enum
 
+# Internal import
+from api.record_cache import Record_Cache
+# Optional : only needed for AsyncKohaRESTAPIClient
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
-NS = {"marc": "http://www.loc.gov/MARC21/slim"}
 
-# ↓ Tf ?
-# Ensuite, faire les appels
-# Token expire après 3600, check sa validité + relancer un get token si nécessaire
-# ya moyen qu'après un call les inforamtions du tokken sont renvoyés
+NS = {"marc": "http://www.loc.gov/MARC21/slim"}
+# HTTP status that are retried with exponential backoff by the session
+RETRY_STATUS_CODES = [429, 502, 503, 504]
 
 # ----------------- Enum def -----------------
 
@@ -41,6 +51,9 @@ class Errors(Enum):
     # Data error
     INVALID_BIBNB = 10
     RECORD_DOES_NOT_EXIST = 11
+    RECORD_NOT_IN_CACHE = 12
+    # Cache only : add & update requests are never sent
+    RECORD_NOT_SENT_CACHE_ONLY = 13
     # 2XX : authorities
     INVALID_AUTH_ID = 200
     AUTHORIRY_DOES_NOT_EXIST = 201
@@ -58,6 +71,7 @@ class Api_Name(Enum):
     GET_BIBLIO = 0
     UPDATE_BIBLIO = 1
     ADD_BIBLIO = 2
+    GET_BIBLIO_LIST = 3
     # 2XX : authorities
     GET_AUTH = 200
     GET_AUTH_LIST = 201
@@ -140,6 +154,83 @@ def add_to_dict_if_inexistent(dict:dict, key:str, value:None) -> None:
     if not key in dict:
         dict[key] = value
 
+def split_raw_marc_records(content:bytes) -> List[bytes]:
+    """Splits a raw MARC (ISO 2709) stream into records.
+    White spaces between records (like line feeds) are ignored"""
+    output = []
+    for raw_record in content.split(b"\x1d"):
+        raw_record = raw_record.lstrip()
+        if raw_record:
+            output.append(raw_record + b"\x1d")
+    return output
+
+def get_raw_marc_control_field(raw_record:bytes, tag:str) -> str|None:
+    """Returns the value of a control field of a raw MARC (ISO 2709) record
+    WITHOUT parsing the whole record.
+    Returns None if the field does not exist or the record is malformed"""
+    try:
+        base_address = int(raw_record[12:17])
+        # The directory ends with a field terminator before the base address
+        if base_address < 25 or base_address > len(raw_record):
+            return None
+        directory = raw_record[24:base_address - 1]
+        tag = tag.encode()
+        for pos in range(0, len(directory) - 11, 12):
+            if directory[pos:pos + 3] == tag:
+                length = int(directory[pos + 3:pos + 7])
+                start = base_address + int(directory[pos + 7:pos + 12])
+                if length < 0 or start + length > len(raw_record):
+                    return None
+                # Remove field terminator
+                return raw_record[start:start + length].rstrip(b"\x1e").decode("utf-8", errors="replace")
+    except ValueError:
+        return None
+    return None
+
+def record_request_metrics(metrics, api:Api_Name|None, latency:float, status:int|None):
+    """Reports a request latency as api.<Api_Name> (api.TOKEN if api is None).
+    Requests without response or with an HTTP error status are also counted as api.<Api_Name>.errors"""
+    name = "api." + (api.name if api is not None else "TOKEN")
+    metrics.observe(name, latency)
+    metrics.count(name + ".requests")
+    if status is None or status >= 400:
+        metrics.count(name + ".errors")
+
+def get_token_renewal_time(token:dict, start:float, margin:float) -> float:
+    """Returns the time.monotonic() value at which the token must be renewed :
+    margin seconds before it expires, or halfway through its lifetime if it is shorter than 2 margins.
+    start is the time.monotonic() value before the token was requested.
+    Returns infinity if the token has no valid expires_in"""
+    try:
+        expires_in = float(token["expires_in"])
+    except (KeyError, TypeError, ValueError):
+        return float("inf")
+    return start + expires_in - min(margin, expires_in / 2)
+
+def get_cached_record(cache:Record_Cache|None, metrics, endpoint:str, id:str, content_type:Content_Type) -> bytes|None:
+    """Returns the record from the cache, or None if there is no cache or it is not cached.
+    Counts cache.hits & cache.misses to metrics if set"""
+    if cache is None:
+        return None
+    content = cache.get(endpoint, id, content_type.value)
+    if metrics is not None:
+        metrics.count("cache.hits" if content is not None else "cache.misses")
+    return content
+
+def split_marcxml_records(content:bytes) -> List[Tuple[str|None, bytes]]:
+    """Splits a MARCXML collection into records.
+    Returns a list of tuples (001 value or None, record as MARCXML)"""
+    output = []
+    root = ET.fromstring(content)
+    records = [root] if root.tag.endswith("record") else root.iter(f"{{{NS['marc']}}}record")
+    for record in records:
+        controlfield = record.find("marc:controlfield[@tag='001']", NS)
+        bibnb = None
+        if controlfield is not None and controlfield.text:
+            bibnb = controlfield.text.strip()
+        output.append((bibnb, ET.tostring(record, encoding="utf-8")))
+    return output
+
 # ----------------- Class def -----------------
 
 class KohaRESTAPIClient(object):
@@ -151,23 +242,83 @@ class KohaRESTAPIClient(object):
     - client_id
     - client_secret
     - service [opt] : service name
+    - pool_connections [opt] : number of per-host connection pools kept by the session
+    - pool_maxsize [opt] : maximum number of kept-alive connections per host
+    - pool_block [opt] : if True, waits for a free connection instead of opening an extra one
+    - keep_alive [opt] : if False, closes the connection after each request
+    - max_retries [opt] : number of retries on connection errors & retried HTTP status (429, 502, 503, 504)
+    - backoff_factor [opt] : exponential backoff factor between retries (in seconds)
+    - connect_timeout [opt] : connect timeout (in seconds)
+    - read_timeout [opt] : read timeout (in seconds)
+    - limiter [opt] : an object with a slot() context manager (like api.adaptive_limiter.Adaptive_Limiter)
+    wrapping every request, yielding a dict in which the response "status" is set
+    - metrics [opt] : an object with count() & observe() methods (like api.metrics.Metrics)
+    receiving the latency of every request as api.<Api_Name> (api.TOKEN for authentification)
+    - token_refresh_margin [opt] : the token is renewed this many seconds before it expires (at most half its lifetime)
+    - cache_file [opt] : path of a api.record_cache.Record_Cache file storing the records retrieved by get_biblio(s) & get_auth.
+    Updated records are removed from the cache
+    - cache_ttl [opt] : number of seconds a cached record stays valid
+    - cache_max_size [opt] : maximum size of the cached records in bytes
+    - cache_only [opt] : never contact Koha : records not in the cache return RECORD_NOT_IN_CACHE,
+    add & update are not sent and return RECORD_NOT_SENT_CACHE_ONLY
+    - read_cached_biblios [opt] : if False, get_biblio(s) always retrieve the biblios from Koha, they are only stored in the cache.
+    A cached biblio edited in Koha since it was cached would otherwise be overwritten by an update based on it.
+    Always True with cache_only
+
+The token is renewed before it expires, or when Koha answers 401 : the request is then sent once more.
+Only one thread renews the token, the others wait for it.
 """
-    def __init__(self, koha_url, client_id, client_secret, service='KohaRESTAPIClient'):
+    def __init__(self, koha_url, client_id, client_secret, service='KohaRESTAPIClient',
+                 pool_connections:int=4, pool_maxsize:int=10, pool_block:bool=False, keep_alive:bool=True,
+                 max_retries:int=3, backoff_factor:float=0.5, connect_timeout:float=5, read_timeout:float=60,
+                 limiter=None, metrics=None, token_refresh_margin:float=60,
+                 cache_file:str=None, cache_ttl:float=3600, cache_max_size:int=1073741824, cache_only:bool=False,
+                 read_cached_biblios:bool=True):
         self.service = service
+        self.limiter = limiter
+        self.metrics = metrics
         self.init_logger()
         self.endpoint = str(koha_url).rstrip("/") + "/api/v1/"
         self.error:Errors = None
         self.error_msg:str = None
         self.status:Status = Status.UNKNOWN
+        self.timeout = (connect_timeout, read_timeout)
+        self.init_session(pool_connections, pool_maxsize, pool_block, keep_alive, max_retries, backoff_factor)
+        self.__client_id = client_id
+        self.__client_secret = client_secret
+        self.token:dict = None
+        self.token_renew_at:float = 0
+        self.token_refresh_margin = token_refresh_margin
+        self.token_lock = threading.Lock()
+        self.cache:Record_Cache = None
+        if cache_file:
+            self.cache = Record_Cache(cache_file, cache_ttl, cache_max_size)
+        self.cache_only = cache_only
+        self.read_cached_biblios = read_cached_biblios or cache_only
 
+        # No authentification without Koha
+        if self.cache_only:
+            self.status = Status.SUCCESS
+            self.log.info(f"{self.log.init_name} :: Cache only, Koha will not be contacted")
+            return
         # Try authentification
+        with self.token_lock:
+            self.__authenticate(init=True)
+
+    # ---------- Token methods ----------
+    def __authenticate(self, init:bool=False) -> Status:
+        """Gets a new token, must be called with token_lock acquired.
+        Returns the client status"""
+        start = time.monotonic()
+        r = None
         try:
-            r = requests.request(method="POST", url=self.endpoint + "oauth/token",
+            r = self.__send(method="POST", url=self.endpoint + "oauth/token", authenticate=False,
                             data={
                                 "grant_type": "client_credentials",
-                                "client_id": client_id,
-                                "client_secret": client_secret
-                            }
+                                "client_id": self.__client_id,
+                                "client_secret": self.__client_secret
+                            },
+                            timeout=self.timeout
                         )
             r.raise_for_status()
         # Error managing
@@ -177,23 +328,36 @@ class KohaRESTAPIClient(object):
             self.log.http_error(r, init=True)
             self.error_msg = r.reason
         except requests.exceptions.RequestException as generic_error:
-            try:
-                self.status = Status.ERROR
-                self.error = Errors.GENERIC_REQUEST_ERROR
-                self.log.request_generic_error(r, generic_error, msg="Generic exception", init=True)
-                self.error_msg = f"Generic exception : {r.reason}"
-            except NameError as e:
-                self.status = Status.ERROR
-                self.error = Errors.GENERIC_REQUEST_ERROR_INTO_NAME_ERROR
-                self.log.generic_error(e, msg="Generic exception then NameError", init=True)
-                self.error_msg = e
+            self.status = Status.ERROR
+            self.error = Errors.GENERIC_REQUEST_ERROR
+            self.log.request_generic_error(r, generic_error, msg="Generic exception", init=True)
+            self.error_msg = f"Generic exception : {r.reason if r is not None else generic_error}"
         # Access authorized
         else:
             token = json.loads(r.content)
             # Store token 
             self.token = token
+            self.token_renew_at = get_token_renewal_time(token, start, self.token_refresh_margin)
             self.status = Status.SUCCESS
-            self.log.info(f"{self.log.init_name} :: Access authorized")
+            if init:
+                self.log.info(f"{self.log.init_name} :: Access authorized")
+            else:
+                self.log.info(f"{self.service} :: Token renewed")
+        return self.status
+
+    def get_token(self, refused:dict=None) -> dict|None:
+        """Returns a valid token, renewing it if it expires in less than token_refresh_margin seconds
+        (or if half of its lifetime has passed, for short lived tokens).
+        If refused is set (a token Koha answered 401 to), renews it unless another thread already did.
+        Returns None if no token could be retrieved"""
+        token = self.token
+        if token is not None and token is not refused and time.monotonic() < self.token_renew_at:
+            return token
+        with self.token_lock:
+            # Another thread may have renewed it while this one was waiting
+            if self.token is None or self.token is refused or time.monotonic() >= self.token_renew_at:
+                self.__authenticate()
+            return self.token
 
     # ---------- API methods ----------
 
@@ -210,34 +374,45 @@ class KohaRESTAPIClient(object):
             return Errors.INVALID_AUTH_ID
         # Checks if content-type is correct
         content_type = validate_content_type(format)
+        # Checks the cache
+        cached = get_cached_record(self.cache, self.metrics, "authorities", auth_id, content_type)
+        if cached is not None:
+            self.log.debug(f"{api.name} Authority {id} retrieved from cache")
+            return cached
+        if self.cache_only:
+            self.log.error(f"{api.name} Authority {id} is not in the cache")
+            return Errors.RECORD_NOT_IN_CACHE
 
         # Try getting the authority
         # Hm, I'm getting an error 500 when trying to get the auth record as MARCXML
         # But other 4 format work, so Idk, marcxml issue ? Though it works for biblios
+        r = None
         try:
             headers = {
-                "Authorization":f"{self.token['token_type']} {self.token['access_token']}",
                 "accept":content_type.value
             }
-            r = requests.get(f"{self.endpoint}authorities/{auth_id}", headers=headers)
+            r = self.__send("GET", f"{self.endpoint}authorities/{auth_id}", api=api, headers=headers, timeout=self.timeout)
             r.raise_for_status()
         # Error handling
         except requests.exceptions.RequestException as generic_error:
             self.log.request_generic_error(r, generic_error, msg=f"{api.name} Generic exception")
-            if r.status_code == 404:
+            if r is not None and r.status_code == 404:
                 return Errors.AUTHORIRY_DOES_NOT_EXIST
             else:
                 return Errors.GENERIC_REQUEST_ERROR
         # Succesfully retrieve the record
         else:
             self.log.debug(f"{api.name} Authority {id} retrieved")
+            if self.cache is not None:
+                self.cache.put("authorities", auth_id, content_type.value, r.content)
             return r.content
 
-    def list_auth(self, query:Dict={}, format:Content_Type=Content_Type.RAW_MARC, page:int=1, nb_res:int=40, auth_type:str=None) -> str|Errors:
+    def list_auth(self, query:Dict={}, format:Content_Type=Content_Type.RAW_MARC, page:int=1, nb_res:int=40, auth_type:str=None, with_total:bool=False) -> str|Tuple[str, int|None]|Errors:
         """Returns a list of authorities WITHOUT decoding them.
         If an error occurred, returns an Errors element
         
-        If an authority type is provided in the query, will use this one"""
+        If an authority type is provided in the query, will use this one.
+        If with_total is True, returns a tuple (list, total number of matching authorities from X-Total-Count or None)"""
         # Checks if the provided ID is a number
         api = Api_Name.GET_AUTH_LIST
         # Checks if content-type is correct
@@ -248,9 +423,9 @@ class KohaRESTAPIClient(object):
         # Try getting the authority
         # Hm, I'm getting an error 500 when trying to get the auth record as MARCXML
         # But other 4 format work, so Idk, marcxml issue ? Though it works for biblios
+        r = None
         try:
             headers = {
-                "Authorization":f"{self.token['token_type']} {self.token['access_token']}",
                 "accept":content_type.value
             }
             params = {
@@ -264,7 +439,7 @@ class KohaRESTAPIClient(object):
             # If an auth type is provided and none was provided in the query, adds it
             if auth_type:
                 add_to_dict_if_inexistent(data, "framework_id", str(auth_type))
-            r = requests.get(f"{self.endpoint}authorities", headers=headers, data=data, params=params)
+            r = self.__send("GET", f"{self.endpoint}authorities", api=api, headers=headers, data=data, params=params, timeout=self.timeout)
             r.raise_for_status()
         # Error handling
         except requests.exceptions.RequestException as generic_error:
@@ -273,6 +448,9 @@ class KohaRESTAPIClient(object):
         # Succesfully retrieve the record
         else:
             self.log.debug(f"{api.name} Authority list retrieved")
+            if with_total:
+                total = r.headers.get("X-Total-Count", "").strip()
+                return r.content, int(total) if total.isdigit() else None
             return r.content
 
     # ----- Biblios -----
@@ -289,27 +467,121 @@ class KohaRESTAPIClient(object):
             return Errors.INVALID_BIBNB
         # Checks if content-type is correct
         content_type = validate_content_type(format)
+        # Checks the cache
+        cached = get_cached_record(self.cache if self.read_cached_biblios else None, self.metrics, "biblios", bibnb, content_type)
+        if cached is not None:
+            self.log.debug(f"{api.name} Record {id} retrieved from cache")
+            return cached
+        if self.cache_only:
+            self.log.error(f"{api.name} Record {id} is not in the cache")
+            return Errors.RECORD_NOT_IN_CACHE
 
         # Try getting the biblio
+        r = None
         try:
             headers = {
-                "Authorization":f"{self.token['token_type']} {self.token['access_token']}",
                 "accept":content_type.value
             }
-            r = requests.get(f"{self.endpoint}biblios/{bibnb}", headers=headers)
+            r = self.__send("GET", f"{self.endpoint}biblios/{bibnb}", api=api, headers=headers, timeout=self.timeout)
             r.raise_for_status()
         # Error handling
         except requests.exceptions.RequestException as generic_error:
             self.log.request_generic_error(r, generic_error, msg=f"{api.name} Generic exception")
-            if r.status_code == 404:
+            if r is not None and r.status_code == 404:
                 return Errors.RECORD_DOES_NOT_EXIST
             else:
                 return Errors.GENERIC_REQUEST_ERROR
         # Succesfully retrieve the record
         else:
             self.log.debug(f"{api.name} Record {id} retrieved")
+            if self.cache is not None:
+                self.cache.put("biblios", bibnb, content_type.value, r.content)
             return r.content
 
+    def get_biblios(self, ids:List[str], format:Content_Type=Content_Type.RAW_MARC, chunk_size:int=100) -> Dict[str, bytes|Errors]:
+        """Returns multiple records WITHOUT decoding them, using the biblio list endpoint.
+        Requests chunk_size records per call.
+        Records are matched with their ID using their 001.
+
+        Returns a dict with the biblionumber (as a string) as key
+        and the record or an Errors element as value :
+            - INVALID_BIBNB if the ID is not a number
+            - RECORD_DOES_NOT_EXIST if the record was not in the response
+            - RECORD_NOT_IN_CACHE if cache_only is set & the record is not cached
+            - GENERIC_REQUEST_ERROR if the request for this chunk failed or its MARCXML response could not be parsed
+            - CONTENT_TYPE_NOT_SUPPORTED for all IDs if format is not RAW_MARC or MARCXML"""
+        api = Api_Name.GET_BIBLIO_LIST
+        output:Dict[str, bytes|Errors] = {}
+        bibnbs:List[str] = []
+        for id in ids:
+            bibnb = validate_bibnb(id)
+            if bibnb == None or bibnb == "":
+                self.log.error(f"{api.name} Invalid input biblionumber ({id})")
+                output[str(id)] = Errors.INVALID_BIBNB
+            elif not bibnb in bibnbs:
+                bibnbs.append(bibnb)
+        # Checks if content-type is correct
+        content_type = validate_content_type(format)
+        if content_type not in [Content_Type.RAW_MARC, Content_Type.MARCXML]:
+            for bibnb in bibnbs:
+                output[bibnb] = Errors.CONTENT_TYPE_NOT_SUPPORTED
+            return output
+        chunk_size = max(validate_int(chunk_size, default=100), 1)
+        # Only requests records that are not cached
+        if (self.cache is not None and self.read_cached_biblios) or self.cache_only:
+            missing = []
+            for bibnb in bibnbs:
+                cached = get_cached_record(self.cache, self.metrics, "biblios", bibnb, content_type)
+                if cached is not None:
+                    output[bibnb] = cached
+                elif self.cache_only:
+                    output[bibnb] = Errors.RECORD_NOT_IN_CACHE
+                else:
+                    missing.append(bibnb)
+            bibnbs = missing
+
+        for chunk_start in range(0, len(bibnbs), chunk_size):
+            chunk = bibnbs[chunk_start:chunk_start + chunk_size]
+            # Try getting the biblios
+            r = None
+            try:
+                headers = {
+                    "accept":content_type.value
+                }
+                params = {
+                    "q":json.dumps({"biblio_id":[int(bibnb) for bibnb in chunk]}),
+                    "_per_page":len(chunk)
+                }
+                r = self.__send("GET", f"{self.endpoint}biblios", api=api, headers=headers, params=params, timeout=self.timeout)
+                r.raise_for_status()
+            # Error handling
+            except requests.exceptions.RequestException as generic_error:
+                self.log.request_generic_error(r, generic_error, msg=f"{api.name} Generic exception")
+                for bibnb in chunk:
+                    output[bibnb] = Errors.GENERIC_REQUEST_ERROR
+                continue
+            # Succesfully retrieve the records
+            if content_type == Content_Type.MARCXML:
+                # A truncated or malformed response fails the whole chunk, like a failed request
+                try:
+                    records = split_marcxml_records(r.content)
+                except ET.ParseError as parse_error:
+                    self.log.error(f"{api.name} Failed to parse the MARCXML response : {parse_error}")
+                    for bibnb in chunk:
+                        output[bibnb] = Errors.GENERIC_REQUEST_ERROR
+                    continue
+            else:
+                records = [(get_raw_marc_control_field(record, "001"), record) for record in split_raw_marc_records(r.content)]
+            for bibnb, record in records:
+                if bibnb in chunk:
+                    output[bibnb] = record
+                    if self.cache is not None:
+                        self.cache.put("biblios", bibnb, content_type.value, record)
+            for bibnb in chunk:
+                add_to_dict_if_inexistent(output, bibnb, Errors.RECORD_DOES_NOT_EXIST)
+            self.log.debug(f"{api.name} {len(records)} records retrieved out of {len(chunk)}")
+        return output
+
     def __post_biblio(self, api:Api_Name, record:str, format:Content_Type=Content_Type.RAW_MARC, record_schema:Record_Schema=Record_Schema.UNIMARC, framework_id:str=None, id:str=None) -> str|Errors:
         """Private function for add & update biblio.
         Returns the API repsonse content (or an error)
@@ -350,10 +622,15 @@ class KohaRESTAPIClient(object):
                 self.log.error(f"{api.name} Invalid input biblionumber ({id})")
                 return Errors.INVALID_BIBNB
 
+        # Without Koha, nothing is sent
+        if self.cache_only:
+            self.log.debug(f"{api.name} Cache only, record was not sent")
+            return Errors.RECORD_NOT_SENT_CACHE_ONLY
+
         # Try psoting the biblio
+        r = None
         try:
             headers = {
-                "Authorization":f"{self.token['token_type']} {self.token['access_token']}",
                 "Content-type":content_type.value,
                 "x-record-schema":record_schema.value
             }
@@ -366,12 +643,12 @@ class KohaRESTAPIClient(object):
             if api == Api_Name.UPDATE_BIBLIO:
                 url = url + f"/{bibnb}"
                 method = "PUT"
-            r = requests.request(method, url, headers=headers, data=data)
+            r = self.__send(method, url, api=api, headers=headers, data=data, timeout=self.timeout)
             r.raise_for_status()
         # Error handling
         except requests.exceptions.RequestException as generic_error:
             self.log.request_generic_error(r, generic_error, msg=f"{api.name} Generic exception")
-            if r.status_code == 404:
+            if r is not None and r.status_code == 404:
                 return Errors.RECORD_DOES_NOT_EXIST
             else:
                 return Errors.GENERIC_REQUEST_ERROR
@@ -379,6 +656,9 @@ class KohaRESTAPIClient(object):
         else:
             if api == Api_Name.UPDATE_BIBLIO:
                 self.log.debug(f"{api.name} Record {id} updated")
+                # The cached record is outdated
+                if self.cache is not None:
+                    self.cache.invalidate("biblios", bibnb)
             else:
                 self.log.debug(f"{api.name} Record added")
             return r.content
@@ -406,6 +686,78 @@ class KohaRESTAPIClient(object):
             - [optionnal] framework_id {str} : code of the framework ID in Koha"""
         return self.__post_biblio(Api_Name.UPDATE_BIBLIO, record=record, format=format, record_schema=record_schema, framework_id=framework_id, id=id)
 
+    # ---------- Session methods ----------
+    def init_session(self, pool_connections:int=4, pool_maxsize:int=10, pool_block:bool=False, keep_alive:bool=True, max_retries:int=3, backoff_factor:float=0.5):
+        """Init the pooled HTTP session used by all API calls.
+        Connections are kept alive between calls, and connection errors
+        & HTTP status in RETRY_STATUS_CODES are retried with exponential backoff"""
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            # POST is not idempotent : add_biblio must never be replayed
+            allowed_methods=["GET", "PUT"],
+            respect_retry_after_header=True,
+            # Return the last response so raise_for_status() handles it as before
+            raise_on_status=False
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # The token request is safe to replay, requests uses the longest matching prefix
+        token_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry.new(allowed_methods=["POST"]))
+        self.session.mount(self.endpoint + "oauth/token", token_adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def __send(self, method:str, url:str, api:Api_Name=None, authenticate:bool=True, **kwargs) -> requests.Response:
+        """Sends a request through the session, inside a limiter slot if a limiter is set.
+        Reports the latency to metrics if set.
+        If authenticate is True, adds the token to the headers,
+        and if Koha answers 401, sends the request once more with a new token"""
+        if not authenticate:
+            return self.__send_once(method, url, api, **kwargs)
+        token = self.get_token()
+        if token is not None:
+            kwargs["headers"]["Authorization"] = f"{token['token_type']} {token['access_token']}"
+        r = self.__send_once(method, url, api, **kwargs)
+        if r.status_code == 401:
+            new_token = self.get_token(refused=token)
+            if new_token is not None and new_token is not token:
+                self.log.debug(f"{api.name} Token refused, retrying with a new token")
+                kwargs["headers"]["Authorization"] = f"{new_token['token_type']} {new_token['access_token']}"
+                r = self.__send_once(method, url, api, **kwargs)
+        return r
+
+    def __send_once(self, method:str, url:str, api:Api_Name=None, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        status = None
+        try:
+            if self.limiter is None:
+                r = self.session.request(method, url, **kwargs)
+                status = r.status_code
+                return r
+            with self.limiter.slot() as outcome:
+                r = self.session.request(method, url, **kwargs)
+                status = outcome["status"] = r.status_code
+                return r
+        finally:
+            if self.metrics is not None:
+                record_request_metrics(self.metrics, api, time.perf_counter() - start, status)
+
+    def close(self):
+        """Closes the session & all its pooled connections, and the cache"""
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     # ---------- Logger methods for other classes / functions ----------
     def init_logger(self):
         """Init the logger"""
@@ -433,11 +785,11 @@ class KohaRESTAPIClient(object):
                 service = self.init_name
             self.logger.error(f"{service} :: {msg}HTTP Status : {r.status_code} || Method : {r.request.method} || URL : {r.url} || Reason : {r.text}")
 
-        def request_generic_error(self, r:requests.Response, reason, msg:str="", init=False):
+        def request_generic_error(self, r:requests.Response|None, reason, msg:str="", init=False):
             """Log an error statement with the service then HTTP Status, Method, URL and error reason.
             
             Takes as argument :
-                - requests.Reponse
+                - requests.Reponse (or None if no response was received)
                 - reason : the exception message
                 - [optional] msg : a message to display before HTTP infos
                 - [optionnal, default to False] init : if True, set service as 'KohaRESTAPIClient_Init'"""
@@ -448,6 +800,10 @@ class KohaRESTAPIClient(object):
             service = self.parent.service
             if init:
                 service = self.init_name
+            # No response (connection error, timeout, retries exhausted...)
+            if r is None:
+                self.logger.error(f"{service} :: {msg}No response || Reason : {reason}")
+                return
             self.logger.error(f"{service} :: {msg}HTTP Status : {r.status_code} || Method : {r.request.method} || URL : {r.url} || Reason : {reason}")
 
         def generic_error(self, reason, msg:str, init=False):
@@ -481,3 +837,335 @@ class KohaRESTAPIClient(object):
         def error(self, msg:str):
             """Log a error statement logging first the service then the message"""
             self.logger.error(f"{self.parent.service} :: {msg}")
+
+class AsyncKohaRESTAPIClient(object):
+    """AsyncKohaRESTAPIClient
+    =======
+    Same API methods as KohaRESTAPIClient, but as coroutines sharing one event loop.
+    Requires aiohttp.
+    Authentification happens in connect() (or when entering async with), not on init.
+    On init take as arguments :
+    - koha_url : Koha server URL
+    - client_id
+    - client_secret
+    - service [opt] : service name
+    - max_concurrency [opt] : maximum number of requests in flight
+    - max_retries [opt] : number of retries on connection errors & retried HTTP status (429, 502, 503, 504)
+    - backoff_factor [opt] : exponential backoff factor between retries (in seconds)
+    - connect_timeout [opt] : connect timeout (in seconds)
+    - read_timeout [opt] : read timeout (in seconds)
+    - limiter [opt] : an object with an async_slot() async context manager (like api.adaptive_limiter.Adaptive_Limiter),
+    each attempt is sent inside a slot
+    - metrics [opt] : same as KohaRESTAPIClient
+    - token_refresh_margin [opt] : same as KohaRESTAPIClient
+    - cache_file, cache_ttl, cache_max_size, cache_only & read_cached_biblios [opt] : same as KohaRESTAPIClient
+
+The token is renewed the same way as KohaRESTAPIClient, by a single coroutine.
+"""
+    def __init__(self, koha_url, client_id, client_secret, service='KohaRESTAPIClient',
+                 max_concurrency:int=100, max_retries:int=3, backoff_factor:float=0.5, connect_timeout:float=5, read_timeout:float=60,
+                 limiter=None, metrics=None, token_refresh_margin:float=60,
+                 cache_file:str=None, cache_ttl:float=3600, cache_max_size:int=1073741824, cache_only:bool=False,
+                 read_cached_biblios:bool=True):
+        if aiohttp is None:
+            raise ImportError("AsyncKohaRESTAPIClient requires aiohttp")
+        self.service = service
+        self.limiter = limiter
+        self.metrics = metrics
+        self.log = KohaRESTAPIClient.Logger(self)
+        self.endpoint = str(koha_url).rstrip("/") + "/api/v1/"
+        self.error:Errors = None
+        self.error_msg:str = None
+        self.status:Status = Status.UNKNOWN
+        self.token:dict = None
+        self.token_renew_at:float = 0
+        self.token_refresh_margin = token_refresh_margin
+        self.__client_id = client_id
+        self.__client_secret = client_secret
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        # Created in connect() as they must be bound to the running event loop
+        self.session:aiohttp.ClientSession = None
+        self.semaphore:asyncio.Semaphore = None
+        self.token_lock:asyncio.Lock = None
+        # SQLite calls are quick enough to be made from the event loop
+        self.cache:Record_Cache = None
+        if cache_file:
+            self.cache = Record_Cache(cache_file, cache_ttl, cache_max_size)
+        self.cache_only = cache_only
+        self.read_cached_biblios = read_cached_biblios or cache_only
+
+    async def connect(self) -> Status:
+        """Opens the session & gets the token.
+        Returns the client status"""
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.token_lock = asyncio.Lock()
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        # No authentification without Koha
+        if self.cache_only:
+            self.status = Status.SUCCESS
+            self.log.info(f"{self.log.init_name} :: Cache only, Koha will not be contacted")
+            return self.status
+        async with self.token_lock:
+            return await self.__authenticate(init=True)
+
+    async def __authenticate(self, init:bool=False) -> Status:
+        """Gets a new token, must be called with token_lock acquired.
+        Returns the client status"""
+        start = time.monotonic()
+        status, content, reason = await self.__request("POST", self.endpoint + "oauth/token", retry_post=True, authenticate=False,
+                            data={
+                                "grant_type": "client_credentials",
+                                "client_id": self.__client_id,
+                                "client_secret": self.__client_secret
+                            }
+                        )
+        if status is None:
+            self.status = Status.ERROR
+            self.error = Errors.GENERIC_REQUEST_ERROR
+            self.log.generic_error(reason, msg="Generic exception", init=True)
+            self.error_msg = f"Generic exception : {reason}"
+        elif status >= 400:
+            self.status = Status.ERROR
+            self.error = Errors.HTTP_ERROR
+            self.log.generic_error(reason, msg=f"HTTP Status : {status}", init=True)
+            self.error_msg = reason
+        # Access authorized
+        else:
+            self.token = json.loads(content)
+            self.token_renew_at = get_token_renewal_time(self.token, start, self.token_refresh_margin)
+            self.status = Status.SUCCESS
+            if init:
+                self.log.info(f"{self.log.init_name} :: Access authorized")
+            else:
+                self.log.info(f"{self.service} :: Token renewed")
+        return self.status
+
+    async def get_token(self, refused:dict=None) -> dict|None:
+        """Returns a valid token, see KohaRESTAPIClient.get_token()"""
+        token = self.token
+        if token is not None and token is not refused and time.monotonic() < self.token_renew_at:
+            return token
+        async with self.token_lock:
+            # Another coroutine may have renewed it while this one was waiting
+            if self.token is None or self.token is refused or time.monotonic() >= self.token_renew_at:
+                await self.__authenticate()
+            return self.token
+
+    async def close(self):
+        """Closes the session & all its connections, and the cache"""
+        if self.session is not None:
+            await self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def __request(self, method:str, url:str, retry_post:bool=False, api:Api_Name=None, authenticate:bool=True, **kwargs):
+        """Sends a request, retrying connection errors & RETRY_STATUS_CODES with exponential backoff.
+        POST are not retried unless retry_post is True.
+        If authenticate is True, adds the token to the headers,
+        and if Koha answers 401, sends the request once more with a new token.
+        Reports the latency (retries included) to metrics if set.
+        Returns a tuple (HTTP status or None if no response, content, reason)"""
+        if not authenticate:
+            return await self.__timed_request(method, url, retry_post, api, **kwargs)
+        token = await self.get_token()
+        if token is not None:
+            kwargs["headers"]["Authorization"] = f"{token['token_type']} {token['access_token']}"
+        status, content, reason = await self.__timed_request(method, url, retry_post, api, **kwargs)
+        if status == 401:
+            new_token = await self.get_token(refused=token)
+            if new_token is not None and new_token is not token:
+                self.log.debug(f"{api.name} Token refused, retrying with a new token")
+                kwargs["headers"]["Authorization"] = f"{new_token['token_type']} {new_token['access_token']}"
+                status, content, reason = await self.__timed_request(method, url, retry_post, api, **kwargs)
+        return status, content, reason
+
+    async def __timed_request(self, method:str, url:str, retry_post:bool=False, api:Api_Name=None, **kwargs):
+        start = time.perf_counter()
+        status, content, reason = await self.__send_with_retries(method, url, retry_post, **kwargs)
+        if self.metrics is not None:
+            record_request_metrics(self.metrics, api, time.perf_counter() - start, status)
+        return status, content, reason
+
+    async def __send_with_retries(self, method:str, url:str, retry_post:bool=False, **kwargs):
+        attempt = 0
+        while True:
+            status, content, reason = None, None, None
+            try:
+                async with self.semaphore:
+                    if self.limiter is None:
+                        status, content, reason = await self.__send_once(method, url, **kwargs)
+                    else:
+                        async with self.limiter.async_slot() as outcome:
+                            status, content, reason = await self.__send_once(method, url, **kwargs)
+                            outcome["status"] = status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                reason = f"{type(e).__name__} {e} || Method : {method} || URL : {url}"
+            can_retry = method != "POST" or retry_post
+            if not can_retry or attempt >= self.max_retries or (status is not None and status not in RETRY_STATUS_CODES):
+                return status, content, reason
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    async def __send_once(self, method:str, url:str, **kwargs):
+        async with self.session.request(method, url, **kwargs) as r:
+            content = await r.read()
+            return r.status, content, f"{r.reason} || Method : {method} || URL : {url}"
+
+    def __check_response(self, api:Api_Name, status:int|None, content:bytes, reason:str, not_found:Errors|None) -> bytes|Errors:
+        """Returns the content, or the Errors matching the response"""
+        if status is not None and status < 400:
+            return content
+        self.log.error(f"{api.name} Generic exception. HTTP Status : {status} || Reason : {reason}")
+        if status == 404 and not_found is not None:
+            return not_found
+        return Errors.GENERIC_REQUEST_ERROR
+
+    # ---------- API methods ----------
+
+    # ----- Authorities -----
+    async def get_auth(self, id:str, format:Content_Type=Content_Type.RAW_MARC) -> bytes|Errors:
+        """Returns the authority record WITHOUT decoding it.
+        If an error occurred, returns an Errors element"""
+        api = Api_Name.GET_AUTH
+        auth_id = validate_bibnb(id)
+        if auth_id == None:
+            self.log.error(f"{api.name} Invalid input authority ID ({id})")
+            return Errors.INVALID_AUTH_ID
+        content_type = validate_content_type(format)
+        cached = get_cached_record(self.cache, self.metrics, "authorities", auth_id, content_type)
+        if cached is not None:
+            self.log.debug(f"{api.name} Authority {id} retrieved from cache")
+            return cached
+        if self.cache_only:
+            self.log.error(f"{api.name} Authority {id} is not in the cache")
+            return Errors.RECORD_NOT_IN_CACHE
+        headers = {}
+        headers["accept"] = content_type.value
+        output = self.__check_response(api, *await self.__request("GET", f"{self.endpoint}authorities/{auth_id}", api=api, headers=headers), Errors.AUTHORIRY_DOES_NOT_EXIST)
+        if type(output) != Errors:
+            self.log.debug(f"{api.name} Authority {id} retrieved")
+            if self.cache is not None:
+                self.cache.put("authorities", auth_id, content_type.value, output)
+        return output
+
+    async def list_auth(self, query:Dict={}, format:Content_Type=Content_Type.RAW_MARC, page:int=1, nb_res:int=40, auth_type:str=None) -> bytes|Errors:
+        """Returns a list of authorities WITHOUT decoding them.
+        If an error occurred, returns an Errors element
+        
+        If an authority type is provided in the query, will use this one"""
+        api = Api_Name.GET_AUTH_LIST
+        content_type = validate_content_type(format)
+        page = validate_int(page, default=1)
+        nb_res = validate_int(nb_res, default=1)
+        headers = {}
+        headers["accept"] = content_type.value
+        params = {
+            "_page":page,
+            "_per_page":nb_res
+        }
+        data = {}
+        # If query is a dict, use it as body
+        if type(query) == dict:
+            data = dict(query)
+        # If an auth type is provided and none was provided in the query, adds it
+        if auth_type:
+            add_to_dict_if_inexistent(data, "framework_id", str(auth_type))
+        output = self.__check_response(api, *await self.__request("GET", f"{self.endpoint}authorities", api=api, headers=headers, data=data, params=params), None)
+        if type(output) != Errors:
+            self.log.debug(f"{api.name} Authority list retrieved")
+        return output
+
+    # ----- Biblios -----
+
+    async def get_biblio(self, id:str, format:Content_Type=Content_Type.RAW_MARC) -> bytes|Errors:
+        """Returns the record WITHOUT decoding it.
+        If an error occurred, returns an Errors element"""
+        api = Api_Name.GET_BIBLIO
+        bibnb = validate_bibnb(id)
+        if bibnb == None:
+            self.log.error(f"{api.name} Invalid input biblionumber ({id})")
+            return Errors.INVALID_BIBNB
+        content_type = validate_content_type(format)
+        cached = get_cached_record(self.cache if self.read_cached_biblios else None, self.metrics, "biblios", bibnb, content_type)
+        if cached is not None:
+            self.log.debug(f"{api.name} Record {id} retrieved from cache")
+            return cached
+        if self.cache_only:
+            self.log.error(f"{api.name} Record {id} is not in the cache")
+            return Errors.RECORD_NOT_IN_CACHE
+        headers = {}
+        headers["accept"] = content_type.value
+        output = self.__check_response(api, *await self.__request("GET", f"{self.endpoint}biblios/{bibnb}", api=api, headers=headers), Errors.RECORD_DOES_NOT_EXIST)
+        if type(output) != Errors:
+            self.log.debug(f"{api.name} Record {id} retrieved")
+            if self.cache is not None:
+                self.cache.put("biblios", bibnb, content_type.value, output)
+        return output
+
+    async def __post_biblio(self, api:Api_Name, record:str, format:Content_Type=Content_Type.RAW_MARC, record_schema:Record_Schema=Record_Schema.UNIMARC, framework_id:str=None, id:str=None) -> bytes|Errors:
+        """Private function for add & update biblio.
+        Returns the API repsonse content (or an error), see KohaRESTAPIClient for arguments"""
+        api = validate_api_name(api)
+        if api == None or api not in [
+            Api_Name.ADD_BIBLIO,
+            Api_Name.UPDATE_BIBLIO
+            ]:
+            return Errors.API_NOT_SUPPORTED
+        content_type = validate_content_type(format, default=False)
+        if content_type == None or content_type in [
+            Content_Type.JSON,
+            Content_Type.RAW_TEXT
+            ]:
+            return Errors.CONTENT_TYPE_NOT_SUPPORTED
+        record_schema = validate_record_schema(record_schema, default=False)
+        if record_schema == None:
+            return Errors.RECORD_SCHEMA_NOT_SUPPORTED
+        url = f"{self.endpoint}biblios"
+        method = "POST"
+        if api == Api_Name.UPDATE_BIBLIO:
+            bibnb = validate_bibnb(id)
+            if bibnb == None:
+                self.log.error(f"{api.name} Invalid input biblionumber ({id})")
+                return Errors.INVALID_BIBNB
+            url = url + f"/{bibnb}"
+            method = "PUT"
+        # Without Koha, nothing is sent
+        if self.cache_only:
+            self.log.debug(f"{api.name} Cache only, record was not sent")
+            return Errors.RECORD_NOT_SENT_CACHE_ONLY
+        headers = {}
+        headers["Content-type"] = content_type.value
+        headers["x-record-schema"] = record_schema.value
+        if framework_id:
+            headers["x-framework-id"] = framework_id
+        output = self.__check_response(api, *await self.__request(method, url, api=api, headers=headers, data=record), Errors.RECORD_DOES_NOT_EXIST)
+        if type(output) != Errors:
+            if api == Api_Name.UPDATE_BIBLIO:
+                self.log.debug(f"{api.name} Record {id} updated")
+                # The cached record is outdated
+                if self.cache is not None:
+                    self.cache.invalidate("biblios", bibnb)
+            else:
+                self.log.debug(f"{api.name} Record added")
+        return output
+
+    async def add_biblio(self, record:str, format:Content_Type=Content_Type.RAW_MARC, record_schema:Record_Schema=Record_Schema.UNIMARC, framework_id:str=None) -> bytes|Errors:
+        """Add a new biblio record to Koha
+        Returns the API repsonse content (or an error)"""
+        return await self.__post_biblio(Api_Name.ADD_BIBLIO, record=record, format=format, record_schema=record_schema, framework_id=framework_id)
+
+    async def update_biblio(self, id:str, record:str, format:Content_Type=Content_Type.RAW_MARC, record_schema:Record_Schema=Record_Schema.UNIMARC, framework_id:str=None) -> bytes|Errors:
+        """Update a biblio record in Koha 
+        Returns the API repsonse content (or an error)"""
+        return await self.__post_biblio(Api_Name.UPDATE_BIBLIO, record=record, format=format, record_schema=record_schema, framework_id=framework_id, id=id)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import List
+
+# Internal import
+from api.cl_log import Logger, Level
+
+def percentile(values:List[float], pct:float) -> float:
+    """Returns the nearest-rank percentile (pct between 0 and 100) of a list of values.
+    Returns 0 if the list is empty"""
+    if len(values) < 1:
+        return 0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+def is_server_error(status:int|None) -> bool:
+    """Returns if the HTTP status means the server is struggling.
+    None (no response) counts as an error"""
+    return status is None or status == 429 or status >= 500
+
+class Adaptive_Limiter(object):
+    """Adaptive_Limiter
+    =======
+    Limits the number of requests in flight, adapting the limit to the server health (AIMD) :
+    - every window_size requests, if the p95 latency is above target_latency or the error rate
+    (429, 5XX, no response) is above error_rate_threshold, the limit is multiplied by decrease_factor
+    - else, the limit is increased by 1
+
+    Also acts as a circuit breaker : if the error rate of a window reaches breaker_error_rate,
+    all requests are paused for breaker_cooldown seconds, then restart with the minimum limit.
+
+    Threads use slot() & coroutines async_slot(), a limiter must only be shared by the coroutines of a single event loop.
+
+    Decisions are logged if a Logger is provided"""
+    def __init__(self, logger:Logger=None, min_limit:int=1, max_limit:int=32, initial_limit:int=4,
+                 target_latency:float=2, error_rate_threshold:float=0.05, decrease_factor:float=0.5, window_size:int=50,
+                 breaker_error_rate:float=0.5, breaker_cooldown:float=60) -> None:
+        self.log = logger
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = min(max(initial_limit, self.min_limit), self.max_limit)
+        self.target_latency = target_latency
+        self.error_rate_threshold = error_rate_threshold
+        self.decrease_factor = decrease_factor
+        self.window_size = max(window_size, 1)
+        self.breaker_error_rate = breaker_error_rate
+        self.breaker_cooldown = breaker_cooldown
+        self.in_flight = 0
+        self.open_until = 0
+        self.__latencies:List[float] = []
+        self.__nb_errors = 0
+        self.__condition = threading.Condition()
+        # Created by the first coroutine, as it must be bound to the running event loop
+        self.__released:asyncio.Event = None
+
+    @contextmanager
+    def slot(self):
+        """Waits for a free slot, then yields a dict in which the caller must set the "status" key
+        to the HTTP status of the response (or None if no response was received)"""
+        self.acquire()
+        outcome = {"status":None}
+        start = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            self.release(time.perf_counter() - start, outcome["status"])
+
+    def acquire(self):
+        """Blocks until the circuit breaker is closed and a slot is free"""
+        with self.__condition:
+            while True:
+                wait = self.open_until - time.monotonic()
+                if wait > 0:
+                    self.__condition.wait(wait)
+                    continue
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self.__condition.wait()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """Same as slot(), for coroutines"""
+        await self.acquire_async()
+        outcome = {"status":None}
+        start = time.perf_counter()
+        try:
+            yield outcome
+        finally:
+            self.release(time.perf_counter() - start, outcome["status"])
+
+    async def acquire_async(self):
+        """Same as acquire(), waiting without blocking the event loop"""
+        if self.__released is None:
+            self.__released = asyncio.Event()
+        while True:
+            with self.__condition:
+                wait = self.open_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            # No await between the check & the clear, so a release can not be missed
+            self.__released.clear()
+            await self.__released.wait()
+
+    def release(self, latency:float, status:int|None):
+        """Frees a slot and records the request outcome"""
+        with self.__condition:
+            self.in_flight -= 1
+            self.__latencies.append(latency)
+            if is_server_error(status):
+                self.__nb_errors += 1
+            if len(self.__latencies) >= self.window_size:
+                self.__adapt()
+            self.__condition.notify_all()
+        if self.__released is not None:
+            self.__released.set()
+
+    def __adapt(self):
+        """Updates the limit at the end of a window. Must be called while holding the condition"""
+        p95 = percentile(self.__latencies, 95)
+        error_rate = self.__nb_errors / len(self.__latencies)
+        self.__latencies = []
+        self.__nb_errors = 0
+        stats = f"p95 : {p95:.3f}s, error rate : {error_rate:.1%}"
+        old_limit = self.limit
+        # Circuit breaker
+        if error_rate >= self.breaker_error_rate:
+            self.open_until = time.monotonic() + self.breaker_cooldown
+            self.limit = self.min_limit
+            self.__log(Level.CRITICAL, f"Adaptive limiter : circuit breaker opened for {self.breaker_cooldown}s", f"{stats}, limit {old_limit} -> {self.limit}")
+            return
+        # Multiplicative decrease
+        if error_rate > self.error_rate_threshold or p95 > self.target_latency:
+            self.limit = max(int(self.limit * self.decrease_factor), self.min_limit)
+            if self.limit != old_limit:
+                self.__log(Level.WARNING, "Adaptive limiter : decreasing limit", f"{old_limit} -> {self.limit} ({stats})")
+            return
+        # Additive increase
+        self.limit = min(self.limit + 1, self.max_limit)
+        if self.limit != old_limit:
+            self.__log(Level.DEBUG, "Adaptive limiter : increasing limit", f"{old_limit} -> {self.limit} ({stats})")
+
+    def __log(self, level:Level, msg:str, data):
+        if self.log is not None:
+            self.log.message_data(level, msg, data)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+# Internal import
+from api.Koha_REST_API_Client import KohaRESTAPIClient, Content_Type, Errors, split_raw_marc_records, get_raw_marc_control_field
+
+# Tags of the subfields read as authority type : Koha authtypecode in UNIMARC (152$b) & MARC21 (942$a)
+AUTH_TYPE_SUBFIELDS = [("152", "b"), ("942", "a")]
+
+# ----------------- Func def -----------------
+def get_raw_subfields(raw_record:bytes, tags:Tuple[str, ...]) -> Tuple[str|None, list]:
+    """Returns the tag & subfields (list of (code, value)) of the first field of a raw MARC (ISO 2709) record
+    whose tag starts with one of the tags prefixes, WITHOUT parsing the whole record.
+    Returns (None, []) if there is no such field or the record is malformed"""
+    try:
+        base_address = int(raw_record[12:17])
+        directory = raw_record[24:base_address - 1]
+        for pos in range(0, len(directory) - 11, 12):
+            tag = directory[pos:pos + 3].decode("ascii")
+            if not tag.startswith(tags) or tag < "010":
+                continue
+            length = int(directory[pos + 3:pos + 7])
+            start = base_address + int(directory[pos + 7:pos + 12])
+            # Removes the field terminator, 1st element is the indicators
+            subfields = raw_record[start:start + length - 1].split(b"\x1f")[1:]
+            return tag, [(subfield[:1].decode("utf-8", errors="replace"), subfield[1:].decode("utf-8", errors="replace")) for subfield in subfields if subfield]
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return None, []
+
+def get_raw_heading(raw_record:bytes) -> Tuple[str, str]:
+    """Returns the (type, heading) of a raw authority record.
+    The heading is the 1st 2XX (UNIMARC) or 1XX (MARC21) field letter subfields.
+    The type is the Koha authority type (152$b or 942$a), or the heading tag"""
+    tag, subfields = get_raw_subfields(raw_record, ("2",))
+    if tag is None:
+        tag, subfields = get_raw_subfields(raw_record, ("1",))
+    heading = " ".join(value for code, value in subfields if code.isalpha())
+    auth_type = tag or ""
+    for type_tag, type_code in AUTH_TYPE_SUBFIELDS:
+        type_subfields = get_raw_subfields(raw_record, (type_tag,))[1]
+        for code, value in type_subfields:
+            if code == type_code and value:
+                return value, heading
+    return auth_type, heading
+
+def clean(value:str) -> str:
+    """Removes tabulations & line feeds from a value written to the index file"""
+    return value.replace("\t", " ").replace("\n", " ").replace("\r", " ")
+
+def get_index_age(file_path:str) -> float|None:
+    """Returns the number of seconds since the index file was written, or None if it does not exist"""
+    if not os.path.exists(file_path):
+        return None
+    return time.time() - os.path.getmtime(file_path)
+
+# ----------------- Class def -----------------
+class Authority_Index(object):
+    """Authority_Index
+    =======
+    In-memory index of the authorities existing in Koha : authority ID -> (type, heading).
+    Built by paging the authority list API (see build()), and optionally saved to / loaded from a file
+    (one authority per line : ID, type & heading separated by tabulations).
+    Supports `auth_id in index` with the authority ID as a str, bytes or int"""
+    HEADER = "# KRSD authority index"
+
+    def __init__(self) -> None:
+        self.authorities:Dict[int, Tuple[str, str]] = {}
+
+    def __contains__(self, auth_id:str|bytes|int) -> bool:
+        try:
+            return int(auth_id) in self.authorities
+        except (TypeError, ValueError):
+            return False
+
+    def __len__(self) -> int:
+        return len(self.authorities)
+
+    def get(self, auth_id:str|bytes|int) -> Tuple[str, str]|None:
+        """Returns the (type, heading) of an authority, or None if it does not exist"""
+        try:
+            return self.authorities.get(int(auth_id))
+        except (TypeError, ValueError):
+            return None
+
+    def add_auth_list_to_index(self, raw_authority_list:bytes) -> int:
+        """Adds the records of a raw MARC authority list (like KohaRESTAPIClient.list_auth() content).
+        Returns the number of records in the list"""
+        raw_records = split_raw_marc_records(raw_authority_list)
+        for raw_record in raw_records:
+            auth_id = get_raw_marc_control_field(raw_record, "001")
+            try:
+                self.authorities[int(auth_id)] = get_raw_heading(raw_record)
+            except (TypeError, ValueError):
+                continue
+        return len(raw_records)
+
+    def build(self, koha:KohaRESTAPIClient, per_page:int=1000, prefetch:int=2, log=None) -> bool:
+        """Adds all the authorities of Koha, by pages of per_page authorities.
+        The next prefetch pages are requested while the current one is read.
+        Koha may return less than per_page authorities per page (its maximum page size) :
+        pages are read until an empty page, or until the number of authorities announced by Koha (X-Total-Count) is read.
+        log [opt] is a function receiving progress & error messages.
+        Returns False if a page could not be retrieved, or if the number of authorities read
+        does not match X-Total-Count : the index is then incomplete"""
+        per_page = max(per_page, 1)
+        prefetch = max(prefetch, 1)
+        total = None
+        nb_read = 0
+        with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="auth_index") as executor:
+            def request(page:int):
+                return executor.submit(koha.list_auth, page=page, nb_res=per_page, format=Content_Type.RAW_MARC, with_total=True)
+            pending = {page:request(page) for page in range(1, prefetch + 1)}
+            page = 1
+            try:
+                while True:
+                    response = pending.pop(page).result()
+                    if type(response) == Errors:
+                        if log is not None:
+                            log(f"Failed to retrieve authorities page {page} : {response.name}")
+                        return False
+                    content, page_total = response
+                    if total is None:
+                        total = page_total
+                    nb_records = self.add_auth_list_to_index(content)
+                    nb_read += nb_records
+                    # Last page
+                    if nb_records == 0 or (total is not None and nb_read >= total):
+                        break
+                    if log is not None and page % 100 == 0:
+                        log(f"{len(self.authorities)} authorities indexed ({page} pages)")
+                    pending[page + prefetch] = request(page + prefetch)
+                    page += 1
+            finally:
+                for future in pending.values():
+                    future.cancel()
+        if total is not None and nb_read != total:
+            if log is not None:
+                log(f"{nb_read} authorities retrieved but Koha announced {total} : the authority index is incomplete")
+            return False
+        return True
+
+    def save(self, file_path:str):
+        """Writes the index to a file, replacing it at once"""
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8", newline="\n") as f:
+            f.write(f"{self.HEADER}\n")
+            for auth_id, (auth_type, heading) in self.authorities.items():
+                f.write(f"{auth_id}\t{clean(auth_type)}\t{clean(heading)}\n")
+        os.replace(temp_path, file_path)
+
+    def load(self, file_path:str):
+        """Adds the authorities of a file written by save().
+        Raises ValueError if it is not an authority index"""
+        with open(file_path, "r", encoding="utf-8", newline="\n") as f:
+            if f.readline().rstrip("\n") != self.HEADER:
+                raise ValueError(f"{file_path} is not an authority index")
+            for line in f:
+                auth_id, auth_type, heading = line.rstrip("\n").split("\t", 2)
+                self.authorities[int(auth_id)] = (auth_type, heading)
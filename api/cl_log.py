@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*- 
 
 # External import
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from enum import Enum
 
 class Level(Enum):
@@ -12,32 +14,126 @@ class Level(Enum):
     ERROR = 3
     CRITICAL = 4
 
+# Matching logging module levels
+LOGGING_LEVELS = {
+    Level.DEBUG:logging.DEBUG,
+    Level.INFO:logging.INFO,
+    Level.WARNING:logging.WARNING,
+    Level.ERROR:logging.ERROR,
+    Level.CRITICAL:logging.CRITICAL
+}
+
+def get_level(name:str|Level|None, default:Level=Level.INFO) -> Level:
+    """Returns the Level matching a name (DEBUG, INFO, etc.).
+    Returns default if the name is not a level"""
+    if type(name) == Level:
+        return name
+    if type(name) != str or not name.strip().upper() in Level.__members__:
+        return default
+    return Level[name.strip().upper()]
+
+def render_message(msg, args:tuple=()) -> str:
+    """Returns the message : calls msg if it is a function, else formats it with args (%-style)"""
+    if callable(msg):
+        return msg()
+    if args:
+        return msg % args
+    return msg
+
+class Queue_Policy(Enum):
+    BLOCK = "block"
+    DROP = "drop"
+
+def get_queue_policy(name:str|Queue_Policy|None, default:Queue_Policy=Queue_Policy.BLOCK) -> Queue_Policy:
+    """Returns the Queue_Policy matching a name (block or drop).
+    Returns default if the name is not a policy"""
+    if type(name) == Queue_Policy:
+        return name
+    for policy in Queue_Policy:
+        if type(name) == str and name.strip().lower() == policy.value:
+            return policy
+    return default
+
+class Bounded_Queue_Handler(QueueHandler):
+    """QueueHandler with a bounded queue : when the queue is full, either waits for
+    the listener to free a slot (BLOCK) or drops the record & counts it (DROP)"""
+    def __init__(self, log_queue:queue.Queue, policy:Queue_Policy=Queue_Policy.BLOCK) -> None:
+        super().__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+
+    def enqueue(self, record:logging.LogRecord):
+        if self.policy == Queue_Policy.BLOCK:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 class Logger(object):# From FCR
-    def __init__(self, path:str, name:str) -> None:
+    def __init__(self, path:str, name:str, level:str|Level="DEBUG", console_level:str|Level=None,
+                 use_queue:bool=False, queue_size:int=10000, queue_policy:str|Queue_Policy=Queue_Policy.BLOCK) -> None:
+        """If use_queue is True, log records are put in a bounded queue & written to the file
+        and the console by a background thread, so logging never waits for disk / console writes
+        (unless the queue is full with policy BLOCK). The queue is flushed at exit.
+        console_level defaults to level"""
         self.name = name
-        self.__init_logs(path, name, "DEBUG")
+        self.level = get_level(level, Level.DEBUG)
+        self.console_level = get_level(console_level, self.level)
+        self.queue_handler:Bounded_Queue_Handler = None
+        self.listener:QueueListener = None
+        self.__init_logs(path, name, self.level, self.console_level, use_queue, queue_size, get_queue_policy(queue_policy))
         self.logger = logging.getLogger(name)
 
-    def __init_logs(self, logsrep,programme,niveau):
+    def __init_logs(self, logsrep,programme,niveau:Level, console_level:Level, use_queue:bool, queue_size:int, queue_policy:Queue_Policy):
         # logs.py by @louxfaure, check file for more comments
         # D'aprés http://sametmax.com/ecrire-des-logs-en-python/
         logsfile = logsrep + "/" + programme + ".log"
         logger = logging.getLogger(programme)
-        logger.setLevel(getattr(logging, niveau))
+        logger.setLevel(min(LOGGING_LEVELS[niveau], LOGGING_LEVELS[console_level]))
         # Formatter
         formatter = logging.Formatter(u'%(asctime)s :: %(levelname)s :: %(message)s')
         file_handler = RotatingFileHandler(logsfile, 'a', 10000000, 1, encoding="utf-8")
-        file_handler.setLevel(getattr(logging, niveau))
+        file_handler.setLevel(LOGGING_LEVELS[niveau])
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
         # For console
         stream_handler = logging.StreamHandler()
-        stream_handler.setLevel(getattr(logging, niveau))
+        stream_handler.setLevel(LOGGING_LEVELS[console_level])
         stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+        self.handlers = [file_handler, stream_handler]
+        if use_queue:
+            # Handlers are called by the listener thread
+            self.queue_handler = Bounded_Queue_Handler(queue.Queue(max(queue_size, 1)), queue_policy)
+            self.listener = QueueListener(self.queue_handler.queue, file_handler, stream_handler, respect_handler_level=True)
+            logger.addHandler(self.queue_handler)
+            self.listener.start()
+        else:
+            logger.addHandler(file_handler)
+            logger.addHandler(stream_handler)
+        # Flush everything at exit, even after an uncaught exception
+        atexit.register(self.close)
 
         logger.info('Logger initialised')
 
+    def close(self):
+        """Writes all queued log records & closes the handlers.
+        Can be called multiple times"""
+        logger = logging.getLogger(self.name)
+        if self.listener is not None:
+            if self.queue_handler.dropped > 0:
+                # Make sure this one is written
+                self.queue_handler.policy = Queue_Policy.BLOCK
+                logger.warning(f"{self.queue_handler.dropped} log records were dropped because the log queue was full")
+            logger.removeHandler(self.queue_handler)
+            # Processes all records already in the queue before stopping
+            self.listener.stop()
+            self.listener = None
+        for handler in self.handlers:
+            logger.removeHandler(handler)
+            handler.close()
+        self.handlers = []
+
     # ---------- basics ----------
 
     def debug(self, msg:str):
@@ -62,6 +158,10 @@ class Logger(object):# From FCR
 
     # ---------- Advanced ----------
 
+    def is_enabled(self, level:Level) -> bool:
+        """Returns if a message at this level would be logged"""
+        return self.logger.isEnabledFor(LOGGING_LEVELS[level])
+
     def __msg_to_level(self, level:Level, msg:str):
         """Internal function that calls the rigth log function"""
         if level == Level.DEBUG:
@@ -75,16 +175,26 @@ class Logger(object):# From FCR
         elif level == Level.CRITICAL:
             self.logger.critical(msg)
 
-    def record_message(self, level:Level, index:int, id:str|None, msg:str):
+    def record_message(self, level:Level, index:int, id:str|None, msg:str, *args):
         """Log at wanted level with the record index and ID before the message.
-        The ID can be None"""
+        The ID can be None.
+        The message is only built if the level is enabled : msg can be a function returning the message,
+        or a %-style format string used with args"""
+        if not self.is_enabled(level):
+            return
+        msg = render_message(msg, args)
         output = f"Index {index} : {msg}"
         if id != None:
             output = f"ID {id} (index : {index}) : {msg}"
         self.__msg_to_level(level, output)
 
     def message_data(self, level:Level, msg:str, data):
-        """Log at wanted level a msg and data separated by :"""
+        """Log at wanted level a msg and data separated by :
+        data can be a function returning the data, only called if the level is enabled"""
+        if not self.is_enabled(level):
+            return
+        if callable(data):
+            data = data()
         self.__msg_to_level(level, f"{msg} : {data}")
 
     def big_message(self, level:Level, msg:str):
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import os
+import threading
+import time
+from typing import Dict, List
+
+class Journal(object):
+    """Journal
+    =======
+    Append-only file listing the outcome of each input index, so an interrupted run can be resumed.
+    The first line identifies the input, then each line is index;bibnb;outcome.
+    Lines are kept in memory, then written & fsynced by batches : every sync_every lines,
+    or sync_interval seconds after the last sync.
+
+    Each batch ends with a checkpoint line with the size of the output files (see watch()),
+    flushed & fsynced just before. On resume, lines after the last checkpoint are ignored
+    and restore_files() truncates the output files to their checkpoint size,
+    so the records of a lost batch are processed again without being written twice.
+    Can be used by multiple threads.
+
+    On init take as arguments :
+    - file_path : path of the journal
+    - input_name : name of the input (file path), a journal of another input can not be resumed
+    - [optional] resume : load the completed indexes of an existing journal & append to it.
+    Otherwise, the journal is overwritten
+    - [optional] sync_every : number of lines in a batch
+    - [optional] sync_interval : maximum number of seconds between two syncs
+    - [optional] retry_outcomes : outcomes written to the journal but not completing the index,
+    so a resumed run processes it again
+
+    Raises ValueError if the journal to resume is not for input_name"""
+    HEADER = "# KRSD journal;"
+    CHECKPOINT = "# checkpoint;"
+
+    def __init__(self, file_path:str, input_name:str, resume:bool=False, sync_every:int=100, sync_interval:float=1, retry_outcomes:List[str]=[]) -> None:
+        self.path = file_path
+        self.input_name = input_name
+        self.resume = resume
+        self.sync_every = max(sync_every, 1)
+        self.sync_interval = sync_interval
+        self.retry_outcomes = set(retry_outcomes)
+        self.lock = threading.Lock()
+        self.lines:List[str] = []
+        self.files = []
+        # Bitmap of completed indexes
+        self.completed = bytearray()
+        self.nb_completed = 0
+        # Size of each output file (by file name) at the last checkpoint
+        self.checkpoint_sizes:Dict[str, int] = {}
+        if resume and os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self.__load()
+        else:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(f"{self.HEADER}{self.input_name}\n")
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.last_sync = time.monotonic()
+
+    def __load(self):
+        """Loads the completed indexes up to the last checkpoint,
+        then removes the lines after it from the journal"""
+        with open(self.path, "rb") as f:
+            header = f.readline()
+            if header.decode("utf-8").rstrip("\n") != f"{self.HEADER}{self.input_name}":
+                raise ValueError(f"Journal {self.path} is not for {self.input_name} ({header.decode('utf-8').strip()})")
+            end = f.tell()
+            batch:List[int] = []
+            for line in f:
+                line = line.decode("utf-8")
+                # Ignore the end of the file if it was only partially written
+                if not line.endswith("\n"):
+                    break
+                if line.startswith(self.CHECKPOINT):
+                    for index in batch:
+                        self.__mark(index)
+                    batch = []
+                    self.checkpoint_sizes = {}
+                    for file_size in line[len(self.CHECKPOINT):].rstrip("\n").split(";"):
+                        name, _, size = file_size.rpartition("=")
+                        if name and size.isdigit():
+                            self.checkpoint_sizes[name] = int(size)
+                    end = f.tell()
+                elif line.split(";", 1)[0].isdigit():
+                    if line.rstrip("\n").rsplit(";", 1)[-1] not in self.retry_outcomes:
+                        batch.append(int(line.split(";", 1)[0]))
+        os.truncate(self.path, end)
+
+    def __mark(self, index:int):
+        byte, bit = divmod(index, 8)
+        if byte >= len(self.completed):
+            self.completed.extend(bytes(byte + 1 - len(self.completed)))
+        if not self.completed[byte] & (1 << bit):
+            self.completed[byte] |= 1 << bit
+            self.nb_completed += 1
+
+    def restore_files(self, paths:List[str]):
+        """When resuming, truncates the output files to their size at the last checkpoint.
+        Files without checkpoint size are emptied : none of their content is in the journal.
+        Must be called before opening them"""
+        if not self.resume:
+            return
+        for path in paths:
+            if os.path.exists(path) and os.path.getsize(path) > self.checkpoint_sizes.get(os.path.basename(path), 0):
+                os.truncate(path, self.checkpoint_sizes.get(os.path.basename(path), 0))
+
+    def watch(self, files:List):
+        """Sets the output files flushed before each sync.
+        They need a path attribute & a flush(sync) method (like api.report_sink.Report_Sink)"""
+        with self.lock:
+            self.files = files
+
+    def is_completed(self, index:int) -> bool:
+        """Returns if this index already has an outcome"""
+        byte, bit = divmod(index, 8)
+        return byte < len(self.completed) and self.completed[byte] & (1 << bit) != 0
+
+    def write(self, index:int, bibnb:int|None, outcome:str):
+        """Adds the outcome of an index"""
+        with self.lock:
+            self.lines.append(f"{index};{'' if bibnb is None else bibnb};{outcome}\n")
+            if not outcome in self.retry_outcomes:
+                self.__mark(index)
+            if len(self.lines) >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+                self.__sync()
+
+    def sync(self):
+        """Writes & fsyncs the pending lines"""
+        with self.lock:
+            self.__sync()
+
+    def close(self):
+        with self.lock:
+            self.__sync()
+            self.file.close()
+
+    def __sync(self):
+        if self.lines:
+            sizes = []
+            for file in self.files:
+                file.flush(sync=True)
+                sizes.append(f"{os.path.basename(file.path)}={os.path.getsize(file.path)}")
+            self.file.write("".join(self.lines) + self.CHECKPOINT + ";".join(sizes) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.lines = []
+        self.last_sync = time.monotonic()
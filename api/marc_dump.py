@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# External imports
+import os
+import pymarc
+import xml.etree.ElementTree as ET
+from enum import Enum
+from typing import BinaryIO
+
+MARCXML_NS = "http://www.loc.gov/MARC21/slim"
+LEADER_LENGTH = 24
+RECORD_TERMINATOR = b"\x1d"
+
+class Dump_Format(Enum):
+    ISO2709 = "mrc"
+    MARCXML = "xml"
+
+def detect_dump_format(path:str) -> Dump_Format:
+    """Returns the format of a MARC dump, MARCXML if the first non-blank character is a <"""
+    with open(path, "rb") as f:
+        start = f.read(1024).lstrip(b"\xef\xbb\xbf \t\r\n")
+    if start.startswith(b"<"):
+        return Dump_Format.MARCXML
+    return Dump_Format.ISO2709
+
+def read_to_terminator(f:BinaryIO) -> bytes:
+    """Returns the bytes of the stream up to the next record terminator (included) or the end of the stream"""
+    data = bytearray()
+    while True:
+        byte = f.read(1)
+        data += byte
+        if not byte or byte == RECORD_TERMINATOR:
+            return bytes(data)
+
+def iter_raw_marc_records(f:BinaryIO):
+    """Yields each record of an ISO 2709 stream as bytes WITHOUT parsing it.
+    Uses the record length in the leader, like pymarc.MARCReader.
+    White spaces between records (like line feeds) are ignored.
+
+    If the record length is not a number, is shorter than a leader or does not end on a record terminator,
+    the record is yielded up to the next record terminator, so the caller reports it as unparsable
+    & the next records are still read. Truncated records at the end of the stream are yielded as is"""
+    while True:
+        first_bytes = f.read(5)
+        # Skip white spaces between records
+        while first_bytes[:1].isspace():
+            first_bytes = first_bytes[1:] + f.read(1)
+        if len(first_bytes) < 5:
+            if first_bytes:
+                yield first_bytes
+            return
+        try:
+            length = int(first_bytes)
+        except ValueError:
+            length = 0
+        if length < LEADER_LENGTH:
+            yield first_bytes + read_to_terminator(f)
+            continue
+        data = first_bytes + f.read(length - 5)
+        if not data.endswith(RECORD_TERMINATOR):
+            end = data.find(RECORD_TERMINATOR)
+            # Length too long : the next record starts after the first terminator
+            if end != -1 and f.seekable():
+                f.seek(end + 1 - len(data), os.SEEK_CUR)
+                data = data[:end + 1]
+            # Length too short
+            elif end == -1:
+                data += read_to_terminator(f)
+        yield data
+
+def marcxml_element_to_record(element:ET.Element) -> pymarc.record.Record:
+    """Returns a pymarc Record from a MARCXML record element (with or without namespace)"""
+    record = pymarc.record.Record(to_unicode=True, force_utf8=True)
+    for child in element:
+        tag = child.tag.split("}")[-1]
+        if tag == "leader":
+            record.leader = pymarc.leader.Leader(child.text or "")
+        elif tag == "controlfield":
+            record.add_field(pymarc.field.Field(tag=child.get("tag"), data=child.text or ""))
+        elif tag == "datafield":
+            subfields = [pymarc.field.Subfield(code=subfield.get("code"), value=subfield.text or "") for subfield in child]
+            record.add_field(pymarc.field.Field(
+                tag=child.get("tag"),
+                indicators=pymarc.field.Indicators(child.get("ind1", " "), child.get("ind2", " ")),
+                subfields=subfields
+            ))
+    return record
+
+def iter_marcxml_elements(path:str):
+    """Yields each record element of a MARCXML file.
+    Streams the file : once the caller is done with it, each record is detached from the root,
+    else the root keeps every (cleared) record element"""
+    root = None
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if root is None:
+            root = element
+        if event == "end" and element.tag in [f"{{{MARCXML_NS}}}record", "record"]:
+            yield element
+            element.clear()
+            root.clear()
+
+def iter_marcxml_records(path:str):
+    """Yields each record of a MARCXML file as a pymarc Record.
+    Streams the file : each record element is freed once converted"""
+    for element in iter_marcxml_elements(path):
+        yield marcxml_element_to_record(element)
+
+def iter_marcxml_raw_records(path:str):
+    """Yields each record of a MARCXML file as MARCXML bytes WITHOUT converting it.
+    Streams the file : each record element is freed once serialised"""
+    for element in iter_marcxml_elements(path):
+        yield ET.tostring(element, encoding="utf-8")
+
+def marcxml_to_record(data:bytes) -> pymarc.record.Record:
+    """Returns a pymarc Record from a MARCXML record as bytes"""
+    return marcxml_element_to_record(ET.fromstring(data))
+
+def serialize_record(record:pymarc.record.Record, format:Dump_Format=Dump_Format.ISO2709) -> bytes:
+    """Returns the record as it must be written in a dump of this format"""
+    if format == Dump_Format.MARCXML:
+        return pymarc.record_to_xml(record, namespace=False) + b"\n"
+    return record.as_marc()
+
+class Marc_Dump_Writer(object):
+    """Writes records to a MARC file (ISO 2709 or MARCXML collection).
+    If append is True, records are added to an existing file
+    (for MARCXML, after removing the end of the collection if the file has one)"""
+    COLLECTION_END = b"</collection>\n"
+
+    def __init__(self, file_path:str, format:Dump_Format=Dump_Format.ISO2709, append:bool=False) -> None:
+        self.path = file_path
+        self.format = format
+        is_empty = not append or not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        if is_empty:
+            self.file = open(self.path, "wb")
+        else:
+            self.file = open(self.path, "r+b")
+            self.file.seek(0, os.SEEK_END)
+            if self.format == Dump_Format.MARCXML and self.file.tell() >= len(self.COLLECTION_END):
+                self.file.seek(-len(self.COLLECTION_END), os.SEEK_END)
+                if self.file.read() == self.COLLECTION_END:
+                    self.file.seek(-len(self.COLLECTION_END), os.SEEK_END)
+                    self.file.truncate()
+        if self.format == Dump_Format.MARCXML and is_empty:
+            self.file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<collection xmlns="{MARCXML_NS}">\n'.encode())
+
+    def write(self, record:pymarc.record.Record):
+        self.file.write(serialize_record(record, self.format))
+
+    def write_serialized(self, data:bytes):
+        """Writes a record already serialised with serialize_record()"""
+        self.file.write(data)
+
+    def flush(self, sync:bool=False):
+        """Writes the records to the file.
+        If sync is True, also asks the OS to write the file to disk"""
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.format == Dump_Format.MARCXML:
+            self.file.write(self.COLLECTION_END)
+        self.file.close()
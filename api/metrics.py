@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+# Internal import
+from api.adaptive_limiter import percentile
+from api.cl_log import Logger, Level
+
+class Timing(object):
+    """Latency histogram of one metric : exact count, total & maximum,
+    percentiles computed on a random sample of at most max_samples values"""
+    __slots__ = ("count", "total", "max", "samples", "max_samples")
+
+    def __init__(self, max_samples:int=10000) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples:List[float] = []
+        self.max_samples = max(max_samples, 1)
+
+    def observe(self, seconds:float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        # Reservoir sampling : every value has the same chance to be kept
+        if len(self.samples) < self.max_samples:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.max_samples:
+                self.samples[slot] = seconds
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count":self.count,
+            "total":round(self.total, 6),
+            "mean":round(self.total / self.count, 6) if self.count else 0,
+            "p50":round(percentile(self.samples, 50), 6),
+            "p95":round(percentile(self.samples, 95), 6),
+            "p99":round(percentile(self.samples, 99), 6),
+            "max":round(self.max, 6)
+        }
+
+class Metrics(object):
+    """Metrics
+    =======
+    Thread-safe counters & latency histograms (in seconds), identified by a name like api.GET_BIBLIO or stage.parse"""
+    def __init__(self, max_samples:int=10000) -> None:
+        self.start = time.time()
+        self.max_samples = max_samples
+        self.counters:Dict[str, int] = {}
+        self.timings:Dict[str, Timing] = {}
+        self.lock = threading.Lock()
+
+    def count(self, name:str, value:int=1):
+        """Increments a counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name:str, seconds:float):
+        """Adds a latency to a histogram"""
+        with self.lock:
+            if not name in self.timings:
+                self.timings[name] = Timing(self.max_samples)
+            self.timings[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name:str):
+        """Observes the time spent in the with block, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def summary(self) -> Dict:
+        """Returns all metrics as a dict that can be dumped as JSON"""
+        with self.lock:
+            return {
+                "start":time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start)),
+                "duration":round(time.time() - self.start, 3),
+                "counters":dict(sorted(self.counters.items())),
+                "timings":{name:self.timings[name].summary() for name in sorted(self.timings)}
+            }
+
+    def write_json(self, path:str, extra:Dict=None):
+        """Writes the summary (and extra keys) to a JSON file"""
+        summary = self.summary()
+        if extra:
+            summary.update(extra)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+    def write_prometheus(self, path:str, prefix:str="krsd"):
+        """Writes the metrics in Prometheus text format, for node exporter textfile collector.
+        Counters become <prefix>_<name>_total, histograms become <prefix>_<name>_seconds summaries.
+        The file is replaced atomically"""
+        summary = self.summary()
+        lines = [f"# TYPE {prefix}_duration_seconds gauge", f"{prefix}_duration_seconds {summary['duration']}"]
+        for name, value in summary["counters"].items():
+            metric = f"{prefix}_{prometheus_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, timing in summary["timings"].items():
+            metric = f"{prefix}_{prometheus_name(name)}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for quantile in ["50", "95", "99"]:
+                lines.append(f'{metric}{{quantile="0.{quantile}"}} {timing["p" + quantile]}')
+            lines += [f"{metric}_sum {timing['total']}", f"{metric}_count {timing['count']}"]
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+def prometheus_name(name:str) -> str:
+    """Returns the name with only characters allowed in Prometheus metric names"""
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name).lower()
+
+def format_duration(seconds:float) -> str:
+    """Returns a duration as H:MM:SS (hours can go above 24)"""
+    seconds = int(max(seconds, 0))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class Progress(object):
+    """Logs a progress line (records/s & ETA) at most every interval seconds.
+    total can be None if the number of records is unknown"""
+    def __init__(self, logger:Logger, metrics:Metrics, total:int|None=None, interval:float=30, prometheus_path:str=None) -> None:
+        self.log = logger
+        self.metrics = metrics
+        self.total = total
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def tick(self, nb:int=1):
+        """Adds nb records & logs the progress line if needed"""
+        with self.lock:
+            self.done += nb
+            now = time.monotonic()
+            if self.interval <= 0 or now - self.last_report < self.interval:
+                return
+            self.last_report = now
+        self.report()
+
+    def rate(self) -> float:
+        """Returns the number of records per second since start"""
+        elapsed = time.monotonic() - self.start
+        return self.done / elapsed if elapsed > 0 else 0
+
+    def report(self):
+        """Logs the progress line & updates the Prometheus file"""
+        rate = self.rate()
+        progress = f"{self.done} records, {rate:.1f} records/s"
+        if self.total:
+            eta = (self.total - self.done) / rate if rate > 0 else 0
+            progress = f"{self.done}/{self.total} records ({self.done / self.total:.1%}), {rate:.1f} records/s, ETA {format_duration(eta)}"
+        self.log.message_data(Level.INFO, "Progress", progress)
+        if self.prometheus_path:
+            self.metrics.write_prometheus(self.prometheus_path)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from enum import Enum
+from typing import List
+
+# Since Python 3.12, cProfile uses sys.monitoring : a single profile sees every thread
+# & enabling a second one raises ValueError
+SINGLE_PROFILE = sys.version_info >= (3, 12)
+
+class Profile_Mode(Enum):
+    NONE = ""
+    CPU = "cpu"
+    MEMORY = "memory"
+
+def get_profile_mode(name:str|None, default:Profile_Mode=Profile_Mode.NONE) -> Profile_Mode:
+    """Returns the Profile_Mode matching a name (cpu or memory).
+    Returns default if the name is not a mode"""
+    for mode in Profile_Mode:
+        if type(name) == str and mode != Profile_Mode.NONE and name.strip().lower() == mode.value:
+            return mode
+    return default
+
+class Profiler(object):
+    """Profiler
+    =======
+    Opt-in profiling of a script run, doing nothing with Profile_Mode.NONE :
+    - CPU : cProfile of the whole process, threads started after start() included.
+    Python 3.12+ uses a single profile for all threads. Older versions only profile the thread enabling a profile :
+    each new thread enables its own profile through threading.setprofile(), merged at the end.
+    Worker processes are never profiled.
+    Writes <name>.pstats & <name>_cpu.txt (top functions by cumulative & own time)
+    - MEMORY : tracemalloc. Every snapshot_every records (see tick()), logs the current & peak memory
+    since the previous line to <name>_memory.txt, then writes the top allocation sites at the end
+
+    Files are written in output_dir when stop() is called"""
+    def __init__(self, mode:Profile_Mode, output_dir:str, name:str, top:int=30, snapshot_every:int=1000) -> None:
+        self.mode = mode
+        self.output_dir = output_dir
+        self.name = name
+        self.top = max(top, 1)
+        self.snapshot_every = max(snapshot_every, 1)
+        self.profiles:List[cProfile.Profile] = []
+        self.nb_records = 0
+        self.memory_file = None
+        self.lock = threading.Lock()
+        self.start_time = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != Profile_Mode.NONE
+
+    def __path(self, suffix:str) -> str:
+        return os.path.join(self.output_dir, self.name + suffix)
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        if self.mode == Profile_Mode.CPU:
+            profile = cProfile.Profile()
+            self.profiles.append(profile)
+            profile.enable()
+            if not SINGLE_PROFILE:
+                threading.setprofile(self.__start_thread_profile)
+        elif self.mode == Profile_Mode.MEMORY:
+            tracemalloc.start(10)
+            self.memory_file = open(self.__path("_memory.txt"), "w", encoding="utf-8")
+            self.memory_file.write("records;elapsed_seconds;current_MiB;peak_MiB\n")
+
+    def __start_thread_profile(self, frame, event, arg):
+        """Profile function of new threads before Python 3.12 : replaces itself with a profile of this thread"""
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def tick(self, nb:int=1):
+        """Counts processed records. In MEMORY mode, writes a memory line every snapshot_every records"""
+        if self.mode != Profile_Mode.MEMORY:
+            return
+        with self.lock:
+            self.nb_records += nb
+            if self.nb_records % self.snapshot_every != 0:
+                return
+            self.__write_memory_line()
+
+    def __write_memory_line(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.memory_file.write(f"{self.nb_records};{time.perf_counter() - self.start_time:.3f};{current / 1048576:.2f};{peak / 1048576:.2f}\n")
+        self.memory_file.flush()
+        # Next line peak is the peak since this line
+        tracemalloc.reset_peak()
+
+    def stop(self) -> List[str]:
+        """Stops profiling & writes the reports.
+        Returns the paths of the written files"""
+        if self.mode == Profile_Mode.CPU:
+            return self.__stop_cpu()
+        if self.mode == Profile_Mode.MEMORY:
+            return self.__stop_memory()
+        return []
+
+    def __stop_cpu(self) -> List[str]:
+        if not SINGLE_PROFILE:
+            threading.setprofile(None)
+        self.profiles[0].disable()
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiles[0], stream=stream)
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats_path = self.__path(".pstats")
+        stats.dump_stats(stats_path)
+        stream.write(f"Profiled threads : {'all' if SINGLE_PROFILE else len(self.profiles)}\n\n---------- Top {self.top} by cumulative time ----------\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        stream.write(f"---------- Top {self.top} by own time ----------\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        report_path = self.__path("_cpu.txt")
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(stream.getvalue())
+        return [stats_path, report_path]
+
+    def __stop_memory(self) -> List[str]:
+        with self.lock:
+            self.__write_memory_line()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        self.memory_file.write(f"\n---------- Top {self.top} allocation sites still allocated at the end ----------\n")
+        for stat in snapshot.statistics("lineno")[:self.top]:
+            self.memory_file.write(f"{stat}\n")
+        self.memory_file.write(f"\n---------- Top {self.top} allocation sites by traceback ----------\n")
+        for stat in snapshot.statistics("traceback")[:self.top]:
+            self.memory_file.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+            for line in stat.traceback.format(limit=5):
+                self.memory_file.write(f"{line}\n")
+        self.memory_file.close()
+        return [self.__path("_memory.txt")]
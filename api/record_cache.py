@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import os
+import sqlite3
+import threading
+import time
+
+class Record_Cache(object):
+    """Record_Cache
+    =======
+    Local copy of records retrieved from Koha, stored in a single SQLite file.
+    Records are keyed by (endpoint, ID, content type), endpoint being "biblios" or "authorities".
+    Can be used by multiple threads, and by multiple processes opening the same file.
+
+    On init take as arguments :
+    - file_path : path of the SQLite file, created if needed
+    - [optional] ttl : number of seconds a record stays valid. 0 or less keeps records until evicted
+    - [optional] max_size : maximum size of the cached records in bytes.
+    Least recently used records are evicted above it. 0 or less disables the limit"""
+    # Evicting down to this share of max_size avoids evicting again at the next record
+    EVICT_TO = 0.9
+
+    def __init__(self, file_path:str, ttl:float=3600, max_size:int=1073741824) -> None:
+        self.path = file_path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Autocommit : each statement is its own transaction
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # It's a cache : losing the last records on a power failure is fine
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS records (
+            endpoint TEXT NOT NULL,
+            id TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            content BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (endpoint, id, content_type))""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS records_accessed ON records (accessed)")
+        # Approximative if other processes use the same file, recomputed before evicting
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM records").fetchone()[0]
+
+    def get(self, endpoint:str, id:str, content_type:str) -> bytes|None:
+        """Returns the cached record, or None if it is not cached or expired"""
+        key = (endpoint, str(id), content_type)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT content, created FROM records WHERE endpoint = ? AND id = ? AND content_type = ?", key).fetchone()
+            if row is not None and self.ttl > 0 and row[1] < now - self.ttl:
+                self.db.execute("DELETE FROM records WHERE endpoint = ? AND id = ? AND content_type = ?", key)
+                self.size -= len(row[0])
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE records SET accessed = ? WHERE endpoint = ? AND id = ? AND content_type = ?", (now,) + key)
+            self.hits += 1
+            return bytes(row[0])
+
+    def put(self, endpoint:str, id:str, content_type:str, content:bytes):
+        """Stores a record, then evicts the least recently used ones if the cache is too big"""
+        if type(content) == str:
+            content = content.encode("utf-8")
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (endpoint, str(id), content_type, content, len(content), now, now))
+            self.size += len(content)
+            if self.max_size > 0 and self.size > self.max_size:
+                self.__evict()
+
+    def invalidate(self, endpoint:str, id:str):
+        """Removes a record in all content types"""
+        with self.lock:
+            self.db.execute("DELETE FROM records WHERE endpoint = ? AND id = ?", (endpoint, str(id)))
+
+    def __evict(self):
+        """Removes expired records, then the least recently used ones down to EVICT_TO * max_size"""
+        if self.ttl > 0:
+            self.db.execute("DELETE FROM records WHERE created < ?", (time.time() - self.ttl,))
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM records").fetchone()[0]
+        if self.size <= self.max_size:
+            return
+        # Most recently used records first : the first record above the limit & all older ones are removed
+        row = self.db.execute("""SELECT accessed FROM (
+                SELECT accessed, SUM(size) OVER (ORDER BY accessed DESC ROWS UNBOUNDED PRECEDING) AS total FROM records)
+            WHERE total > ? LIMIT 1""", (int(self.max_size * self.EVICT_TO),)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM records WHERE accessed <= ?", row)
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM records").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
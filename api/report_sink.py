@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from enum import Enum
+from typing import BinaryIO, Dict, List
+
+# Optional : only needed for Compression.ZSTD
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class Report_Format(Enum):
+    CSV = "csv"
+    JSONL = "jsonl"
+
+class Compression(Enum):
+    NONE = ""
+    GZIP = "gz"
+    ZSTD = "zst"
+
+def get_report_format(name:str|None, default:Report_Format=Report_Format.CSV) -> Report_Format:
+    """Returns the Report_Format matching a name (csv or jsonl).
+    Returns default if the name is not a format"""
+    for format in Report_Format:
+        if type(name) == str and name.strip().lower() == format.value:
+            return format
+    return default
+
+def get_compression(name:str|None, default:Compression=Compression.NONE) -> Compression:
+    """Returns the Compression matching a name (none, gzip or zstd).
+    Returns default if the name is not a compression"""
+    if type(name) != str:
+        return default
+    return {"none":Compression.NONE, "gzip":Compression.GZIP, "zstd":Compression.ZSTD}.get(name.strip().lower(), default)
+
+def open_compressed(path:str, compression:Compression=Compression.NONE, append:bool=False) -> BinaryIO:
+    """Opens a binary file for writing, compressed or not.
+    Appending to a compressed file adds a new gzip member / zstd frame, which readers handle"""
+    mode = "ab" if append else "wb"
+    if compression == Compression.GZIP:
+        return gzip.open(path, mode)
+    if compression == Compression.ZSTD:
+        if zstandard is None:
+            raise ImportError("zstd compression requires zstandard")
+        return zstandard.ZstdCompressor().stream_writer(open(path, mode), closefd=True)
+    return open(path, mode)
+
+def get_report_path(file_path:str, format:Report_Format=Report_Format.CSV, compression:Compression=Compression.NONE) -> str:
+    """Returns the path of a report file once its format & compression are applied"""
+    if format == Report_Format.JSONL:
+        file_path = os.path.splitext(file_path)[0] + ".jsonl"
+    if compression != Compression.NONE:
+        file_path += "." + compression.value
+    return file_path
+
+def fsync_file(f:BinaryIO):
+    """fsyncs the file under a (compressed) file object, if it has one"""
+    try:
+        os.fsync(f.fileno())
+    except (AttributeError, io.UnsupportedOperation, OSError):
+        pass
+
+class Report_Sink(object):
+    """Report_Sink
+    =======
+    Writes report rows (dicts) to a file, as ;-separated CSV or JSON lines, compressed or not.
+    Rows are serialised in memory and written to the file by blocks :
+    when the buffer reaches buffer_size characters, or flush_interval seconds after the last write to the file.
+    Can be used by multiple threads. Worker processes must send their rows to the main process.
+
+    On init take as arguments :
+    - file_path : path of the CSV file. With JSONL format, its extension is replaced by .jsonl.
+    Compressed files get an extra .gz or .zst extension
+    - headers : columns of the report, in order
+    - [optional] format : Report_Format
+    - [optional] compression : Compression
+    - [optional] write_header : write the CSV header (not written when appending to a non empty file)
+    - [optional] append : append to the file instead of overwriting it
+    - [optional] line_terminator : end of CSV lines"""
+    def __init__(self, file_path:str, headers:List[str], format:Report_Format=Report_Format.CSV,
+                 compression:Compression=Compression.NONE, buffer_size:int=1048576, flush_interval:float=5,
+                 write_header:bool=True, append:bool=False, line_terminator:str="\r\n") -> None:
+        self.format = format
+        self.compression = compression
+        self.headers = headers
+        self.path = get_report_path(file_path, format, compression)
+        self.buffer_size = max(buffer_size, 0)
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        # Do not write the header in the middle of a file
+        is_empty = not append or not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open_compressed(self.path, self.compression, append)
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, extrasaction="ignore", fieldnames=self.headers, delimiter=";", lineterminator=line_terminator)
+        self.last_flush = time.monotonic()
+        if self.format == Report_Format.CSV and write_header and is_empty:
+            self.writer.writeheader()
+
+    def write(self, row:Dict):
+        """Adds a row to the report"""
+        with self.lock:
+            self.__serialise(row)
+            self.__flush_if_needed()
+
+    def write_rows(self, rows:List[Dict]):
+        """Adds multiple rows to the report at once"""
+        with self.lock:
+            for row in rows:
+                self.__serialise(row)
+            self.__flush_if_needed()
+
+    def flush(self, sync:bool=False):
+        """Writes the buffer to the file.
+        If sync is True, also asks the OS to write the file to disk"""
+        with self.lock:
+            self.__flush()
+            if sync:
+                fsync_file(self.file)
+
+    def close(self):
+        with self.lock:
+            self.__flush()
+            self.file.close()
+
+    def __serialise(self, row:Dict):
+        if self.format == Report_Format.JSONL:
+            self.buffer.write(json.dumps({key:row.get(key) for key in self.headers}, ensure_ascii=False) + "\n")
+        else:
+            # Use str to prevent crash if I'm stupid when coding
+            self.writer.writerow({key:str(row.get(key)) for key in self.headers})
+
+    def __flush_if_needed(self):
+        if self.buffer.tell() >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.__flush()
+
+    def __flush(self):
+        data = self.buffer.getvalue()
+        if data:
+            self.file.write(data.encode("utf-8"))
+            self.file.flush()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        self.last_flush = time.monotonic()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# External import
+import os
+import sqlite3
+import threading
+import time
+from enum import Enum
+from typing import Dict, List, Tuple
+
+# Internal import
+from api.Koha_REST_API_Client import get_raw_marc_control_field
+
+# ----------------- Enum def -----------------
+class Run_Mode(Enum):
+    RUN = "run"
+    PLAN = "plan"
+    APPLY = "apply"
+
+class Staged_Status(Enum):
+    PLANNED = "planned"
+    APPLIED = "applied"
+    # The record was edited in Koha after it was staged
+    CHANGED = "changed"
+    ERROR = "error"
+
+# ----------------- Func def -----------------
+def get_run_mode(name:str|None, default:Run_Mode=Run_Mode.RUN) -> Run_Mode:
+    """Returns the Run_Mode matching a name (run, plan or apply).
+    Returns default if the name is not a mode"""
+    for mode in Run_Mode:
+        if type(name) == str and name.strip().lower() == mode.value:
+            return mode
+    return default
+
+def format_diff(deleted_fields:List[Tuple[str, str, str, str]]) -> str:
+    """Returns the deleted fields of a record (like Record_Report.deleted_fields) as text,
+    each deleted field followed by the field kept instead"""
+    lines = []
+    for tag, auth_id, field, replaced_by in deleted_fields:
+        lines.append(f"- {field}")
+        lines.append(f"  kept : {replaced_by}")
+    return "\n".join(lines)
+
+# ----------------- Class def -----------------
+class Staging_Store(object):
+    """Staging_Store
+    =======
+    Edited records waiting to be sent to Koha, stored in a single SQLite file.
+    Each record is stored as raw MARC with its 005 when it was retrieved,
+    its index in the input file, the diff (deleted fields) & a Staged_Status.
+    Can be used by multiple threads.
+
+    On init take as arguments :
+    - file_path : path of the SQLite file, created if needed
+    - [optional] reset : remove all the records already staged"""
+    # Number of records read at once by iter_planned()
+    PAGE_SIZE = 500
+
+    def __init__(self, file_path:str, reset:bool=False) -> None:
+        self.path = file_path
+        self.lock = threading.Lock()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Autocommit : each statement is its own transaction
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Staged records must survive a crash once the journal lists them
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS staged (
+            bibnb INTEGER PRIMARY KEY,
+            idx INTEGER NOT NULL,
+            version TEXT,
+            record BLOB NOT NULL,
+            diff TEXT,
+            status TEXT NOT NULL,
+            message TEXT,
+            staged REAL NOT NULL,
+            applied REAL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS staged_idx ON staged (idx)")
+        if reset:
+            self.db.execute("DELETE FROM staged")
+
+    def add(self, index:int, bibnb:int, record:bytes, deleted_fields:List[Tuple[str, str, str, str]]=[]):
+        """Stages an edited record, replacing the one already staged for this biblionumber"""
+        version = get_raw_marc_control_field(record, "005")
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO staged VALUES (?, ?, ?, ?, ?, ?, NULL, ?, NULL)",
+                            (bibnb, index, version, record, format_diff(deleted_fields), Staged_Status.PLANNED.value, time.time()))
+
+    def iter_planned(self):
+        """Yields (index, biblionumber, 005, record) of the records not sent yet, in input order.
+        Records are read by pages, so status changes while iterating are fine"""
+        last_index = -1
+        while True:
+            with self.lock:
+                rows = self.db.execute("SELECT idx, bibnb, version, record FROM staged WHERE status = ? AND idx > ? ORDER BY idx LIMIT ?",
+                                       (Staged_Status.PLANNED.value, last_index, self.PAGE_SIZE)).fetchall()
+            for index, bibnb, version, record in rows:
+                yield index, bibnb, version, bytes(record)
+            if len(rows) < self.PAGE_SIZE:
+                return
+            last_index = rows[-1][0]
+
+    def set_status(self, bibnb:int, status:Staged_Status, msg:str=None):
+        """Sets what happened to a staged record"""
+        with self.lock:
+            self.db.execute("UPDATE staged SET status = ?, message = ?, applied = ? WHERE bibnb = ?",
+                            (status.value, msg, time.time(), bibnb))
+
+    def count(self) -> Dict[str, int]:
+        """Returns the number of records by status"""
+        with self.lock:
+            return dict(self.db.execute("SELECT status, COUNT(*) FROM staged GROUP BY status").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark suite of the dedupe engine on synthetic records (no Koha needed)
+# Results are saved as JSON, and can be compared with a previous result file :
+# python benchmarks/bench_dedupe.py --output new.json --compare old.json
+
+# external imports
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+import pymarc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Internal imports
+import api.marc_utils_5 as marc_utils
+from api.cl_log import Level
+import dedupe
+from dedupe import Error_Types, Field_Summary, Preferred_Field, Record_Report, get_auth_id
+from synthetic_records import Synthetic_Settings, iter_records
+
+# ----------------- Benchmark helpers -----------------
+def best_time(func:Callable, setup:Callable=None, repeat:int=5) -> float:
+    """Returns the best time of func(setup()) over repeat runs.
+    setup() is not timed"""
+    best = None
+    for _ in range(repeat):
+        data = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(data)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def result(seconds:float, nb_ops:int) -> Dict:
+    return {"ops":nb_ops, "seconds":round(seconds, 6), "per_op_us":round(seconds / nb_ops * 1000000, 3) if nb_ops else 0}
+
+def get_commit() -> str|None:
+    """Returns the current git commit, or None"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+# ----------------- Previous implementation -----------------
+def dedupe_per_tag(record:pymarc.record.Record, tag:str, report:Record_Report) -> bool:
+    """Per tag deduping of 1.1.1, kept as a reference for dedupe.dedupe_record() :
+    reads record.fields with get_fields() twice for each tag, then remove_fields() & add_ordered_field()"""
+    auth_id_index:Dict[str, Preferred_Field] = {}
+    fields:List[pymarc.field.Field] = []
+    for field in record.get_fields(tag):
+        if not field.get("9"):
+            field_as_string = marc_utils.field_as_string(field)
+            report.error(Error_Types.WARNING_FIELD_WITHOUT_AUTHORITY_ID, msg=field_as_string)
+            report.log(Level.WARNING, "Field without authority ID : %s", field_as_string)
+            fields.append(field)
+            continue
+        summary = Field_Summary(field)
+        if summary.nb_koha_id > 1:
+            field_as_string = marc_utils.field_as_string(field)
+            report.error(Error_Types.WARNING_MULTIPLE_AUTHORITY_ID_IN_ONE_FIELD, msg=field_as_string)
+            report.log(Level.WARNING, "Field has multiple authority ID : %s", field_as_string)
+        auth_id = summary.auth_id
+        if not auth_id in auth_id_index:
+            auth_id_index[auth_id] = Preferred_Field(summary)
+        else:
+            changed = auth_id_index[auth_id].update_with_new_field(summary)
+            deleted_field = auth_id_index[auth_id].old_field if changed else field
+            report.deleted_field(tag, auth_id, deleted_field, auth_id_index[auth_id].current_field)
+    for auth_id in auth_id_index:
+        fields.append(auth_id_index[auth_id].current_field)
+    if len(fields) == len(record.get_fields(tag)):
+        return False
+    record.remove_fields(tag)
+    record.add_ordered_field(*fields)
+    return True
+
+# ----------------- Benchmarks -----------------
+def run_benchmarks(raw_records:List[bytes], tags:List[str], repeat:int, mixed_raw_records:List[bytes]=None) -> Dict[str, Dict]:
+    """Times each part of the dedupe engine on the records.
+    If mixed_raw_records is set, round trips with & without pre-scan are also timed on them"""
+    records = [pymarc.record.Record(data=raw, to_unicode=True, force_utf8=True) for raw in raw_records]
+    fields = [field for record in records for field in record.fields if field.tag in tags]
+    auth_fields = [field for field in fields if field.get("9")]
+    nb_records = len(records)
+    results = {}
+
+    results["get_auth_id"] = result(best_time(lambda _: [get_auth_id(field) for field in auth_fields], repeat=repeat), len(auth_fields))
+    results["Field_Summary"] = result(best_time(lambda _: [Field_Summary(field) for field in auth_fields], repeat=repeat), len(auth_fields))
+    results["field_as_string"] = result(best_time(lambda _: [marc_utils.field_as_string(field) for field in fields], repeat=repeat), len(fields))
+
+    # Preferred_Field.update_with_new_field() on fields sharing an authority ID (same record & tag)
+    pairs = []
+    for record in records:
+        seen = {}
+        for field in record.fields:
+            if field.tag in tags and field.get("9"):
+                key = (field.tag, get_auth_id(field))
+                if key in seen:
+                    pairs.append((seen[key], Field_Summary(field)))
+                else:
+                    seen[key] = Field_Summary(field)
+    def update_pairs(_):
+        for first, other in pairs:
+            Preferred_Field(first).update_with_new_field(other)
+    results["Preferred_Field.update_with_new_field"] = result(best_time(update_pairs, repeat=repeat), len(pairs))
+
+    # Deduping edits records : each run uses freshly parsed records (parsing is not timed)
+    def parse_all():
+        return [pymarc.record.Record(data=raw, to_unicode=True, force_utf8=True) for raw in raw_records]
+    def dedupe_by_tag(records):
+        for record in records:
+            report = Record_Report(log_level=Level.WARNING)
+            for tag in tags:
+                dedupe_per_tag(record, tag, report)
+    def dedupe_by_record(records):
+        for record in records:
+            dedupe.dedupe_record(record, tags, Record_Report(log_level=Level.WARNING))
+    # Both keep the same fields, only their order differs
+    by_tag, by_record = parse_all(), parse_all()
+    dedupe_by_tag(by_tag)
+    dedupe_by_record(by_record)
+    assert [sorted(field.as_marc("utf-8") for field in record.fields) for record in by_tag] == \
+        [sorted(field.as_marc("utf-8") for field in record.fields) for record in by_record], "Implementations do not keep the same fields"
+    results["dedupe_per_tag"] = result(best_time(dedupe_by_tag, parse_all, repeat), nb_records)
+    results["dedupe_record"] = result(best_time(dedupe_by_record, parse_all, repeat), nb_records)
+
+    # Full round trips
+    results["parse"] = result(best_time(lambda _: parse_all(), repeat=repeat), nb_records)
+    def round_trip(_, prescan:bool=False, log_level:Level=Level.WARNING, raw_records:List[bytes]=raw_records):
+        for raw in raw_records:
+            # Like main.py, the biblionumber is known before processing : the pre-scan only skips records with one
+            record = dedupe.process_raw_record(raw, tags, Record_Report(bibnb=dedupe.get_bibnb_from_record(raw), log_level=log_level), prescan)
+            if record is not None:
+                record.as_marc()
+    results["round_trip"] = result(best_time(round_trip, repeat=repeat), nb_records)
+    results["round_trip_debug_logs"] = result(best_time(lambda _: round_trip(_, log_level=Level.DEBUG), repeat=repeat), nb_records)
+    results["round_trip_prescan"] = result(best_time(lambda _: round_trip(_, prescan=True), repeat=repeat), nb_records)
+    # The pre-scan only pays off on records without duplicates
+    if mixed_raw_records:
+        results["round_trip_mixed"] = result(best_time(lambda _: round_trip(_, raw_records=mixed_raw_records), repeat=repeat), len(mixed_raw_records))
+        results["round_trip_mixed_prescan"] = result(best_time(lambda _: round_trip(_, prescan=True, raw_records=mixed_raw_records), repeat=repeat), len(mixed_raw_records))
+    return results
+
+def get_mixed_records(nb_records:int, settings:Synthetic_Settings, clean_ratio:float, seed:int) -> List[bytes]:
+    """Returns nb_records raw records, clean_ratio of them without duplicate authority ID"""
+    clean_settings = Synthetic_Settings(**{**settings.to_dict(), "duplicate_ratio":0})
+    nb_clean = round(nb_records * clean_ratio)
+    clean = iter_records(nb_clean, clean_settings, seed + 1)
+    other = iter_records(nb_records - nb_clean, settings, seed, first_bibnb=nb_clean + 1)
+    # Spreads the records with duplicates among the clean ones
+    rand = random.Random(seed)
+    kinds = [True] * nb_clean + [False] * (nb_records - nb_clean)
+    rand.shuffle(kinds)
+    return [next(clean if is_clean else other).as_marc() for is_clean in kinds]
+
+def print_results(results:Dict[str, Dict], previous:Dict[str, Dict]=None):
+    for name, values in results.items():
+        line = f"{name:<40} {values['per_op_us']:>12.3f} us/op ({values['ops']} ops)"
+        if previous and name in previous and previous[name]["per_op_us"]:
+            line += f"   x{previous[name]['per_op_us'] / values['per_op_us']:.2f} vs previous" if values["per_op_us"] else ""
+        print(line)
+
+# ----------------- Main -----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dedupe engine on synthetic UNIMARC records")
+    parser.add_argument("--records", type=int, default=200, help="Number of records")
+    parser.add_argument("--fields", type=int, default=50, help="Number of 60X fields per record")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.3, help="Share of fields reusing a previous authority ID")
+    parser.add_argument("--compound-ratio", type=float, default=0.2, help="Share of subjects with multiple $9")
+    parser.add_argument("--ppn-ratio", type=float, default=0.7, help="Chance for each $9 to have a $3")
+    parser.add_argument("--script-ratio", type=float, default=0.3, help="Chance for a field to have a $7")
+    parser.add_argument("--clean-ratio", type=float, default=0.9, help="Share of records without duplicate authority ID in the mixed round trips")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark, the best one is kept")
+    parser.add_argument("--output", default=None, help="JSON result file. Defaults to benchmarks/results/dedupe_<commit>_<date>.json")
+    parser.add_argument("--compare", default=None, help="Previous JSON result file to compare with")
+    args = parser.parse_args()
+
+    settings = Synthetic_Settings(nb_fields=args.fields, duplicate_ratio=args.duplicate_ratio, compound_ratio=args.compound_ratio,
+                                  ppn_ratio=args.ppn_ratio, script_ratio=args.script_ratio)
+    raw_records = [record.as_marc() for record in iter_records(args.records, settings, args.seed)]
+    mixed_raw_records = get_mixed_records(args.records, settings, args.clean_ratio, args.seed)
+    results = run_benchmarks(raw_records, settings.tags, args.repeat, mixed_raw_records)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+    print_results(results, previous)
+
+    commit = get_commit()
+    output_path = args.output
+    if output_path is None:
+        output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, f"dedupe_{commit or 'nocommit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta":{
+                "commit":commit,
+                "date":time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python":platform.python_version(),
+                "pymarc":getattr(pymarc, "__version__", None),
+                "platform":platform.platform(),
+                "records":args.records,
+                "seed":args.seed,
+                "clean_ratio":args.clean_ratio,
+                "repeat":args.repeat,
+                "settings":settings.to_dict()
+            },
+            "results":results
+        }, f, indent=2)
+    print(f"Results written to {output_path}")
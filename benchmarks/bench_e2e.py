@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# End-to-end throughput benchmark : runs main.py against the local fake Koha (benchmarks/fake_koha.py)
+# with different worker counts and reports records/s
+# python benchmarks/bench_e2e.py --records 500 --workers 1,2,4,8,16 --latency 0.02
+
+# external imports
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+# Internal imports
+from fake_koha import Fake_Koha_Data, Fake_Koha_Server, Fake_Koha_Settings, load_records
+from synthetic_records import Synthetic_Settings, iter_records
+
+def run_main(server:Fake_Koha_Server, work_dir:str, bibnbs:list, tags:list, concurrency_arg:str, concurrency:int, extra_args:list) -> dict:
+    """Runs main.py once on freshly reset records. Returns the run results"""
+    server.data.reset()
+    output_dir = os.path.join(work_dir, f"{concurrency_arg}_{concurrency}")
+    os.makedirs(output_dir, exist_ok=True)
+    input_path = os.path.join(work_dir, "bibnbs.txt")
+    with open(input_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(str(bibnb) for bibnb in bibnbs) + "\n")
+    env = dict(os.environ)
+    env.update({
+        "KOHA_URL":server.url,
+        "KOHA_CLIENT_ID":"fake",
+        "KOHA_CLIENT_SECRET":"fake",
+        "SUBJECTS_TAG":",".join(tags),
+        "INPUT_FILE":input_path,
+        "OUTPUT_PATH":output_dir,
+        "LOGS_FOLDER":output_dir,
+        "RECORD_NB_LIMIT":str(len(bibnbs)),
+        "LOG_LEVEL":env.get("LOG_LEVEL", "WARNING"),
+        "PROGRESS_INTERVAL":"0"
+    })
+    env.pop("INPUT_MARC_FILE", None)
+    command = [sys.executable, os.path.join(REPO_DIR, "main.py"), f"--{concurrency_arg}", str(concurrency)] + extra_args
+    start = time.perf_counter()
+    process = subprocess.run(command, env=env, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall_time = time.perf_counter() - start
+    if process.returncode != 0:
+        print(process.stderr, file=sys.stderr)
+    with open(os.path.join(output_dir, "KRSD_metrics.json"), "r", encoding="utf-8") as f:
+        metrics = json.load(f)
+    with server.data.lock:
+        stats = dict(server.data.stats)
+    return {
+        concurrency_arg:concurrency,
+        "records":metrics["records"],
+        "records_per_second":metrics["records_per_second"],
+        "wall_seconds":round(wall_time, 3),
+        "updated":metrics["counters"].get("records.updated", 0),
+        "server_requests":stats
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs main.py against a local fake Koha and reports records/s")
+    parser.add_argument("--biblios", default=None, help="MARC file served by the fake Koha. Defaults to synthetic records")
+    parser.add_argument("--records", type=int, default=500, help="Number of synthetic records (if --biblios is not set)")
+    parser.add_argument("--tags", default="600,601,602,604,605,606,607,608", help="SUBJECTS_TAG used by main.py")
+    parser.add_argument("--workers", default="1,2,4,8,16", help="Comma separated concurrency values to test")
+    parser.add_argument("--concurrency-arg", default="workers", choices=["workers", "async-concurrency", "processes"],
+                        help="main.py argument receiving each --workers value")
+    parser.add_argument("--extra-args", default="", help="Other main.py arguments, like \"--batch-size 50\"")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--token-expiry", type=int, default=3600)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="JSON result file")
+    args = parser.parse_args()
+
+    tags = [tag.strip() for tag in args.tags.split(",") if tag.strip()]
+    if args.biblios:
+        biblios = load_records(args.biblios)
+    else:
+        biblios = {int(record["001"].data):record.as_marc() for record in iter_records(args.records, Synthetic_Settings(tags=tags), args.seed)}
+    settings = Fake_Koha_Settings(args.latency, args.jitter, args.error_rate, token_expiry=args.token_expiry, seed=args.seed)
+    server = Fake_Koha_Server(Fake_Koha_Data(biblios), settings)
+    server.start_in_thread()
+    print(f"Fake Koha on {server.url} : {len(biblios)} biblios, latency {args.latency}s (+ up to {args.jitter}s), error rate {args.error_rate}")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="krsd_e2e_") as work_dir:
+        for concurrency in [int(value) for value in args.workers.split(",")]:
+            result = run_main(server, work_dir, sorted(biblios), tags, args.concurrency_arg, concurrency, shlex.split(args.extra_args))
+            results.append(result)
+            print(f"{args.concurrency_arg} {concurrency:>4} : {result['records_per_second']:>9.1f} records/s "
+                  f"({result['records']} records, {result['updated']} updated, {result['wall_seconds']}s wall time)")
+    server.shutdown()
+    server.server_close()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings":dict(vars(args)), "server":settings.to_dict(), "results":results}, f, indent=2)
+        print(f"Results written to {args.output}")
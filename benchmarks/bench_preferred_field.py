@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Micro-benchmark of Preferred_Field : previous implementation (rescanning subfields
+# for each comparison) vs Field_Summary (subfields read once per field)
+# Usage : python benchmarks/bench_preferred_field.py [--fields 200] [--repeat 200]
+
+# external imports
+import argparse
+import os
+import random
+import sys
+import timeit
+import pymarc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Internal imports
+from dedupe import AlphaScript_Priority, Field_Summary, Preferred_Field, get_alphascript_priority, get_auth_id
+
+# ----------------- Previous implementation -----------------
+class Rescanning_Preferred_Field(object):
+    """Preferred_Field as it was before Field_Summary, kept for comparison"""
+    def __init__(self, field:pymarc.field.Field):
+        self.id = get_auth_id(field)
+        self.old_field = None
+        self.current_field = None
+        self.update_with_new_field(field)
+
+    def update_with_new_field(self, field:pymarc.field.Field) -> bool:
+        if self.current_field == None:
+            self.current_field = field
+            return True
+        if len(field.get_subfields("3")) > 0:
+            if not self.has_ppn:
+                self.__replace_current_field(field)
+                return True
+            if not self.nb_ppn_match_nb_ids:
+                if abs(len(field.get_subfields("9")) - len(field.get_subfields("3"))) < abs(self.nb_koha_id - self.nb_ppn):
+                    self.__replace_current_field(field)
+                    return True
+                elif abs(len(field.get_subfields("9")) - len(field.get_subfields("3"))) == abs(self.nb_koha_id - self.nb_ppn):
+                    if get_alphascript_priority(field) > self.alphascript_priority:
+                        self.__replace_current_field(field)
+                        return True
+            if len(field.get_subfields("9")) == len(field.get_subfields("3")):
+                if get_alphascript_priority(field) > self.alphascript_priority:
+                    self.__replace_current_field(field)
+                    return True
+        if not self.has_ppn:
+            if get_alphascript_priority(field) > self.alphascript_priority:
+                self.__replace_current_field(field)
+                return True
+        return False
+
+    @property
+    def nb_koha_id(self) -> int:
+        return len(self.current_field.get_subfields("9"))
+
+    @property
+    def nb_ppn(self) -> int:
+        return len(self.current_field.get_subfields("3"))
+
+    @property
+    def has_ppn(self) -> bool:
+        return self.nb_ppn > 0
+
+    @property
+    def nb_ppn_match_nb_ids(self) -> bool:
+        return self.nb_ppn == self.nb_koha_id
+
+    @property
+    def alphascript_priority(self) -> AlphaScript_Priority:
+        return get_alphascript_priority(self.current_field)
+
+    def __replace_current_field(self, field:pymarc.field.Field):
+        self.old_field = self.current_field
+        self.current_field = field
+
+# ----------------- Synthetic data -----------------
+def make_field(rand:random.Random, nb_auth:int) -> pymarc.field.Field:
+    """Returns a 606 with a compound subject ($a-$x-$y…) among nb_auth authorities"""
+    subfields = []
+    first_auth = rand.randrange(nb_auth)
+    nb_terms = rand.randint(1, 4)
+    for i in range(nb_terms):
+        subfields.append(pymarc.field.Subfield("3", f"0{first_auth + i:07d}X") if rand.random() < 0.7 else None)
+        subfields.append(pymarc.field.Subfield("a" if i == 0 else "x", f"Term {first_auth + i}"))
+        subfields.append(pymarc.field.Subfield("9", str(first_auth + i)))
+    subfields.append(pymarc.field.Subfield("2", "rameau"))
+    if rand.random() < 0.5:
+        subfields.append(pymarc.field.Subfield("7", rand.choice(["ba0yba0y", "ba", "ca0yca0y"])))
+    return pymarc.field.Field(tag="606", indicators=pymarc.field.Indicators(" ", " "),
+                              subfields=[subfield for subfield in subfields if subfield is not None])
+
+def dedupe_fields(cls, fields, make_arg):
+    """Runs the deduping loop of dedupe_field() on a list of fields"""
+    index = {}
+    for field in fields:
+        arg = make_arg(field)
+        auth_id = arg.auth_id if type(arg) == Field_Summary else get_auth_id(arg)
+        if not auth_id in index:
+            index[auth_id] = cls(arg)
+        else:
+            index[auth_id].update_with_new_field(arg)
+    return [index[auth_id].current_field for auth_id in index]
+
+# ----------------- Main -----------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Preferred_Field against the previous implementation on synthetic fields")
+    parser.add_argument("--fields", type=int, default=200, help="Number of fields of the synthetic record")
+    parser.add_argument("--repeat", type=int, default=200, help="Runs per timing, the best of 3 timings is kept")
+    args = parser.parse_args()
+    nb_fields = max(args.fields, 1)
+    nb_repeat = max(args.repeat, 1)
+    rand = random.Random(42)
+    # Few authorities for many fields : lots of comparisons
+    fields = [make_field(rand, max(nb_fields // 10, 1)) for _ in range(nb_fields)]
+
+    previous = dedupe_fields(Rescanning_Preferred_Field, fields, lambda field: field)
+    current = dedupe_fields(Preferred_Field, fields, Field_Summary)
+    assert [id(field) for field in previous] == [id(field) for field in current], "Implementations do not keep the same fields"
+
+    previous_time = min(timeit.repeat(lambda: dedupe_fields(Rescanning_Preferred_Field, fields, lambda field: field), number=nb_repeat, repeat=3))
+    current_time = min(timeit.repeat(lambda: dedupe_fields(Preferred_Field, fields, Field_Summary), number=nb_repeat, repeat=3))
+    print(f"{nb_fields} fields ({len(current)} authorities), {nb_repeat} runs")
+    print(f"Rescanning subfields : {previous_time / nb_repeat * 1000:.3f} ms per record")
+    print(f"Field_Summary        : {current_time / nb_repeat * 1000:.3f} ms per record")
+    print(f"Speedup              : x{previous_time / current_time:.2f}")
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+# Local stand-in of the Koha REST API endpoints used by KohaRESTAPIClient, for end-to-end tests & benchmarks
+# Do NOT use it as a reference of the Koha API : only what this script needs is implemented
+# python benchmarks/fake_koha.py --biblios <records.mrc|.xml> [--port 8765] [--latency 0.02] [--jitter 0.01] [--error-rate 0.01]
+
+# external imports
+import argparse
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+import pymarc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Internal imports
+from api.marc_dump import Dump_Format, MARCXML_NS, detect_dump_format, iter_raw_marc_records, iter_marcxml_records, marcxml_to_record
+
+RAW_MARC = "application/marc"
+MARCXML = "application/marcxml+xml"
+JSON = "application/json"
+
+# ----------------- Settings & data -----------------
+class Fake_Koha_Settings(object):
+    """Behaviour of the fake Koha :
+    - latency : seconds waited before answering any API request (not the token)
+    - jitter : maximum random seconds added to latency
+    - error_rate : chance for an API request to fail with error_status
+    - error_status : HTTP status of random errors (503 is retried by the clients)
+    - token_expiry : lifetime of access tokens in seconds, requests with an expired token get a 401
+    - seed : seed of the random errors & jitter
+    - max_per_page : lists return at most this many records per page, whatever _per_page is (like Koha). 0 disables it"""
+    def __init__(self, latency:float=0.01, jitter:float=0, error_rate:float=0, error_status:int=503,
+                 token_expiry:int=3600, seed:int=None, max_per_page:int=0) -> None:
+        self.latency = max(latency, 0)
+        self.jitter = max(jitter, 0)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_expiry = token_expiry
+        self.rand = random.Random(seed)
+        self.max_per_page = max(max_per_page, 0)
+
+    def to_dict(self) -> dict:
+        return {key:value for key, value in self.__dict__.items() if key != "rand"}
+
+def load_records(path:str) -> Dict[int, bytes]:
+    """Returns the records of an ISO 2709 or MARCXML file as raw ISO 2709, by their 001"""
+    if detect_dump_format(path) == Dump_Format.MARCXML:
+        records = [record.as_marc() for record in iter_marcxml_records(path)]
+    else:
+        with open(path, "rb") as f:
+            records = list(iter_raw_marc_records(f))
+    output = {}
+    for raw in records:
+        record = pymarc.record.Record(data=raw, to_unicode=True, force_utf8=True)
+        if record.get("001") is not None and record["001"].data.strip().isdigit():
+            output[int(record["001"].data.strip())] = raw
+    return output
+
+def make_authorities(biblios:Dict[int, bytes]) -> Dict[int, bytes]:
+    """Returns a minimal UNIMARC authority record for each authority ID ($9) of the biblios"""
+    output = {}
+    for raw in biblios.values():
+        for match in re.finditer(rb"\x1f9(\d+)", raw):
+            auth_id = int(match.group(1))
+            if auth_id in output:
+                continue
+            record = pymarc.record.Record(to_unicode=True, force_utf8=True)
+            record.leader = pymarc.leader.Leader("     nx  a22        45  ")
+            record.add_field(pymarc.field.Field(tag="001", data=str(auth_id)))
+            record.add_field(pymarc.field.Field(tag="250", indicators=pymarc.field.Indicators(" ", " "),
+                                                subfields=[pymarc.field.Subfield("a", f"Term {auth_id}")]))
+            output[auth_id] = record.as_marc()
+    return output
+
+class Fake_Koha_Data(object):
+    """Records served by the fake Koha & counters of received requests.
+    reset() restores the records as they were loaded"""
+    def __init__(self, biblios:Dict[int, bytes], authorities:Dict[int, bytes]=None) -> None:
+        self.original_biblios = dict(biblios)
+        self.authorities = authorities if authorities is not None else make_authorities(biblios)
+        self.lock = threading.Lock()
+        self.tokens:Dict[str, float] = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.biblios = dict(self.original_biblios)
+            self.next_biblio_id = max(self.biblios, default=0) + 1
+            self.stats:Dict[str, int] = {}
+
+    def count(self, name:str):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+# ----------------- Serialisation -----------------
+def stamp_record(record:pymarc.record.Record) -> bytes:
+    """Sets the 005 to the current time, like Koha does when a record is saved.
+    Returns the record as raw ISO 2709"""
+    record.remove_fields("005")
+    record.add_ordered_field(pymarc.field.Field(tag="005", data=time.strftime("%Y%m%d%H%M%S.0")))
+    return record.as_marc()
+
+def to_marcxml(raw_records:List[bytes], collection:bool) -> bytes:
+    """Returns raw ISO 2709 records as a MARCXML record or collection"""
+    records = [pymarc.record_to_xml(pymarc.record.Record(data=raw, to_unicode=True, force_utf8=True), namespace=not collection)
+               for raw in raw_records]
+    if not collection:
+        return records[0]
+    return f'<collection xmlns="{MARCXML_NS}">'.encode("utf-8") + b"".join(records) + b"</collection>"
+
+# ----------------- Request handler -----------------
+class Fake_Koha_Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffered writes : headers & body are sent with one system call
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def data(self) -> Fake_Koha_Data:
+        return self.server.data
+
+    @property
+    def settings(self) -> Fake_Koha_Settings:
+        return self.server.settings
+
+    def send(self, status:int, body:bytes|dict, content_type:str=JSON, headers:Dict[str, str]={}, name:str=None):
+        if type(body) == dict:
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if name:
+            self.data.count(f"{name} {status}")
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def before_api(self, name:str) -> bool:
+        """Waits the latency, then checks the token & random errors.
+        Returns False if an error was already sent"""
+        wait = self.settings.latency
+        if self.settings.jitter:
+            wait += self.settings.rand.uniform(0, self.settings.jitter)
+        if wait:
+            time.sleep(wait)
+        token = (self.headers.get("Authorization") or "").split(" ")[-1]
+        expiry = self.data.tokens.get(token)
+        if expiry is None or expiry < time.time():
+            self.send(401, {"error":"Invalid or expired token"}, name=name)
+            return False
+        if self.settings.error_rate and self.settings.rand.random() < self.settings.error_rate:
+            self.send(self.settings.error_status, {"error":"Random error"}, name=name)
+            return False
+        return True
+
+    def send_records(self, raw_records:List[bytes], collection:bool, headers:Dict[str, str]={}, name:str=None):
+        """Sends records in the format asked by the accept header"""
+        accept = self.headers.get("accept") or RAW_MARC
+        if accept == MARCXML:
+            body = to_marcxml(raw_records, collection) if raw_records or collection else b""
+            return self.send(200, body, MARCXML, headers, name)
+        if accept == RAW_MARC:
+            return self.send(200, b"".join(raw_records), RAW_MARC, headers, name)
+        self.send(406, {"error":f"Unsupported accept header : {accept}"}, name=name)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        page = int(params.get("_page", ["1"])[0])
+        per_page = int(params.get("_per_page", ["20"])[0])
+        if self.settings.max_per_page > 0:
+            per_page = min(per_page, self.settings.max_per_page)
+        match = re.fullmatch(r"/api/v1/(biblios|authorities)(?:/(\d+))?", url.path)
+        if url.path == "/fake/stats":
+            with self.data.lock:
+                return self.send(200, dict(sorted(self.data.stats.items())))
+        if not match:
+            return self.send(404, {"error":"Path not found"})
+        name = "GET " + match.group(1) + ("/{id}" if match.group(2) else "")
+        if not self.before_api(name):
+            return
+        records = self.data.biblios if match.group(1) == "biblios" else self.data.authorities
+        # Single record
+        if match.group(2):
+            raw = records.get(int(match.group(2)))
+            if raw is None:
+                return self.send(404, {"error":"Object not found."}, name=name)
+            return self.send_records([raw], False, name=name)
+        # List : biblio_id query or all records, paged
+        ids = sorted(records)
+        if "q" in params:
+            query = json.loads(params["q"][0])
+            wanted = query.get("biblio_id", [])
+            if type(wanted) == dict:
+                wanted = wanted.get("-in", [])
+            ids = [int(id) for id in (wanted if type(wanted) == list else [wanted]) if int(id) in records]
+        page_ids = ids[(page - 1) * per_page:page * per_page]
+        self.send_records([records[id] for id in page_ids], True, {"X-Total-Count":str(len(ids))}, name)
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path.rstrip("/") == "/api/v1/oauth/token":
+            token = secrets.token_hex(16)
+            with self.data.lock:
+                self.data.tokens[token] = time.time() + self.settings.token_expiry
+            return self.send(200, {"access_token":token, "token_type":"Bearer", "expires_in":self.settings.token_expiry}, name="POST oauth/token")
+        if self.path.rstrip("/") == "/fake/reset":
+            self.data.reset()
+            return self.send(200, {"reset":True})
+        if self.path.rstrip("/") != "/api/v1/biblios":
+            return self.send(404, {"error":"Path not found"})
+        name = "POST biblios"
+        if not self.before_api(name):
+            return
+        raw = self.parse_record(body)
+        if raw is None:
+            return self.send(400, {"error":"Invalid record"}, name=name)
+        with self.data.lock:
+            biblio_id = self.data.next_biblio_id
+            self.data.next_biblio_id += 1
+            self.data.biblios[biblio_id] = raw
+        self.send(200, {"id":biblio_id}, name=name)
+
+    def do_PUT(self):
+        body = self.read_body()
+        match = re.fullmatch(r"/api/v1/biblios/(\d+)", self.path)
+        if not match:
+            return self.send(404, {"error":"Path not found"})
+        name = "PUT biblios/{id}"
+        if not self.before_api(name):
+            return
+        biblio_id = int(match.group(1))
+        if not biblio_id in self.data.biblios:
+            return self.send(404, {"error":"Object not found."}, name=name)
+        raw = self.parse_record(body)
+        if raw is None:
+            return self.send(400, {"error":"Invalid record"}, name=name)
+        with self.data.lock:
+            self.data.biblios[biblio_id] = raw
+        self.send(200, {"id":biblio_id}, name=name)
+
+    def parse_record(self, body:bytes) -> bytes|None:
+        """Returns the sent record as raw ISO 2709 with a new 005, or None if it can not be parsed"""
+        try:
+            if self.headers.get("Content-type") == MARCXML:
+                record = marcxml_to_record(body)
+            else:
+                record = pymarc.record.Record(data=body, to_unicode=True, force_utf8=True)
+        except Exception:
+            return None
+        return stamp_record(record)
+
+# ----------------- Server -----------------
+class Fake_Koha_Server(ThreadingHTTPServer):
+    """Fake Koha HTTP server, one thread per connection"""
+    request_queue_size = 128
+    daemon_threads = True
+
+    def __init__(self, data:Fake_Koha_Data, settings:Fake_Koha_Settings=None, host:str="127.0.0.1", port:int=0) -> None:
+        self.data = data
+        self.settings = settings or Fake_Koha_Settings()
+        super().__init__((host, port), Fake_Koha_Handler)
+
+    def handle_error(self, request, client_address):
+        # Clients closing their connections (like a killed script) are not errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start_in_thread(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of the Koha REST API")
+    parser.add_argument("--biblios", required=True, help="ISO 2709 or MARCXML file of the served biblios (identified by their 001)")
+    parser.add_argument("--authorities", default=None, help="ISO 2709 or MARCXML file of the served authorities. Defaults to generated records for each $9 of the biblios")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds waited before each answer")
+    parser.add_argument("--jitter", type=float, default=0, help="Maximum random seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Chance for a request to fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of the random errors")
+    parser.add_argument("--token-expiry", type=int, default=3600, help="Access tokens lifetime in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-per-page", type=int, default=0, help="Maximum number of records per list page, 0 for no limit")
+    args = parser.parse_args()
+
+    biblios = load_records(args.biblios)
+    authorities = load_records(args.authorities) if args.authorities else None
+    server = Fake_Koha_Server(Fake_Koha_Data(biblios, authorities),
+                              Fake_Koha_Settings(args.latency, args.jitter, args.error_rate, args.error_status, args.token_expiry, args.seed, args.max_per_page),
+                              args.host, args.port)
+    print(f"Fake Koha serving {len(biblios)} biblios & {len(server.data.authorities)} authorities on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.data.stats, indent=2, sort_keys=True))
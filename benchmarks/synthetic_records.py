@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Generator of synthetic UNIMARC records with duplicate subject fields, for benchmarks
+# Can also write them to a MARC file : python benchmarks/synthetic_records.py <output.mrc> [nb_records]
+
+# external imports
+import random
+import sys
+from typing import List
+import pymarc
+
+# $7 values, see dedupe.get_alphascript_priority()
+SCRIPT_VARIANTS = ["ba0yba0y", "ba", "ca0yca0y"]
+
+class Synthetic_Settings(object):
+    """Settings of the generated records :
+    - nb_fields : number of 60X fields per record
+    - tags : subject tags used
+    - duplicate_ratio : share of fields reusing the authority ID of a previous field with the same tag
+    - compound_ratio : share of new subjects with multiple $9 (compound IDs, $a-$x-$y)
+    - ppn_ratio : chance for each $9 to have a matching $3 (PPN)
+    - script_ratio : chance for a field to have a $7 (script variants from SCRIPT_VARIANTS)
+    - no_auth_ratio : share of fields without $9"""
+    def __init__(self, nb_fields:int=50, tags:List[str]=["600", "601", "602", "604", "605", "606", "607", "608"],
+                 duplicate_ratio:float=0.3, compound_ratio:float=0.2, ppn_ratio:float=0.7, script_ratio:float=0.3,
+                 no_auth_ratio:float=0.02) -> None:
+        self.nb_fields = nb_fields
+        self.tags = tags
+        self.duplicate_ratio = duplicate_ratio
+        self.compound_ratio = compound_ratio
+        self.ppn_ratio = ppn_ratio
+        self.script_ratio = script_ratio
+        self.no_auth_ratio = no_auth_ratio
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+def make_subject_field(rand:random.Random, tag:str, auth_ids:List[str], settings:Synthetic_Settings) -> pymarc.field.Field:
+    """Returns a subject field with one term ($a then $x) per authority ID.
+    If auth_ids is empty, the field has no $9"""
+    subfields = []
+    for i, auth_id in enumerate(auth_ids or ["0"]):
+        if auth_ids and rand.random() < settings.ppn_ratio:
+            subfields.append(pymarc.field.Subfield("3", f"0{int(auth_id):08d}"[-9:]))
+        subfields.append(pymarc.field.Subfield("a" if i == 0 else "x", f"Term {auth_id}"))
+        if auth_ids:
+            subfields.append(pymarc.field.Subfield("9", auth_id))
+    subfields.append(pymarc.field.Subfield("2", "rameau"))
+    if rand.random() < settings.script_ratio:
+        subfields.append(pymarc.field.Subfield("7", rand.choice(SCRIPT_VARIANTS)))
+    return pymarc.field.Field(tag=tag, indicators=pymarc.field.Indicators(" ", " "), subfields=subfields)
+
+def make_record(rand:random.Random, bibnb:int, settings:Synthetic_Settings) -> pymarc.record.Record:
+    """Returns a UNIMARC record with settings.nb_fields subject fields"""
+    record = pymarc.record.Record(to_unicode=True, force_utf8=True)
+    record.leader = pymarc.leader.Leader("     nam0 22        450 ")
+    record.add_field(pymarc.field.Field(tag="001", data=str(bibnb)))
+    record.add_field(pymarc.field.Field(tag="200", indicators=pymarc.field.Indicators("1", " "),
+                                        subfields=[pymarc.field.Subfield("a", f"Synthetic record {bibnb}")]))
+    # Authority IDs already used, by tag
+    used_ids = {tag:[] for tag in settings.tags}
+    next_id = rand.randrange(1, 1000000)
+    for _ in range(settings.nb_fields):
+        tag = rand.choice(settings.tags)
+        if rand.random() < settings.no_auth_ratio:
+            auth_ids = []
+        elif used_ids[tag] and rand.random() < settings.duplicate_ratio:
+            auth_ids = rand.choice(used_ids[tag])
+        else:
+            nb_ids = rand.randint(2, 4) if rand.random() < settings.compound_ratio else 1
+            auth_ids = [str(next_id + i) for i in range(nb_ids)]
+            next_id += nb_ids
+            used_ids[tag].append(auth_ids)
+        record.add_ordered_field(make_subject_field(rand, tag, auth_ids, settings))
+    return record
+
+def iter_records(nb_records:int, settings:Synthetic_Settings=None, seed:int=42, first_bibnb:int=1):
+    """Yields nb_records records. Same seed & settings give the same records"""
+    settings = settings or Synthetic_Settings()
+    rand = random.Random(seed)
+    for bibnb in range(first_bibnb, first_bibnb + nb_records):
+        yield make_record(rand, bibnb, settings)
+
+def write_records(path:str, nb_records:int, settings:Synthetic_Settings=None, seed:int=42):
+    """Writes nb_records records to an ISO 2709 file"""
+    with open(path, "wb") as f:
+        for record in iter_records(nb_records, settings, seed):
+            f.write(record.as_marc())
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage : python benchmarks/synthetic_records.py <output.mrc> [nb_records]")
+        exit()
+    write_records(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
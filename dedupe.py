@@ -0,0 +1,555 @@
+# -*- coding: utf-8 -*- 
+
+# external imports
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from enum import Enum, IntEnum
+import pymarc
+
+# Internal imports
+from api.Koha_REST_API_Client import Errors as Koha_Api_Errors, validate_int, get_raw_marc_control_field
+from api.cl_log import Level, render_message
+import api.marc_utils_5 as marc_utils
+
+# Everything in this module must stay importable without side effects
+# & picklable, as it is also used by worker processes
+
+# ----------------- Enum definition -----------------
+class Error_Types(Enum):
+    REQUESTS_GET_ERROR = 0
+    SECURITY_STOP = 1
+    REQUESTS_PUT_ERROR = 2
+    NOT_SENT_CACHE_ONLY = 3
+    BIBNB_IS_INCORRECT = 10
+    NO_RECORD = 20
+    NO_BIBNB_IN_RECORD = 21
+    FAILED_TO_PARSE_MARC = 22
+    WARNING_FIELD_WITHOUT_AUTHORITY_ID = 30
+    RECORD_WAS_NOT_CHANGED = 31
+    WARNING_MULTIPLE_AUTHORITY_ID_IN_ONE_FIELD = 32
+    AUTH_ID_HAS_NO_CURRENT_FIELD = 33
+    WARNING_DEAD_AUTHORITY_ID = 34
+    STAGED_RECORD_CHANGED = 40
+    UNEXPECTED_ERROR = 50
+
+class Outcome(Enum):
+    """What finally happened to a record, see api.journal.Journal"""
+    UPDATED = "updated"
+    # Plan mode : the edited record was staged instead of being sent
+    STAGED = "staged"
+    # Cache only mode : the edited record was not sent, a resumed run processes it again
+    NOT_SENT = "not_sent"
+    NOT_CHANGED = "not_changed"
+    ERROR = "error"
+
+class Dead_Auth_Policy(Enum):
+    """What to do with fields whose $9 is not an existing authority, see api.authority_index"""
+    # Report the field & keep it
+    FLAG = "flag"
+    # Delete the field if a kept field of the same tag has the same heading, flag it otherwise
+    MERGE = "merge"
+
+class AlphaScript_Priority(IntEnum):
+    NONE = 0
+    MID = 5
+    TOP = 10
+
+# ----------------- Classes definition -----------------
+class Record_Report(object):
+    """Collects errors, deleted fields & log messages about a record.
+    Written to the output files by the main process, so workers never write files"""
+    def __init__(self, index:int=None, bibnb:int=None, log_level:Level=Level.DEBUG) -> None:
+        self.index = index
+        self.bibnb = bibnb
+        self.log_level = log_level
+        self.errors:List[Tuple[Error_Types, str|None]] = []
+        self.deleted_fields:List[Tuple[str, str, str, str]] = []
+        self.logs:List[Tuple[Level, str]] = []
+        self.timings:List[Tuple[str, float]] = []
+        self.updated = False
+        # Plan mode : edited record (raw MARC) to write to the staging store
+        self.staged:bytes|None = None
+        # Set once nothing else will happen to the record
+        self.outcome:Outcome|None = None
+
+    def error(self, error_type:Error_Types, msg:str=None):
+        """Adds a line to the errors file"""
+        self.errors.append((error_type, msg))
+
+    def deleted_field(self, tag:str, auth_id:str, field:pymarc.field.Field, replaced_by:pymarc.field.Field):
+        """Adds a line to the deleted fields file"""
+        self.deleted_fields.append((tag, auth_id, marc_utils.field_as_string(field), marc_utils.field_as_string(replaced_by)))
+
+    def log(self, level:Level, msg:str, *args):
+        """Adds a log message about this record, if level is at least log_level.
+        The message is only built in this case : msg can be a function returning the message,
+        or a %-style format string used with args.
+        Messages are stored as strings so reports can be sent between processes"""
+        if level.value < self.log_level.value:
+            return
+        self.logs.append((level, render_message(msg, args)))
+
+    @contextmanager
+    def timer(self, stage:str):
+        """Adds the time spent in the with block to the timings of this stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((stage, time.perf_counter() - start))
+
+class Field_Summary(object):
+    """What the deduping needs to know about a field, computed in a single pass over its subfields"""
+    __slots__ = ("field", "auth_id", "nb_koha_id", "nb_ppn", "alphascript_priority", "dead")
+
+    def __init__(self, field:pymarc.field.Field, authorities=None):
+        self.field = field
+        koha_ids:List[str] = []
+        nb_ppn = 0
+        first_7 = None
+        for subfield in field.subfields:
+            if subfield.code == "9":
+                koha_ids.append(subfield.value)
+            elif subfield.code == "3":
+                nb_ppn += 1
+            elif subfield.code == "7" and first_7 is None:
+                first_7 = subfield.value
+        self.auth_id:str = "-".join(koha_ids)
+        self.nb_koha_id = len(koha_ids)
+        self.nb_ppn = nb_ppn
+        self.alphascript_priority = get_alphascript_priority_from_value(first_7)
+        # At least one $9 is not in the authority index (never if there is no index)
+        self.dead = authorities is not None and any(not koha_id in authorities for koha_id in koha_ids)
+
+class Preferred_Field(object):
+    """Must be used after ensuring the field has at least 1 $9"""
+    def __init__(self, field:pymarc.field.Field|Field_Summary):
+        if not isinstance(field, Field_Summary):
+            field = Field_Summary(field)
+        self.id:str = field.auth_id
+        self.old:Field_Summary = None
+        self.current:Field_Summary = None
+        self.update_with_new_field(field)
+    
+    def update_with_new_field(self, field:pymarc.field.Field|Field_Summary) -> bool:
+        """Updates the authority with new field.
+        Returns if the new field is used instead of the old one"""
+        if not isinstance(field, Field_Summary):
+            field = Field_Summary(field)
+        # If no current field was used, adds it and end here
+        if self.current == None:
+            self.current = field
+            return True
+        # If the field already existed, checks if there are PPN
+        if field.nb_ppn > 0:
+            # Checks if current field has PPN
+            # If not, replace the olf field
+            if not self.has_ppn:
+                self.__replace_current_field(field)
+                return True
+            # If there are PPN, checks which field is the closest to
+            # the same of Koha ID & PPN
+            if not self.nb_ppn_match_nb_ids:
+                # If new field is closer to the perfect match, replace it
+                if abs(field.nb_koha_id - field.nb_ppn) < abs(self.nb_koha_id - self.nb_ppn):
+                    self.__replace_current_field(field)
+                    return True
+                
+                # If the difference bewten nb of PPN & nb of Koha ID is the
+                # same between both check for $7 Alphabet/Script priority
+                elif abs(field.nb_koha_id - field.nb_ppn) == abs(self.nb_koha_id - self.nb_ppn):
+                    if self.__new_field_has_alphascript_priority(field):
+                        self.__replace_current_field(field)
+                        return True
+            # Current field has same nb of PPN as Koha ID, if new field
+            # is in the same situation, check for $7 Alphabet/Script priority 
+            if field.nb_koha_id == field.nb_ppn:
+                if self.__new_field_has_alphascript_priority(field):
+                    self.__replace_current_field(field)
+                    return True
+        # New field has no PPN, if current field also has no PPN :
+        # -> check for $7 Alphabet/Script priority 
+        if not self.has_ppn:
+            if self.__new_field_has_alphascript_priority(field):
+                self.__replace_current_field(field)
+                return True   
+
+        # By default, return False
+        return False
+
+    @property
+    def current_field(self) -> pymarc.field.Field|None:
+        """Returns the field currently used for this authority"""
+        if self.current == None:
+            return None
+        return self.current.field
+
+    @property
+    def old_field(self) -> pymarc.field.Field|None:
+        """Returns the field previously used for this authority"""
+        if self.old == None:
+            return None
+        return self.old.field
+
+    @property
+    def nb_koha_id(self) -> int:
+        """Returns the number of $9 in current field.
+        Returns -1 if no current field is defined"""
+        if self.current == None:
+            return -1
+        return self.current.nb_koha_id
+
+    @property
+    def nb_ppn(self) -> int:
+        """Returns the number of $3 in current field.
+        Returns -1 if no current field is defined"""
+        if self.current == None:
+            return -1
+        return self.current.nb_ppn
+
+    @property
+    def has_ppn(self) -> bool:
+        """Returns if current field has PPN"""
+        return self.nb_ppn > 0
+    
+    @property
+    def nb_ppn_match_nb_ids(self) -> bool:
+        """Returns if the number of PPN matches the number of IDs"""
+        return self.nb_ppn == self.nb_koha_id
+
+    @property
+    def alphascript_priority(self) -> AlphaScript_Priority:
+        """Returns current field Alphabet/Script priority"""
+        if self.current == None:
+            return AlphaScript_Priority.NONE
+        return self.current.alphascript_priority
+
+    def __replace_current_field(self, field:Field_Summary):
+        self.old = self.current
+        self.current = field
+    
+    def __new_field_has_alphascript_priority(self, field:Field_Summary) -> bool:
+        return field.alphascript_priority > self.alphascript_priority
+
+# ----------------- Functions definition -----------------
+def parse_tag(value:str) -> str|None:
+    """Returns a datafield tag as 3 characters (10 -> 010).
+    Returns None if value is not a datafield tag"""
+    tag_as_int = validate_int(value)
+    if tag_as_int > 9 and tag_as_int < 1000:
+        return f"{tag_as_int:03d}"
+    return None
+
+def parse_tags(raw_tags:str|None) -> List[str]:
+    """Returns the datafield tags of a comma separated list, like SUBJECTS_TAG"""
+    output = []
+    for tag in (raw_tags or "").split(","):
+        tag = parse_tag(tag)
+        if tag is not None:
+            output.append(tag)
+    return output
+
+def get_auth_id(field:pymarc.field.Field) -> str:
+    """Returns the auth id of a field"""
+    return "-".join(field.get_subfields("9"))
+
+def get_dead_auth_policy(name:str|None) -> Dead_Auth_Policy|None:
+    """Returns the Dead_Auth_Policy matching a name (flag or merge).
+    Returns None if the name is not a policy (like none) : authority IDs are not checked"""
+    for policy in Dead_Auth_Policy:
+        if type(name) == str and name.strip().lower() == policy.value:
+            return policy
+    return None
+
+def get_heading(field:pymarc.field.Field) -> Tuple[Tuple[str, str], ...]:
+    """Returns the letter subfields of a field, normalized to compare headings"""
+    return tuple((subfield.code, " ".join(subfield.value.split()).casefold()) for subfield in field.subfields if subfield.code.isalpha())
+
+def get_alphascript_priority(field:pymarc.field.Field) -> AlphaScript_Priority:
+    """Returns the field alphabet/Script Priority.
+    $7='ba0yba0y' > $7='ba' > $7=other / none"""
+    return get_alphascript_priority_from_value(field.get("7"))
+
+def get_alphascript_priority_from_value(value:str|None) -> AlphaScript_Priority:
+    """Returns the alphabet/Script Priority of the first $7 value (None if there is no $7)"""
+    if value == "ba0yba0y":
+        return AlphaScript_Priority.TOP
+    elif value == "ba":
+        return AlphaScript_Priority.MID
+    return AlphaScript_Priority.NONE
+
+def dedupe_record(record:pymarc.record.Record, tags:List[str], report:Record_Report, authorities=None, dead_auth_policy:Dead_Auth_Policy=Dead_Auth_Policy.FLAG) -> bool:
+    """Removes multiple occurence of fields sharing the same $9, for all tags at once.
+    Walks the record fields once, then rebuilds the fields list in place :
+    kept fields stay at their original position
+
+    If authorities (api.authority_index.Authority_Index) is provided, fields with a $9
+    not in it are handled according to dead_auth_policy
+
+    Returns a bool to know if the record was edited"""
+    wanted_tags = set(tags)
+    # For each tag, index of authority IDs
+    auth_id_indexes:Dict[str, Dict[str, Preferred_Field]] = {tag:{} for tag in wanted_tags}
+    nb_fields:Dict[str, int] = {tag:0 for tag in wanted_tags}
+    nb_deleted:Dict[str, int] = {tag:0 for tag in wanted_tags}
+    deleted_fields = set()
+    dead_fields:List[Field_Summary] = []
+    for field in record.fields:
+        if not field.tag in wanted_tags:
+            continue
+        tag = field.tag
+        nb_fields[tag] += 1
+        # If no authority ID, keep the field but log a warning
+        if not field.get("9"):
+            field_as_string = marc_utils.field_as_string(field)
+            report.error(Error_Types.WARNING_FIELD_WITHOUT_AUTHORITY_ID, msg=field_as_string)
+            report.log(Level.WARNING, "Field without authority ID : %s", field_as_string)
+            continue
+        # Subfields are only read once per field
+        summary = Field_Summary(field, authorities)
+        if summary.dead:
+            dead_fields.append(summary)
+        # For info purpose, checks if multiple $9
+        # RAMEAU terms might have multiple $9 ($a-$x), with different combination possible
+        # 1.1 : Keeping this behaviour evenn if new class might have tools to deals wiht it better
+        if summary.nb_koha_id > 1:
+            field_as_string = marc_utils.field_as_string(field)
+            report.error(Error_Types.WARNING_MULTIPLE_AUTHORITY_ID_IN_ONE_FIELD, msg=field_as_string)
+            report.log(Level.WARNING, "Field has multiple authority ID : %s", field_as_string)
+        # Get auth ID to check against index
+        auth_id = summary.auth_id
+        auth_id_index = auth_id_indexes[tag]
+        # If this auth_id does not exist, adds it to the index
+        if not auth_id in auth_id_index:
+            auth_id_index[auth_id] = Preferred_Field(summary)
+        # If it does exist, dedupes it
+        else:
+            changed = auth_id_index[auth_id].update_with_new_field(summary)
+            deleted_field = field
+            if changed:
+                deleted_field = auth_id_index[auth_id].old_field
+                report.log(Level.INFO, lambda: f"Replacing preferred field for authority ID {auth_id} from {marc_utils.field_as_string(auth_id_index[auth_id].old_field)} to {marc_utils.field_as_string(auth_id_index[auth_id].current_field)}")
+            # Log an info + report
+            report.log(Level.INFO, lambda: f"Deduping on authority ID {auth_id} : {marc_utils.field_as_string(deleted_field)}")
+            report.deleted_field(tag, auth_id, deleted_field, auth_id_index[auth_id].current_field)
+            deleted_fields.add(id(deleted_field))
+            nb_deleted[tag] += 1
+
+    # Once loop is over, handle fields pointing to deleted authorities
+    for summary in dead_fields:
+        if id(summary.field) in deleted_fields:
+            continue
+        tag = summary.field.tag
+        replaced_by = None
+        if dead_auth_policy == Dead_Auth_Policy.MERGE:
+            replaced_by = find_live_field(summary.field, auth_id_indexes[tag], deleted_fields)
+        if replaced_by is None:
+            field_as_string = marc_utils.field_as_string(summary.field)
+            report.error(Error_Types.WARNING_DEAD_AUTHORITY_ID, msg=field_as_string)
+            report.log(Level.WARNING, "Field authority ID does not exist : %s", field_as_string)
+            continue
+        report.log(Level.INFO, lambda: f"Merging field with deleted authority ID {summary.auth_id} into {marc_utils.field_as_string(replaced_by)}")
+        report.deleted_field(tag, summary.auth_id, summary.field, replaced_by)
+        deleted_fields.add(id(summary.field))
+        nb_deleted[tag] += 1
+
+    # Check each defined auth_id has a field
+    for tag in dict.fromkeys(tags):
+        for auth_id in auth_id_indexes[tag]:
+            if auth_id_indexes[tag][auth_id].current_field == None:
+                report.error(Error_Types.AUTH_ID_HAS_NO_CURRENT_FIELD, msg=f"{auth_id} is defined in Index but has no current field")
+                report.log(Level.ERROR, f"{auth_id} is defined in Index but has no current field")
+
+    # Check which tags had duplicates
+    record_was_changed = False
+    for tag in dict.fromkeys(tags):
+        if nb_deleted[tag] == 0:
+            report.log(Level.INFO, "Tag %s did not have duplicates", tag)
+            continue
+        report.log(Level.INFO, "Tag %s had duplicates : removing them", tag)
+        record_was_changed = True
+    if not record_was_changed:
+        return False
+
+    # Remove deleted fields in place, keeping the order of the other fields
+    record.fields[:] = [field for field in record.fields if not id(field) in deleted_fields]
+    return True
+
+def find_live_field(field:pymarc.field.Field, auth_id_index:Dict[str, Preferred_Field], deleted_fields:set) -> pymarc.field.Field|None:
+    """Returns the first kept field of the index whose authority exists & with the same heading as field, or None"""
+    heading = get_heading(field)
+    for preferred_field in auth_id_index.values():
+        current = preferred_field.current
+        if current is None or current.dead or id(current.field) in deleted_fields:
+            continue
+        if get_heading(current.field) == heading:
+            return current.field
+    return None
+
+def dedupe_field(record:pymarc.record.Record, tag:str, report:Record_Report) -> bool:
+    """Removes multiple occurence of fields sharing the same $9
+
+    Returns a bool to know if the record was edited"""
+    return dedupe_record(record, [tag], report)
+
+def has_duplicate_auth_ids(raw_record:bytes, tags:List[str], authorities=None) -> bool:
+    """Byte-level pre-scan of a raw MARC (ISO 2709) record WITHOUT parsing it with pymarc.
+    Returns if at least 2 fields of one of the tags share the same auth id (see get_auth_id()),
+    or if one of their $9 is not in authorities (if provided),
+    i.e. if dedupe_record() could change or report the record.
+    Returns True if the record can not be pre-scanned, so pymarc handles (& reports) it"""
+    try:
+        # Invalid leaders raise a ValueError
+        if int(raw_record[0:5]) != len(raw_record):
+            return True
+        base_address = int(raw_record[12:17])
+        # No $9 at all : nothing to dedupe
+        if not b"\x1f9" in raw_record:
+            return False
+        directory = raw_record[24:base_address - 1]
+        wanted_tags = set(tag.encode() for tag in tags)
+        seen_auth_ids = set()
+        for pos in range(0, len(directory) - 11, 12):
+            tag = directory[pos:pos + 3]
+            if not tag in wanted_tags:
+                continue
+            length = int(directory[pos + 3:pos + 7])
+            start = base_address + int(directory[pos + 7:pos + 12])
+            # Same slicing as pymarc : removes the field terminator, 1st element is the indicators
+            subfields = raw_record[start:start + length - 1].split(b"\x1f")[1:]
+            auth_ids = [subfield[1:] for subfield in subfields if subfield[:1] == b"9"]
+            # Fields without authority ID (or with an empty 1st $9) are always kept
+            if len(auth_ids) < 1 or auth_ids[0] == b"":
+                continue
+            if authorities is not None and any(not auth_id in authorities for auth_id in auth_ids):
+                return True
+            auth_id = (tag, b"-".join(auth_ids))
+            if auth_id in seen_auth_ids:
+                return True
+            seen_auth_ids.add(auth_id)
+    except ValueError:
+        return True
+    return False
+
+def get_bibnb_from_record(record:pymarc.record.Record|bytes) -> int|None:
+    """Returns the biblionumber (001) of a parsed or raw record, or None"""
+    if type(record) == bytes:
+        bibnb = validate_int(get_raw_marc_control_field(record, "001"))
+    else:
+        bibnb = validate_int(record["001"].data if record.get("001") else None)
+    if bibnb < 1:
+        return None
+    return bibnb
+
+def process_raw_record(raw_record:bytes, tags:List[str], report:Record_Report, prescan:bool=False, authorities=None, dead_auth_policy:Dead_Auth_Policy=Dead_Auth_Policy.FLAG) -> pymarc.record.Record|None:
+    """Parses the record & removes duplicates for each subject tag.
+    Returns the edited record, or None if the record must not be updated
+
+    If prescan is True, records without duplicates are detected by has_duplicate_auth_ids()
+    and never parsed (so their fields warnings are not reported).
+    See dedupe_record() for authorities & dead_auth_policy"""
+    if prescan:
+        with report.timer("prescan"):
+            has_duplicates = has_duplicate_auth_ids(raw_record, tags, authorities)
+    # Records without a valid biblionumber (offline mode) are parsed so the problem is reported
+    if prescan and not has_duplicates and report.bibnb is not None:
+        report.error(Error_Types.RECORD_WAS_NOT_CHANGED)
+        report.log(Level.INFO, "Record was not changed (pre-scan found no duplicates)")
+        report.outcome = Outcome.NOT_CHANGED
+        return None
+
+    # Parse record
+    record = None
+    try:
+        with report.timer("parse"):
+            record = pymarc.record.Record(data=raw_record, to_unicode=True, force_utf8=True)
+    except:
+        report.error(Error_Types.FAILED_TO_PARSE_MARC)
+        report.log(Level.ERROR, "Failed to parse MARC record")
+        report.outcome = Outcome.ERROR
+        return None
+    return process_record(record, tags, report, authorities, dead_auth_policy)
+
+def process_record(record:pymarc.record.Record|None, tags:List[str], report:Record_Report, authorities=None, dead_auth_policy:Dead_Auth_Policy=Dead_Auth_Policy.FLAG) -> pymarc.record.Record|None:
+    """Removes duplicates for each subject tag of a parsed record.
+    Returns the edited record, or None if the record must not be updated.
+    See dedupe_record() for authorities & dead_auth_policy"""
+    # If record is invalid
+    if record is None:
+        report.error(Error_Types.NO_RECORD)
+        report.log(Level.ERROR, "Record is empty / invalid")
+        report.outcome = Outcome.ERROR
+        return None # Fatal error, skipp
+
+    # Checks that there is a biblionumber for PUT
+    if not record.get("001"):
+        report.error(Error_Types.NO_BIBNB_IN_RECORD)
+        report.log(Level.ERROR, "Record has no biblionumber")
+        report.outcome = Outcome.ERROR
+        return None
+
+    # Dedupe the fields of all subject tags at once
+    with report.timer("dedupe"):
+        record_was_changed = dedupe_record(record, tags, report, authorities, dead_auth_policy)
+
+    # If the record was not changed, log and go to next record
+    if not record_was_changed:
+        # Output the info in error file as records sent to the script should change
+        report.error(Error_Types.RECORD_WAS_NOT_CHANGED)
+        report.log(Level.INFO, "Record was not changed")
+        report.outcome = Outcome.NOT_CHANGED
+        return None
+    return record
+
+def check_get_response(raw_record:bytes|Koha_Api_Errors, report:Record_Report) -> bytes|None:
+    """Returns the raw record, or None (& reports it) if the GET API returned an error"""
+    # An error occured while getting the record, log & skip to next one
+    if type(raw_record) == Koha_Api_Errors:
+        report.error(Error_Types.REQUESTS_GET_ERROR, msg=raw_record.name)
+        report.log(Level.ERROR, f"An error happened with the API trying to get the record : {raw_record.name}")
+        report.outcome = Outcome.ERROR
+        return None
+    return raw_record
+
+def stage_record(record:pymarc.record.Record, report:Record_Report) -> None:
+    """Plan mode : keeps the edited record in the report instead of sending it to Koha.
+    Always returns None, as the record must not be updated"""
+    with report.timer("serialize"):
+        report.staged = record.as_marc()
+    report.outcome = Outcome.STAGED
+    report.log(Level.INFO, "Record was staged without duplicates")
+    return None
+
+def check_staged_version(raw_record:bytes, version:str|None, report:Record_Report) -> bool:
+    """Apply mode : returns if the record in Koha still has the 005 it had when it was staged.
+    Reports it otherwise"""
+    current_version = get_raw_marc_control_field(raw_record, "005")
+    if current_version != version:
+        report.error(Error_Types.STAGED_RECORD_CHANGED, msg=f"005 was {version}, is now {current_version}")
+        report.log(Level.WARNING, f"Record was edited since it was staged (005 was {version}, is now {current_version}), it will not be updated")
+        report.outcome = Outcome.ERROR
+        return False
+    return True
+
+def check_put_response(update_response:bytes|Koha_Api_Errors, report:Record_Report) -> bool:
+    """Reports the PUT API response.
+    Returns if the record was updated"""
+    # Cache only : the record would have been updated
+    if update_response == Koha_Api_Errors.RECORD_NOT_SENT_CACHE_ONLY:
+        report.error(Error_Types.NOT_SENT_CACHE_ONLY)
+        report.log(Level.INFO, "Record was not sent (cache only)")
+        report.outcome = Outcome.NOT_SENT
+        return False
+    # An error occured while getting the record, log & skip to next one
+    if type(update_response) == Koha_Api_Errors:
+        report.error(Error_Types.REQUESTS_PUT_ERROR, msg=update_response.name)
+        report.log(Level.ERROR, f"An error happened with the API trying to update the record : {update_response.name}")
+        report.outcome = Outcome.ERROR
+        return False
+
+    # Report & log
+    report.updated = True
+    report.outcome = Outcome.UPDATED
+    report.log(Level.INFO, "Record was updated without duplicates")
+    return True
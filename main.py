@@ -5,16 +5,31 @@
 # external imports
 import os
 import dotenv
-import csv
-from typing import Dict, List
-from enum import Enum, IntEnum
+import argparse
+import asyncio
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple
 import pymarc
 
 # Internal imports
-from api.Koha_REST_API_Client import KohaRESTAPIClient, Content_Type, Status as Koha_Api_Status, Errors as Koha_Api_Errors, validate_int
-from api.cl_log import Logger, Level
+from api.Koha_REST_API_Client import KohaRESTAPIClient, AsyncKohaRESTAPIClient, Content_Type, Status as Koha_Api_Status, Errors as Koha_Api_Errors, validate_int
+from api.cl_log import Logger, Level, get_level
+from api.adaptive_limiter import Adaptive_Limiter
+from api.metrics import Metrics, Progress
+from api.profiling import Profiler, get_profile_mode
 from api.func_file_check import check_file_existence, check_dir_existence
+from api.journal import Journal
+from api.staging import Run_Mode, Staged_Status, Staging_Store, get_run_mode
+from api.authority_index import Authority_Index, get_index_age
+from api.report_sink import Report_Sink, Compression, get_report_format, get_compression, get_report_path
+import api.report_sink as report_sink
+from api.marc_dump import Dump_Format, Marc_Dump_Writer, detect_dump_format, iter_marcxml_raw_records, iter_raw_marc_records, marcxml_to_record
 import api.marc_utils_5 as marc_utils
+import dedupe
+from dedupe import Error_Types, Outcome, Record_Report, Dead_Auth_Policy, get_dead_auth_policy
+import sharding
 
 # Load paramaters
 dotenv.load_dotenv()
@@ -22,25 +37,12 @@ dotenv.load_dotenv()
 SERVICE = "Koha_Remove_Subjects_Dupes"
 # Load tags
 RAW_SUBJECT_TAGS=os.getenv("SUBJECTS_TAG")
-SUBJECT_TAGS:List[str] = []
 # Parse tags and make sure they are datafields
-for tag in RAW_SUBJECT_TAGS.split(","):
-    tag_as_int = validate_int(tag)
-    if tag_as_int > 9 and tag_as_int < 1000:
-        if tag_as_int < 100:
-            SUBJECT_TAGS.append("0" + str(tag_as_int))
-        else:
-            SUBJECT_TAGS.append(str(tag_as_int))
+SUBJECT_TAGS:List[str] = dedupe.parse_tags(RAW_SUBJECT_TAGS)
 # if no tag was kept, exit
 if len(SUBJECT_TAGS) < 1:
     print(r"/!\ No tag is set to be deduped /!\ ")
     exit()
-# Load input file
-INPUT_FILE_PATH = os.path.abspath(os.getenv("INPUT_FILE"))
-# Leaves if the file doesn't exists
-if not check_file_existence(INPUT_FILE_PATH):
-    print(r"/!\ Input file does not exist /!\ ")
-    exit()
 # Load output folder
 OUTPUT_PATH = os.path.abspath(os.getenv("OUTPUT_PATH"))
 # Check if folder exist, creates if not folder or leave if it can not
@@ -49,346 +51,816 @@ if not check_dir_existence(OUTPUT_PATH):
     exit()
 # Load other stuff
 RECORD_NB_LIMIT = validate_int(os.getenv("RECORD_NB_LIMIT"), 500)
-
-# ----------------- Enum definition -----------------
-class Error_Types(Enum):
-    REQUESTS_GET_ERROR = 0
-    SECURITY_STOP = 1
-    REQUESTS_PUT_ERROR = 2
-    BIBNB_IS_INCORRECT = 10
-    NO_RECORD = 20
-    NO_BIBNB_IN_RECORD = 21
-    FAILED_TO_PARSE_MARC = 21
-    WARNING_FIELD_WITHOUT_AUTHORITY_ID = 30
-    RECORD_WAS_NOT_CHANGED = 31
-    WARNING_MULTIPLE_AUTHORITY_ID_IN_ONE_FIELD = 32
-    AUTH_ID_HAS_NO_CURRENT_FIELD = 33
-
-class AlphaScript_Priority(IntEnum):
-    NONE = 0
-    MID = 5
-    TOP = 10
+LOG_LEVEL = get_level(os.getenv("LOG_LEVEL"), Level.INFO)
+LOG_LEVEL_CONSOLE = get_level(os.getenv("LOG_LEVEL_CONSOLE"), LOG_LEVEL)
+# Records reports only keep messages that at least one handler writes
+REPORT_LOG_LEVEL = min(LOG_LEVEL, LOG_LEVEL_CONSOLE, key=lambda level: level.value)
+LOG_ASYNC = validate_int(os.getenv("LOG_ASYNC"), 0) > 0
+LOG_QUEUE_SIZE = validate_int(os.getenv("LOG_QUEUE_SIZE"), 10000)
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY")
+# Load command line arguments (they override environment variables)
+ARG_PARSER = argparse.ArgumentParser(description="Remove duplicate subject fields from Koha records")
+ARG_PARSER.add_argument("--workers", type=int, default=validate_int(os.getenv("WORKERS"), 1),
+                        help="Number of concurrent GET & PUT workers. 1 processes records sequentially")
+ARG_PARSER.add_argument("--async-concurrency", type=int, default=validate_int(os.getenv("ASYNC_CONCURRENCY"), 0),
+                        help="Process records on an asyncio event loop with this many requests in flight (requires aiohttp). 0 disables it")
+ARG_PARSER.add_argument("--batch-size", type=int, default=validate_int(os.getenv("BATCH_SIZE"), 0),
+                        help="Retrieve records by batches of this size using Koha biblio list API. 0 retrieves them one by one")
+ARG_PARSER.add_argument("--dump", default=os.getenv("INPUT_MARC_FILE"),
+                        help="Process a local MARC export (ISO 2709 or MARCXML) instead of using Koha REST APIs")
+ARG_PARSER.add_argument("--processes", type=int, default=validate_int(os.getenv("PROCESSES"), 1),
+                        help="Number of worker processes deduping records. 1 uses only the main process")
+ARG_PARSER.add_argument("--prescan", action="store_true", default=validate_int(os.getenv("PRESCAN"), 0) > 0,
+                        help="Skip raw MARC records without duplicate authority IDs before parsing them")
+ARG_PARSER.add_argument("--resume", action="store_true", default=validate_int(os.getenv("RESUME"), 0) > 0,
+                        help="Resume an interrupted run : skip the records listed in the journal & append to the reports")
+ARG_PARSER.add_argument("--mode", choices=[mode.value for mode in Run_Mode], default=get_run_mode(os.getenv("RUN_MODE")).value,
+                        help="run : retrieve, dedupe & update records. plan : stage edited records instead of updating them. apply : update the staged records")
+ARG_PARSER.add_argument("--cache-only", action="store_true", default=validate_int(os.getenv("KOHA_CACHE_ONLY"), 0) > 0,
+                        help="Only use records from KOHA_CACHE_FILE : Koha is never contacted & edited records are not sent")
+ARG_PARSER.add_argument("--authority-check", choices=["none"] + [policy.value for policy in Dead_Auth_Policy], default=os.getenv("AUTHORITY_CHECK") or "none",
+                        help="Check subject fields $9 against the authorities existing in Koha. flag : report fields with a deleted authority. merge : also delete them if a kept field has the same heading")
+ARGS = ARG_PARSER.parse_args()
+PRESCAN:bool = ARGS.prescan
+RUN_MODE = get_run_mode(ARGS.mode)
+STAGING_FILE_PATH = os.path.abspath(os.getenv("STAGING_FILE") or os.path.join(OUTPUT_PATH, "KRSD_staging.sqlite"))
+RESUME:bool = ARGS.resume
+PROCESSES = max(ARGS.processes, 1)
+WORKERS = max(ARGS.workers, 1)
+ASYNC_CONCURRENCY = max(ARGS.async_concurrency, 0)
+BATCH_SIZE = max(ARGS.batch_size, 0)
+# Load input file
+INPUT_MARC_FILE_PATH = None
+if ARGS.dump:
+    if RUN_MODE != Run_Mode.RUN:
+        print(r"/!\ plan & apply modes can not be used with a local MARC export /!\ ")
+        exit()
+    INPUT_FILE_PATH = os.path.abspath(ARGS.dump)
+    INPUT_MARC_FILE_PATH = INPUT_FILE_PATH
+elif RUN_MODE == Run_Mode.APPLY:
+    # Records come from the staging store
+    INPUT_FILE_PATH = STAGING_FILE_PATH
+else:
+    INPUT_FILE_PATH = os.path.abspath(os.getenv("INPUT_FILE"))
+# Leaves if the file doesn't exists
+if not check_file_existence(INPUT_FILE_PATH):
+    print(r"/!\ Input file does not exist /!\ ")
+    exit()
+# Load report files settings
+REPORT_FORMAT = get_report_format(os.getenv("REPORT_FORMAT"))
+REPORT_COMPRESSION = get_compression(os.getenv("REPORT_COMPRESSION"))
+if REPORT_COMPRESSION == Compression.ZSTD and report_sink.zstandard is None:
+    print(r"/!\ zstd compression requires zstandard /!\ ")
+    exit()
+REPORT_BUFFER_SIZE = validate_int(os.getenv("REPORT_BUFFER_SIZE"), 1048576)
+REPORT_FLUSH_INTERVAL = float(os.getenv("REPORT_FLUSH_INTERVAL") or 5)
+# Compressed files can not be truncated to the last journal checkpoint
+if RESUME and REPORT_COMPRESSION != Compression.NONE:
+    print(r"/!\ --resume does not support compressed reports /!\ ")
+    exit()
+# Load journal settings
+JOURNAL_SYNC_EVERY = validate_int(os.getenv("JOURNAL_SYNC_EVERY"), 100)
+JOURNAL_SYNC_INTERVAL = float(os.getenv("JOURNAL_SYNC_INTERVAL") or 1)
+# Load metrics settings
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL") or 30)
+METRICS_PROMETHEUS_FILE = os.getenv("METRICS_PROMETHEUS_FILE") or None
+# Load profiling settings
+PROFILE_MODE = get_profile_mode(os.getenv("PROFILE"))
+PROFILE_TOP = validate_int(os.getenv("PROFILE_TOP"), 30)
+PROFILE_MEMORY_EVERY = validate_int(os.getenv("PROFILE_MEMORY_EVERY"), 1000)
+# Load HTTP session settings
+KOHA_POOL_SIZE = validate_int(os.getenv("KOHA_POOL_SIZE"), 10)
+KOHA_MAX_RETRIES = validate_int(os.getenv("KOHA_MAX_RETRIES"), 3)
+KOHA_BACKOFF_FACTOR = float(os.getenv("KOHA_BACKOFF_FACTOR") or 0.5)
+KOHA_CONNECT_TIMEOUT = float(os.getenv("KOHA_CONNECT_TIMEOUT") or 5)
+KOHA_READ_TIMEOUT = float(os.getenv("KOHA_READ_TIMEOUT") or 60)
+KOHA_TOKEN_REFRESH_MARGIN = float(os.getenv("KOHA_TOKEN_REFRESH_MARGIN") or 60)
+# Load record cache settings
+KOHA_CACHE_FILE = os.getenv("KOHA_CACHE_FILE") or None
+KOHA_CACHE_ONLY:bool = ARGS.cache_only
+if KOHA_CACHE_ONLY and KOHA_CACHE_FILE is None:
+    print(r"/!\ --cache-only requires KOHA_CACHE_FILE /!\ ")
+    exit()
+if KOHA_CACHE_ONLY and RUN_MODE == Run_Mode.APPLY:
+    print(r"/!\ apply mode can not be used with --cache-only /!\ ")
+    exit()
+# Apply mode compares the staged 005 with the one in Koha : it must never read a cached record
+if RUN_MODE == Run_Mode.APPLY:
+    KOHA_CACHE_FILE = None
+KOHA_CACHE_SETTINGS = {
+    "cache_file":KOHA_CACHE_FILE,
+    "cache_ttl":float(os.getenv("KOHA_CACHE_TTL") or 3600),
+    "cache_max_size":validate_int(os.getenv("KOHA_CACHE_MAX_SIZE"), 1073741824),
+    "cache_only":KOHA_CACHE_ONLY,
+    # Run mode sends the deduped records : they must be the current ones, a cached one could have been edited in Koha since
+    # Plan mode is safe, apply mode checks the 005 of the staged records
+    "read_cached_biblios":KOHA_CACHE_ONLY or RUN_MODE == Run_Mode.PLAN
+}
+# Load authority check settings
+AUTHORITY_CHECK = get_dead_auth_policy(ARGS.authority_check)
+# Apply mode sends records deduped when they were planned
+if RUN_MODE == Run_Mode.APPLY:
+    AUTHORITY_CHECK = None
+AUTHORITY_INDEX_FILE = os.getenv("AUTHORITY_INDEX_FILE") or None
+if AUTHORITY_INDEX_FILE:
+    AUTHORITY_INDEX_FILE = os.path.abspath(AUTHORITY_INDEX_FILE)
+AUTHORITY_INDEX_MAX_AGE = float(os.getenv("AUTHORITY_INDEX_MAX_AGE") or 86400)
+AUTHORITY_PAGE_SIZE = validate_int(os.getenv("AUTHORITY_PAGE_SIZE"), 1000)
+AUTHORITY_PREFETCH = validate_int(os.getenv("AUTHORITY_PREFETCH"), 2)
+if AUTHORITY_CHECK is not None and KOHA_CACHE_ONLY and (AUTHORITY_INDEX_FILE is None or not os.path.exists(AUTHORITY_INDEX_FILE)):
+    print(r"/!\ --cache-only with an authority check requires an existing AUTHORITY_INDEX_FILE /!\ ")
+    exit()
+# Set by the main process before processing records
+AUTHORITIES:Authority_Index|None = None
+# Load adaptive limiter settings
+ADAPTIVE_MAX_CONCURRENCY = validate_int(os.getenv("ADAPTIVE_MAX_CONCURRENCY"), 0)
+ADAPTIVE_MIN_CONCURRENCY = min(max(validate_int(os.getenv("ADAPTIVE_MIN_CONCURRENCY"), 1), 1), max(ADAPTIVE_MAX_CONCURRENCY, 1))
+ADAPTIVE_TARGET_LATENCY = float(os.getenv("ADAPTIVE_TARGET_LATENCY") or 2)
+CIRCUIT_BREAKER_COOLDOWN = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN") or 60)
+# The limiter drives concurrency : workers are sized for its maximum, it decides how many requests are in flight
+if ADAPTIVE_MAX_CONCURRENCY > 0 and INPUT_MARC_FILE_PATH is None and PROCESSES < 2:
+    if ASYNC_CONCURRENCY > 0 and RUN_MODE != Run_Mode.APPLY:
+        ASYNC_CONCURRENCY = ADAPTIVE_MAX_CONCURRENCY
+    else:
+        WORKERS = ADAPTIVE_MAX_CONCURRENCY
 
 # ----------------- Classes definition -----------------
-class Error_File(object):
-    def __init__(self, file_path:str) -> None:
-        self.path = file_path
-        self.file = open(self.path, "w", newline="", encoding='utf-8')
-        self.headers = ["error_type", "index", "bibnb", "message"]
-        self.writer = csv.DictWriter(self.file, extrasaction="ignore", fieldnames=self.headers, delimiter=";")
-        self.writer.writeheader()
+class Error_File(Report_Sink):
+    def __init__(self, file_path:str, **kwargs) -> None:
+        super().__init__(file_path, ["error_type", "index", "bibnb", "message"], **kwargs)
 
     def write(self, error_type:Error_Types, index:int=None, bibnb:int=None, msg:str=None):
-        # Use str to prevent crash if I'm stupid when coding
-        self.writer.writerow({
+        super().write({
             "error_type":error_type.name,
-            "index":str(index),
-            "bibnb":str(bibnb),
-            "message":str(msg)
+            "index":index,
+            "bibnb":bibnb,
+            "message":msg
             })
 
-    def close(self):
-        self.file.close()
-
-class Report_Deleted_Fields_File(object):
-    def __init__(self, file_path:str) -> None:
-        self.path = file_path
-        self.file = open(self.path, "w", newline="", encoding='utf-8')
-        self.headers = ["bibnb", "index", "tag", "auth_id", "field", "replaced_by"]
-        self.writer = csv.DictWriter(self.file, extrasaction="ignore", fieldnames=self.headers, delimiter=";")
-        self.writer.writeheader()
-
-    def write(self, bibnb:int, index:int, tag:str, auth_id:str, field:pymarc.field.Field, replaced_by:pymarc.field.Field):
-        # Use str to prevent crash if I'm stupid when coding
-        self.writer.writerow({
-            "bibnb":str(bibnb),
-            "index":str(index),
-            "tag":str(tag),
-            "auth_id":str(auth_id),
-            "field":marc_utils.field_as_string(field),
-            "replaced_by":marc_utils.field_as_string(replaced_by)
+class Report_Deleted_Fields_File(Report_Sink):
+    def __init__(self, file_path:str, **kwargs) -> None:
+        super().__init__(file_path, ["bibnb", "index", "tag", "auth_id", "field", "replaced_by"], **kwargs)
+
+    def write(self, bibnb:int, index:int, tag:str, auth_id:str, field:pymarc.field.Field|str, replaced_by:pymarc.field.Field|str):
+        # Fields can be provided already as strings
+        if type(field) != str:
+            field = marc_utils.field_as_string(field)
+        if type(replaced_by) != str:
+            replaced_by = marc_utils.field_as_string(replaced_by)
+        super().write({
+            "bibnb":bibnb,
+            "index":index,
+            "tag":tag,
+            "auth_id":auth_id,
+            "field":field,
+            "replaced_by":replaced_by
             })
 
-    def close(self):
-        self.file.close()
-
-class Report_Updated_Bibnb_File(object):
-    def __init__(self, file_path:str) -> None:
-        self.path = file_path
-        self.file = open(self.path, "w", newline="", encoding='utf-8')
+class Report_Updated_Bibnb_File(Report_Sink):
+    def __init__(self, file_path:str, **kwargs) -> None:
+        # One biblionumber per line
+        super().__init__(file_path, ["bibnb"], write_header=False, line_terminator="\n", **kwargs)
 
     def write(self, bibnb:int):
-        # Use str to prevent crash if I'm stupid when coding
-        self.file.write(f"{str(bibnb)}\n")
-
-    def close(self):
-        self.file.close()
-
-class Preferred_Field(object):
-    """Must be used after ensuring the field has at least 1 $9"""
-    def __init__(self, field:pymarc.field.Field):
-        self.id:str = get_auth_id(field)
-        self.old_field:pymarc.field.Field = None
-        self.current_field:pymarc.field.Field = None
-        self.update_with_new_field(field)
-    
-    def update_with_new_field(self, field:pymarc.field.Field) -> bool:
-        """Updates the authority with new field.
-        Returns if the new field is used instead of the old one"""
-        # If no current field was used, adds it and end here
-        if self.current_field == None:
-            self.current_field = field
-            return True
-        # If the field already existed, checks if there are PPN
-        if len(field.get_subfields("3")) > 0:
-            # Checks if current field has PPN
-            # If not, replace the olf field
-            if not self.has_ppn:
-                self.__replace_current_field(field)
-                return True
-            # If there are PPN, checks which field is the closest to
-            # the same of Koha ID & PPN
-            if not self.nb_ppn_match_nb_ids:
-                # If new field is closer to the perfect match, replace it
-                if abs(len(field.get_subfields("9")) - len(field.get_subfields("3"))) < abs(self.nb_koha_id - self.nb_ppn):
-                    self.__replace_current_field(field)
-                    return True
-                
-                # If the difference bewten nb of PPN & nb of Koha ID is the
-                # same between both check for $7 Alphabet/Script priority
-                elif abs(len(field.get_subfields("9")) - len(field.get_subfields("3"))) == abs(self.nb_koha_id - self.nb_ppn):
-                    if self.__new_field_has_alphascript_priority(field):
-                        self.__replace_current_field(field)
-                        return True
-            # Current field has same nb of PPN as Koha ID, if new field
-            # is in the same situation, check for $7 Alphabet/Script priority 
-            if len(field.get_subfields("9")) == len(field.get_subfields("3")):
-                if self.__new_field_has_alphascript_priority(field):
-                    self.__replace_current_field(field)
-                    return True
-        # New field has no PPN, if current field also has no PPN :
-        # -> check for $7 Alphabet/Script priority 
-        if not self.has_ppn:
-            if self.__new_field_has_alphascript_priority(field):
-                self.__replace_current_field(field)
-                return True   
-
-        # By default, return False
-        return False
-
-    @property
-    def nb_koha_id(self) -> int:
-        """Returns the number of $9 in current field.
-        Returns -1 if no current field is defined"""
-        if self.current_field == None:
-            return -1
-        return len(self.current_field.get_subfields("9"))
-
-    @property
-    def nb_ppn(self) -> int:
-        """Returns the number of $3 in current field.
-        Returns -1 if no current field is defined"""
-        if self.current_field == None:
-            return -1
-        return len(self.current_field.get_subfields("3"))
-
-    @property
-    def has_ppn(self) -> bool:
-        """Returns if current field has PPN"""
-        return self.nb_ppn > 0
-    
-    @property
-    def nb_ppn_match_nb_ids(self) -> bool:
-        """Returns if the number of PPN matches the number of IDs"""
-        return self.nb_ppn == self.nb_koha_id
-
-    @property
-    def alphascript_priority(self) -> AlphaScript_Priority:
-        """Returns current field Alphabet/Script priority"""
-        if self.current_field == None:
-            return AlphaScript_Priority.NONE
-        return get_alphascript_priority(self.current_field)
-
-    def __replace_current_field(self, field:pymarc.field.Field):
-        self.old_field = self.current_field
-        self.current_field = field
-    
-    def __new_field_has_alphascript_priority(self, field:pymarc.field.Field) -> bool:
-        return get_alphascript_priority(field) > self.alphascript_priority
-
-# ----------------- Functions definition -----------------
-def get_auth_id(field:pymarc.field.Field) -> str:
-    """Returns the auth id of a field"""
-    return "-".join(field.get_subfields("9"))
-
-def get_alphascript_priority(field:pymarc.field.Field) -> AlphaScript_Priority:
-    """Returns the field alphabet/Script Priority.
-    $7='ba0yba0y' > $7='ba' > $7=other / none"""
-    if len(field.get_subfields("7")) < 1:
-        return AlphaScript_Priority.NONE
-    if field.get_subfields("7")[0] == "ba0yba0y":
-        return AlphaScript_Priority.TOP
-    elif field.get_subfields("7")[0] == "ba":
-        return AlphaScript_Priority.MID
-    return AlphaScript_Priority.NONE
-
-def dedupe_field(record:pymarc.record.Record, tag:str, index:int=None, bibnb:int=None) -> bool:
-    """Removes multiple occurence of fields sharing the same $9
-    
-    Returns a bool to know if the record was edited"""
-    auth_id_index:Dict[str, Preferred_Field] = {}
-    fields:List[pymarc.field.Field] = []
-    for field in record.get_fields(tag):
-        # If no authority ID, keep the field but log a warning
-        if not field.get("9"):
-            ERRORS_FILE.write(Error_Types.WARNING_FIELD_WITHOUT_AUTHORITY_ID, index=index, bibnb=bibnb, msg=marc_utils.field_as_string(field))
-            LOG.record_message(Level.WARNING, index, bibnb, msg=f"Field without authority ID : {marc_utils.field_as_string(field)}")
-            fields.append(field)
-            continue
-        # For info purpose, checks if multiple $9
-        # RAMEAU terms might have multiple $9 ($a-$x), with different combination possible
-        # 1.1 : Keeping this behaviour evenn if new class might have tools to deals wiht it better
-        if len(field.get_subfields("9")) > 1:
-            ERRORS_FILE.write(Error_Types.WARNING_MULTIPLE_AUTHORITY_ID_IN_ONE_FIELD, index=index, bibnb=bibnb, msg=marc_utils.field_as_string(field))
-            LOG.record_message(Level.WARNING, index, bibnb, msg=f"Field has multiple authority ID : {marc_utils.field_as_string(field)}")
-        # Get auth ID to check against index
-        auth_id = get_auth_id(field)
-        # If this auth_id does not exist, adds it to the index
-        if not auth_id in auth_id_index:
-            auth_id_index[auth_id] = Preferred_Field(field)
-        # If it does exist, dedupes it
-        else:
-            changed = auth_id_index[auth_id].update_with_new_field(field)
-            deleted_field = field
-            if changed:
-                deleted_field = auth_id_index[auth_id].old_field
-                LOG.record_message(Level.INFO, index, bibnb, msg=f"Replacing preferred field for authority ID {auth_id} from {marc_utils.field_as_string(auth_id_index[auth_id].old_field)} to {marc_utils.field_as_string(auth_id_index[auth_id].current_field)}")
-            # Log an info + report
-            LOG.record_message(Level.INFO, index, bibnb, msg=f"Deduping on authority ID {auth_id} : {marc_utils.field_as_string(deleted_field)}")
-            DELETED_FIELD_FILE.write(bibnb, index, tag, auth_id, deleted_field, auth_id_index[auth_id].current_field)
-            continue
-    
-    # Once loop is over, for each defined auth_id, add the corretc field
-    for auth_id in auth_id_index:
-        if auth_id_index[auth_id].current_field != None:
-            fields.append(auth_id_index[auth_id].current_field)
-        else:
-            ERRORS_FILE.write(Error_Types.AUTH_ID_HAS_NO_CURRENT_FIELD, index=index, bibnb=bibnb, msg=f"{auth_id} is defined in Index but has no current field")
-            LOG.record_message(Level.ERROR, index, bibnb, msg=f"{auth_id} is defined in Index but has no current field")
-
-    # Once all fields are selected, check if there were duplicates for this tag
-    if len(fields) == len(record.get_fields(tag)):
-        LOG.record_message(Level.INFO, index, bibnb, msg=f"Tag {tag} did not have duplicates")
-        return False
-    
-    # If there were duplicates, remove fields from the record and 
-    LOG.record_message(Level.INFO, index, bibnb, msg=f"Tag {tag} had duplicates : removing them")
-    record.remove_fields(tag)
-    record.add_ordered_field(*fields) # don't forget the * before the list
-    return True
-
-# ----------------- Preparing Main -----------------
-KOHA = KohaRESTAPIClient(os.getenv("KOHA_URL"), os.getenv("KOHA_CLIENT_ID"), os.getenv("KOHA_CLIENT_SECRET"))
-# Leave if failed to connect to Koha
-if KOHA.status != Koha_Api_Status.SUCCESS:
-    print(r"/!\ Failed to connect to Koha /!\ ")
-    exit()
-LOG = Logger(os.getenv("LOGS_FOLDER"), SERVICE)
-ERRORS_FILE = Error_File(OUTPUT_PATH + r"\KRSD_errors.csv")
-DELETED_FIELD_FILE = Report_Deleted_Fields_File(OUTPUT_PATH + r"\KRSD_deleted_fields.csv")
-UPDATED_BIBNB_FILE = Report_Updated_Bibnb_File(OUTPUT_PATH + r"\KRSD_update_bibnb.txt")
-LOG.big_message(Level.INFO, "Execution settings")
-LOG.message_data(Level.INFO, "Input file", INPUT_FILE_PATH)
-LOG.message_data(Level.INFO, "Report deleted fields file", DELETED_FIELD_FILE.path)
-LOG.message_data(Level.INFO, "Updated biblionumbers file", UPDATED_BIBNB_FILE.path)
-LOG.message_data(Level.INFO, "Errors file", ERRORS_FILE.path)
-LOG.message_data(Level.INFO, "Maximum of records to process", RECORD_NB_LIMIT)
-LOG.message_data(Level.INFO, "Tags to process", ", ".join(SUBJECT_TAGS))
-LOG.big_message(Level.INFO, "Starting main script")
-
-# ----------------- Main -----------------
-# Iterate through all records to fix
-with open(INPUT_FILE_PATH, mode="r") as f:
-    file_lines = f.readlines()
+        super().write({"bibnb":bibnb})
+
+def get_bibnb_from_line(index:int, line:str) -> int|None:
+    """Returns the biblionumber of an input file line.
+    Returns None (& reports it) if it is incorrect"""
+    bibnb = validate_int(line.strip())
+    # Catch mal formed bibnb
+    if bibnb < 1:
+        ERRORS_FILE.write(Error_Types.BIBNB_IS_INCORRECT, index=index, msg=line.strip())
+        LOG.record_message(Level.ERROR, index, None, f"Incorrect biblionumber : {line.strip()}")
+        JOURNAL.write(index, None, Outcome.ERROR.value)
+        return None
+    return bibnb
+
+def write_report(report:Record_Report):
+    """Writes what happened to a record to the output files, logs & metrics"""
+    for error_type, msg in report.errors:
+        ERRORS_FILE.write(error_type, index=report.index, bibnb=report.bibnb, msg=msg)
+        METRICS.count(f"errors.{error_type.name}")
+    for tag, auth_id, field, replaced_by in report.deleted_fields:
+        DELETED_FIELD_FILE.write(report.bibnb, report.index, tag, auth_id, field, replaced_by)
+    if report.deleted_fields:
+        METRICS.count("fields.deleted", len(report.deleted_fields))
+    for level, msg in report.logs:
+        LOG.record_message(level, report.index, report.bibnb, msg)
+    for stage, seconds in report.timings:
+        METRICS.observe(f"stage.{stage}", seconds)
+    if report.updated:
+        UPDATED_BIBNB_FILE.write(report.bibnb)
+        METRICS.count("records.updated")
+    if report.outcome == Outcome.NOT_SENT:
+        METRICS.count("records.not_sent")
+    if report.staged is not None:
+        STAGING.add(report.index, report.bibnb, report.staged, report.deleted_fields)
+        METRICS.count("records.staged")
+    # Only once the reports are written
+    if report.outcome is not None:
+        JOURNAL.write(report.index, report.bibnb, report.outcome.value)
+
+# A record keeps the same report from its retrieval to its update, and the report is only written
+# once the record outcome is known : a journal checkpoint never holds part of the lines of a record
+
+def new_report(index:int, bibnb:int|None) -> Record_Report:
+    """Returns an empty report for a record"""
+    return Record_Report(index, bibnb, REPORT_LOG_LEVEL)
+
+def report_unexpected_error(report:Record_Report, msg:str):
+    """Writes the report of a record whose processing raised an unexpected exception"""
+    # Fields are only deleted once the record is updated
+    if not report.updated:
+        report.deleted_fields = []
+    report.error(Error_Types.UNEXPECTED_ERROR, msg=msg)
+    report.log(Level.CRITICAL, f"Unexpected error : {msg}")
+    report.outcome = Outcome.ERROR
+    write_report(report)
+
+def fetch_record(report:Record_Report) -> bytes|None:
+    """Returns the raw record from Koha.
+    Returns None (& writes the report) if an error occured"""
+    # Get record with Koha private GET API
+    with METRICS.timer("stage.get"):
+        response = KOHA.get_biblio(report.bibnb, Content_Type.RAW_MARC)
+    return check_get_response(report, response)
+
+def check_get_response(report:Record_Report, raw_record:bytes|Koha_Api_Errors) -> bytes|None:
+    """Returns the raw record, or None (& writes the report) if the GET API returned an error"""
+    raw_record = dedupe.check_get_response(raw_record, report)
+    if raw_record is None:
+        write_report(report)
+    return raw_record
+
+def process_raw_record(report:Record_Report, raw_record:bytes) -> pymarc.record.Record|None:
+    """Parses the record & removes duplicates for each subject tag.
+    Returns the edited record, or None (& writes the report) if the record must not be updated"""
+    record = dedupe.process_raw_record(raw_record, SUBJECT_TAGS, report, PRESCAN, AUTHORITIES, AUTHORITY_CHECK)
+    # Plan mode : the record is staged & never sent
+    if record is not None and RUN_MODE == Run_Mode.PLAN:
+        record = dedupe.stage_record(record, report)
+    if record is None:
+        write_report(report)
+    return record
+
+def process_record(report:Record_Report, record:pymarc.record.Record|None) -> pymarc.record.Record|None:
+    """Removes duplicates for each subject tag of a parsed record.
+    Returns the edited record, or None (& writes the report) if the record must not be updated"""
+    record = dedupe.process_record(record, SUBJECT_TAGS, report, AUTHORITIES, AUTHORITY_CHECK)
+    if record is None:
+        write_report(report)
+    return record
+
+def update_record(report:Record_Report, record:pymarc.record.Record) -> bool:
+    """Sends the edited record to Koha & writes the report.
+    Returns if the record was updated"""
+    # If the record was changed, send the edited one to Koha via PUT API
+    with METRICS.timer("stage.serialize"):
+        data = record.as_marc()
+    with METRICS.timer("stage.put"):
+        response = KOHA.update_biblio(report.bibnb, record=data)
+    return check_put_response(report, response)
+
+def check_put_response(report:Record_Report, update_response:bytes|Koha_Api_Errors) -> bool:
+    """Reports the PUT API response & writes the report.
+    Returns if the record was updated"""
+    updated = dedupe.check_put_response(update_response, report)
+    write_report(report)
+    return updated
+
+def iter_input_lines(file_lines:Iterable):
+    """Yields (index, line) of the input file (or records of a MARC dump),
+    stopping (& reporting it) once the maximum number of records is reached.
+    Records already in the journal are skipped, but still count for the maximum number of records"""
+    return iter_indexed_items(enumerate(file_lines))
+
+def iter_indexed_items(items:Iterable[Tuple[int, object]]):
+    """Same as iter_input_lines(), for items already as (index, item)"""
     security = 0
-    for index, line in enumerate(file_lines):
+    for index, line in items:
         security = security + 1
         if security > RECORD_NB_LIMIT:
             ERRORS_FILE.write(Error_Types.SECURITY_STOP, index=index, msg="Security check : maximum number of records reached")
             LOG.record_message(Level.CRITICAL, index, None, f"Security check : maximum number of records reached")
             break
-        bibnb = validate_int(line.strip())
-        # Catch mal formed bibnb
-        if bibnb < 1:
-            ERRORS_FILE.write(Error_Types.BIBNB_IS_INCORRECT, index=index, msg=line.strip())
-            LOG.record_message(Level.ERROR, index, None, f"Incorrect biblionumber : {line.strip()}")
+        if JOURNAL.is_completed(index):
             continue
-        
-        # Get record with Koha private GET API
-        raw_record = KOHA.get_biblio(bibnb, Content_Type.RAW_MARC)
-        # An error occured while getting the record, log & skip to next one
-        if type(raw_record) == Koha_Api_Errors:
-            ERRORS_FILE.write(Error_Types.REQUESTS_GET_ERROR, index=index, bibnb=bibnb, msg=raw_record.name)
-            LOG.record_message(Level.ERROR, index, bibnb, f"An error happened with the API trying to get the record : {raw_record.name}")
+        PROGRESS.tick()
+        PROFILER.tick()
+        yield index, line
+
+def iter_bibnb_batches(file_lines:List[str], batch_size:int):
+    """Yields lists of at most batch_size records reports.
+    Incorrect biblionumbers are reported & skipped"""
+    batch = []
+    for index, line in iter_input_lines(file_lines):
+        bibnb = get_bibnb_from_line(index, line)
+        if bibnb is None:
             continue
-        # ||| On verra si on a besoin de cette aprtie du code ou pas
-        # # Pymarc is not reading records because of the new lines
-        # # So decode the string, remove them, then reencode the string
-        # # Make sure to only remove \n at the end of record, otherwise record length won't match
-        # AUTH_INDEX.add_auth_list_to_index(raw_authority_list.decode().replace("\x1e\x1d\n", "\x1e\x1d").encode(), page)
-        # ||| fin du On verra si on a besoin de cette aprtie du code ou pas
-        
-        # Parse record
-        record = None
-        try:
-            record = pymarc.record.Record(data=raw_record, to_unicode=True, force_utf8=True)
-        except:
-            ERRORS_FILE.write(Error_Types.FAILED_TO_PARSE_MARC, index=index, bibnb=bibnb)
-            LOG.record_message(Level.ERROR, index, bibnb, "Failed to parse MARC record")
+        batch.append(new_report(index, bibnb))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def fetch_batch(batch:List[Record_Report]) -> List[Tuple[Record_Report, bytes]]:
+    """Retrieves a batch of records with a single call to Koha biblio list API.
+    Returns a list of (report, raw record), errors are reported & skipped"""
+    with METRICS.timer("stage.get_batch"):
+        responses = KOHA.get_biblios([report.bibnb for report in batch], Content_Type.RAW_MARC, chunk_size=len(batch))
+    output = []
+    for report in batch:
+        raw_record = check_get_response(report, responses.get(str(report.bibnb), Koha_Api_Errors.RECORD_DOES_NOT_EXIST))
+        if raw_record is not None:
+            output.append((report, raw_record))
+    return output
+
+def run_sequential(file_lines:List[str], batch_size:int=0):
+    """Processes the records one after the other.
+    If batch_size is greater than 0, records are retrieved by batches"""
+    if batch_size > 0:
+        for batch in iter_bibnb_batches(file_lines, batch_size):
+            for report, raw_record in fetch_batch(batch):
+                record = process_raw_record(report, raw_record)
+                if record is None:
+                    continue
+                update_record(report, record)
+        return
+    for index, line in iter_input_lines(file_lines):
+        bibnb = get_bibnb_from_line(index, line)
+        if bibnb is None:
             continue
-
-        # If record is invalid
-        if record is None:
-            ERRORS_FILE.write(Error_Types.NO_RECORD, index=index, bibnb=bibnb)
-            LOG.record_message(Level.ERROR, index, bibnb, "Record is empty / invalid")
-            continue # Fatal error, skipp
-
-        # Checks that there is a biblionumber for PUT
-        if not record.get("001"):
-            ERRORS_FILE.write(Error_Types.NO_BIBNB_IN_RECORD, index=index, bibnb=bibnb)
-            LOG.record_message(Level.ERROR, index, bibnb, "Record has no biblionumber")
+        report = new_report(index, bibnb)
+        raw_record = fetch_record(report)
+        if raw_record is None:
             continue
-
-        # Track if record was changed
-        record_was_changed = False
-        # For each subject tag, dedupe the fields
-        for tag in SUBJECT_TAGS:
-            tag_changed_record = dedupe_field(record, tag, index=index, bibnb=bibnb)
-            # Temp varaible to avoid changing record_was_changed back to False
-            if tag_changed_record:
-                record_was_changed = True
-        
-        # If the record was not changed, log and go to next record
-        if not record_was_changed:
-            # Output the info in error file as records sent to the script should change
-            ERRORS_FILE.write(Error_Types.RECORD_WAS_NOT_CHANGED, index=index, bibnb=bibnb)
-            LOG.record_message(Level.INFO, index, bibnb, "Record was not changed")
+        record = process_raw_record(report, raw_record)
+        if record is None:
             continue
-        
-        # If the record was changed, send the edited one to Koha via PUT API
-        update_response = KOHA.update_biblio(bibnb, record=record.as_marc())
-        # An error occured while getting the record, log & skip to next one
-        if type(update_response) == Koha_Api_Errors:
-            ERRORS_FILE.write(Error_Types.REQUESTS_PUT_ERROR, index=index, bibnb=bibnb, msg=update_response.name)
-            LOG.record_message(Level.ERROR, index, bibnb, f"An error happened with the API trying to update the record : {update_response.name}")
+        update_record(report, record)
+
+class Pipeline_Stage(object):
+    """A pool of threads reading (report, data) items from an input queue,
+    calling a function on them and sending the (report, result) to the output queue.
+    None is used as the end of stream marker.
+    If fan_out is True, data is a batch (list of reports) & the function returns a list of items to send"""
+    def __init__(self, name:str, func, nb_workers:int, input_queue:queue.Queue, output_queue:queue.Queue|None, fan_out:bool=False) -> None:
+        self.name = name
+        self.func = func
+        self.fan_out = fan_out
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.threads = [threading.Thread(target=self.__work, name=f"{name}_{i}", daemon=True) for i in range(nb_workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Sends one end of stream marker per worker & waits for them.
+        Previously queued items are still processed"""
+        for _ in self.threads:
+            self.input_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __work(self):
+        while True:
+            item = self.input_queue.get()
+            if item is None:
+                return
+            report, data = item
+            # Never let an unexpected error kill the worker, or the queues would fill up forever
+            try:
+                output = self.func(report, data)
+            except Exception as e:
+                for failed_report in (data if self.fan_out else [report]):
+                    report_unexpected_error(failed_report, f"stage {self.name} : {e}")
+                continue
+            if output is None or self.output_queue is None:
+                continue
+            if self.fan_out:
+                for output_item in output:
+                    self.output_queue.put(output_item)
+            else:
+                self.output_queue.put((report, output))
+
+def run_pipeline(file_lines:List[str], nb_workers:int, batch_size:int=0):
+    """Processes the records with concurrent GET, dedupe & PUT stages
+    connected by bounded queues.
+    If batch_size is greater than 0, GET workers retrieve records by batches"""
+    get_queue = queue.Queue(maxsize=nb_workers * 2)
+    dedupe_queue = queue.Queue(maxsize=max(nb_workers, batch_size) * 2)
+    put_queue = queue.Queue(maxsize=nb_workers * 2)
+    if batch_size > 0:
+        get_stage = Pipeline_Stage("GET", lambda report, batch: fetch_batch(batch), nb_workers, get_queue, dedupe_queue, fan_out=True)
+    else:
+        get_stage = Pipeline_Stage("GET", lambda report, data: fetch_record(report), nb_workers, get_queue, dedupe_queue)
+    # Dedupe is CPU bound : more threads would only fight over the GIL
+    dedupe_stage = Pipeline_Stage("DEDUPE", process_raw_record, 1, dedupe_queue, put_queue)
+    put_stage = Pipeline_Stage("PUT", update_record, nb_workers, put_queue, None)
+    for stage in [get_stage, dedupe_stage, put_stage]:
+        stage.start()
+    if batch_size > 0:
+        for batch in iter_bibnb_batches(file_lines, batch_size):
+            get_queue.put((None, batch))
+    else:
+        for index, line in iter_input_lines(file_lines):
+            bibnb = get_bibnb_from_line(index, line)
+            if bibnb is None:
+                continue
+            get_queue.put((new_report(index, bibnb), None))
+    # Stop the stages in order so every queued record goes through the whole pipeline
+    for stage in [get_stage, dedupe_stage, put_stage]:
+        stage.stop()
+
+async def run_async(file_lines:List[str], concurrency:int):
+    """Processes the records as coroutines on a single event loop,
+    with at most concurrency requests in flight (fewer if LIMITER lowers its limit)"""
+    koha = AsyncKohaRESTAPIClient(os.getenv("KOHA_URL"), os.getenv("KOHA_CLIENT_ID"), os.getenv("KOHA_CLIENT_SECRET"),
+                                  max_concurrency=concurrency, max_retries=KOHA_MAX_RETRIES, backoff_factor=KOHA_BACKOFF_FACTOR,
+                                  connect_timeout=KOHA_CONNECT_TIMEOUT, read_timeout=KOHA_READ_TIMEOUT, limiter=LIMITER, metrics=METRICS,
+                                  token_refresh_margin=KOHA_TOKEN_REFRESH_MARGIN, **KOHA_CACHE_SETTINGS)
+    async with koha:
+        if koha.status != Koha_Api_Status.SUCCESS:
+            LOG.big_message(Level.CRITICAL, "Failed to connect to Koha")
+            return
+        # Bounded queue : the whole input file is not turned into pending tasks at once
+        records_queue = asyncio.Queue(maxsize=concurrency * 2)
+
+        async def worker():
+            while True:
+                item = await records_queue.get()
+                if item is None:
+                    return
+                report = item
+                try:
+                    with METRICS.timer("stage.get"):
+                        response = await koha.get_biblio(report.bibnb, Content_Type.RAW_MARC)
+                    raw_record = check_get_response(report, response)
+                    if raw_record is None:
+                        continue
+                    record = process_raw_record(report, raw_record)
+                    if record is None:
+                        continue
+                    with METRICS.timer("stage.serialize"):
+                        data = record.as_marc()
+                    with METRICS.timer("stage.put"):
+                        response = await koha.update_biblio(report.bibnb, record=data)
+                    check_put_response(report, response)
+                except Exception as e:
+                    report_unexpected_error(report, str(e))
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for index, line in iter_input_lines(file_lines):
+            bibnb = get_bibnb_from_line(index, line)
+            if bibnb is None:
+                continue
+            await records_queue.put(new_report(index, bibnb))
+        for _ in workers:
+            await records_queue.put(None)
+        await asyncio.gather(*workers)
+
+def iter_staged_batches(batch_size:int):
+    """Apply mode : yields lists of at most batch_size staged records (index, biblionumber, 005, record)"""
+    batch = []
+    staged_records = ((index, (bibnb, version, data)) for index, bibnb, version, data in STAGING.iter_planned())
+    for index, (bibnb, version, data) in iter_indexed_items(staged_records):
+        batch.append((index, bibnb, version, data))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def check_staged_batch(batch:List[Tuple[int, int, str|None, bytes]]) -> List[Tuple[Record_Report, bytes]]:
+    """Apply mode : retrieves the current version of a batch of staged records with a single call to Koha biblio list API.
+    Returns a list of (report, staged record) still having their staged 005, others are reported & skipped"""
+    with METRICS.timer("stage.check"):
+        responses = KOHA.get_biblios([bibnb for index, bibnb, version, data in batch], Content_Type.RAW_MARC, chunk_size=len(batch))
+    output = []
+    for index, bibnb, version, data in batch:
+        report = new_report(index, bibnb)
+        raw_record = dedupe.check_get_response(responses.get(str(bibnb), Koha_Api_Errors.RECORD_DOES_NOT_EXIST), report)
+        if raw_record is None:
+            STAGING.set_status(bibnb, Staged_Status.ERROR, report.errors[-1][1])
+        elif not dedupe.check_staged_version(raw_record, version, report):
+            STAGING.set_status(bibnb, Staged_Status.CHANGED, report.errors[-1][1])
+        else:
+            # Written once the record is sent
+            output.append((report, data))
             continue
+        write_report(report)
+    return output
+
+def apply_record(report:Record_Report, data:bytes) -> bool:
+    """Apply mode : sends a staged record to Koha & writes the report.
+    Returns if the record was updated"""
+    with METRICS.timer("stage.put"):
+        response = KOHA.update_biblio(report.bibnb, record=data)
+    updated = dedupe.check_put_response(response, report)
+    if updated:
+        STAGING.set_status(report.bibnb, Staged_Status.APPLIED)
+    else:
+        STAGING.set_status(report.bibnb, Staged_Status.ERROR, response.name)
+    write_report(report)
+    return updated
+
+def run_apply(nb_workers:int, batch_size:int):
+    """Apply mode : sends the staged records to Koha with nb_workers PUT workers.
+    Their 005 is first checked by batches of batch_size records"""
+    if nb_workers < 2:
+        for batch in iter_staged_batches(batch_size):
+            for report, data in check_staged_batch(batch):
+                apply_record(report, data)
+        return
+    put_queue = queue.Queue(maxsize=nb_workers * 2)
+    put_stage = Pipeline_Stage("PUT", apply_record, nb_workers, put_queue, None)
+    put_stage.start()
+    for batch in iter_staged_batches(batch_size):
+        for item in check_staged_batch(batch):
+            put_queue.put(item)
+    put_stage.stop()
+
+def run_offline(dump_path:str, output_file:Marc_Dump_Writer):
+    """Processes the records of a local MARC dump, without Koha REST APIs.
+    Edited records are written to output_file"""
+    if detect_dump_format(dump_path) == Dump_Format.MARCXML:
+        # Records are converted one by one, so an invalid record is reported instead of stopping the run
+        for index, data in iter_input_lines(iter_marcxml_raw_records(dump_path)):
+            try:
+                record = marcxml_to_record(data)
+            except Exception:
+                report = new_report(index, None)
+                report.error(Error_Types.FAILED_TO_PARSE_MARC)
+                report.log(Level.ERROR, "Failed to parse MARC record")
+                report.outcome = Outcome.ERROR
+                write_report(report)
+                continue
+            report = new_report(index, dedupe.get_bibnb_from_record(record))
+            record = process_record(report, record)
+            if record is not None:
+                write_offline_record(report, record, output_file)
+        return
+    with open(dump_path, "rb") as f:
+        for index, raw_record in iter_input_lines(iter_raw_marc_records(f)):
+            report = new_report(index, dedupe.get_bibnb_from_record(raw_record))
+            record = process_raw_record(report, raw_record)
+            if record is not None:
+                write_offline_record(report, record, output_file)
+
+def write_offline_record(report:Record_Report, record:pymarc.record.Record, output_file:Marc_Dump_Writer):
+    """Writes the edited record to the output MARC file, then its report"""
+    with METRICS.timer("stage.write"):
+        output_file.write(record)
+    report.updated = True
+    report.outcome = Outcome.UPDATED
+    report.log(Level.INFO, "Record was written without duplicates")
+    write_report(report)
+
+def run_sharded_offline(dump_path:str, output_file:Marc_Dump_Writer, nb_processes:int):
+    """Processes the records of a local MARC dump in nb_processes worker processes.
+    Reports & edited records are written in the dump order"""
+    dump_format = detect_dump_format(dump_path)
+    with ProcessPoolExecutor(max_workers=nb_processes, initializer=sharding.init_dump_worker, initargs=(AUTHORITIES,)) as executor:
+        if dump_format == Dump_Format.MARCXML:
+            shards = sharding.iter_shards(iter_input_lines(iter_marcxml_raw_records(dump_path)))
+            for results in sharding.iter_ordered_results(executor, sharding.process_dump_shard, shards, nb_processes * 2, SUBJECT_TAGS, dump_format, PRESCAN, REPORT_LOG_LEVEL, AUTHORITY_CHECK):
+                write_sharded_offline_results(results, output_file)
+            return
+        with open(dump_path, "rb") as f:
+            shards = sharding.iter_shards(iter_input_lines(iter_raw_marc_records(f)))
+            for results in sharding.iter_ordered_results(executor, sharding.process_dump_shard, shards, nb_processes * 2, SUBJECT_TAGS, dump_format, PRESCAN, REPORT_LOG_LEVEL, AUTHORITY_CHECK):
+                write_sharded_offline_results(results, output_file)
+
+def write_sharded_offline_results(results:List[Tuple[Record_Report, bytes|None]], output_file:Marc_Dump_Writer):
+    """Writes the reports & edited records returned by a worker process"""
+    for report, data in results:
+        write_report(report)
+        if data is not None:
+            with METRICS.timer("stage.write"):
+                output_file.write_serialized(data)
+            JOURNAL.write(report.index, report.bibnb, Outcome.UPDATED.value)
+
+def run_sharded_list(file_lines:List[str], nb_processes:int):
+    """Processes the records in nb_processes worker processes, each one using its own Koha client.
+    Reports are written in the input file order"""
+    client_kwargs = {
+        "pool_maxsize":1,
+        "max_retries":KOHA_MAX_RETRIES,
+        "backoff_factor":KOHA_BACKOFF_FACTOR,
+        "connect_timeout":KOHA_CONNECT_TIMEOUT,
+        "read_timeout":KOHA_READ_TIMEOUT,
+        "token_refresh_margin":KOHA_TOKEN_REFRESH_MARGIN,
+        **KOHA_CACHE_SETTINGS
+    }
+    def iter_valid_bibnbs():
+        for index, line in iter_input_lines(file_lines):
+            bibnb = get_bibnb_from_line(index, line)
+            if bibnb is not None:
+                yield index, bibnb
+    with ProcessPoolExecutor(max_workers=nb_processes, initializer=sharding.init_list_worker,
+                             initargs=(os.getenv("KOHA_URL"), os.getenv("KOHA_CLIENT_ID"), os.getenv("KOHA_CLIENT_SECRET"), client_kwargs, AUTHORITIES)) as executor:
+        # Small shards : a worker handles one record at a time
+        shards = sharding.iter_shards(iter_valid_bibnbs(), 10)
+        for reports in sharding.iter_ordered_results(executor, sharding.process_list_shard, shards, nb_processes * 2, SUBJECT_TAGS, PRESCAN, REPORT_LOG_LEVEL, RUN_MODE == Run_Mode.PLAN, AUTHORITY_CHECK):
+            for report in reports:
+                write_report(report)
+
+def load_authority_index() -> Authority_Index|None:
+    """Returns the index of the authorities existing in Koha.
+    Loads AUTHORITY_INDEX_FILE if it is recent enough, otherwise builds it from Koha & saves it to AUTHORITY_INDEX_FILE.
+    Returns None if the index could not be built : an incomplete index would report existing authorities as deleted"""
+    index = Authority_Index()
+    age = get_index_age(AUTHORITY_INDEX_FILE) if AUTHORITY_INDEX_FILE else None
+    if age is not None and (KOHA_CACHE_ONLY or AUTHORITY_INDEX_MAX_AGE <= 0 or age <= AUTHORITY_INDEX_MAX_AGE):
+        try:
+            with METRICS.timer("authorities.load"):
+                index.load(AUTHORITY_INDEX_FILE)
+            LOG.message_data(Level.INFO, "Authority index loaded", f"{len(index)} authorities, {int(age)} seconds old")
+            return index
+        except (OSError, ValueError) as e:
+            LOG.error(f"Failed to load the authority index, building it again : {e}")
+            index = Authority_Index()
+    if KOHA_CACHE_ONLY:
+        return None
+    # Listing authorities never uses the record cache
+    koha = KohaRESTAPIClient(os.getenv("KOHA_URL"), os.getenv("KOHA_CLIENT_ID"), os.getenv("KOHA_CLIENT_SECRET"),
+                             pool_maxsize=max(AUTHORITY_PREFETCH, 1), max_retries=KOHA_MAX_RETRIES, backoff_factor=KOHA_BACKOFF_FACTOR,
+                             connect_timeout=KOHA_CONNECT_TIMEOUT, read_timeout=KOHA_READ_TIMEOUT, metrics=METRICS,
+                             token_refresh_margin=KOHA_TOKEN_REFRESH_MARGIN)
+    if koha.status != Koha_Api_Status.SUCCESS:
+        LOG.error("Failed to connect to Koha to build the authority index")
+        return None
+    try:
+        with METRICS.timer("authorities.build"):
+            complete = index.build(koha, AUTHORITY_PAGE_SIZE, AUTHORITY_PREFETCH, log=LOG.info)
+    finally:
+        koha.close()
+    if not complete:
+        return None
+    LOG.message_data(Level.INFO, "Authority index built", f"{len(index)} authorities")
+    if AUTHORITY_INDEX_FILE:
+        index.save(AUTHORITY_INDEX_FILE)
+    return index
 
-        # Report & log
-        UPDATED_BIBNB_FILE.write(bibnb)
-        LOG.record_message(Level.INFO, index, bibnb, "Record was updated without duplicates")
-
-ERRORS_FILE.close()
-DELETED_FIELD_FILE.close()   
-UPDATED_BIBNB_FILE.close() 
-
-LOG.big_message(Level.INFO, "<(^-^)> <(^-^)> Script fully executed without FATAL errors <(^-^)> <(^-^)>")    
+# ----------------- Preparing Main -----------------
+# Worker processes import this file again : only the main process must run the script
+if __name__ == "__main__":
+    LOG = Logger(os.getenv("LOGS_FOLDER"), SERVICE, LOG_LEVEL, LOG_LEVEL_CONSOLE,
+                 use_queue=LOG_ASYNC, queue_size=LOG_QUEUE_SIZE, queue_policy=LOG_QUEUE_POLICY)
+    METRICS = Metrics()
+    # Total is set once the input is known
+    PROGRESS = Progress(LOG, METRICS, interval=PROGRESS_INTERVAL, prometheus_path=METRICS_PROMETHEUS_FILE)
+    PROFILER = Profiler(PROFILE_MODE, OUTPUT_PATH, "KRSD_profile", top=PROFILE_TOP, snapshot_every=PROFILE_MEMORY_EVERY)
+    # Adaptive limiter protecting Koha, only if enabled
+    LIMITER = None
+    if ADAPTIVE_MAX_CONCURRENCY > 0:
+        LIMITER = Adaptive_Limiter(LOG, min_limit=ADAPTIVE_MIN_CONCURRENCY, max_limit=ADAPTIVE_MAX_CONCURRENCY, initial_limit=ADAPTIVE_MIN_CONCURRENCY,
+                                   target_latency=ADAPTIVE_TARGET_LATENCY, breaker_cooldown=CIRCUIT_BREAKER_COOLDOWN)
+    # In async mode, the async client connects inside the event loop
+    # In offline mode, Koha is not used
+    # Apply mode always uses threads
+    KOHA = None
+    if INPUT_MARC_FILE_PATH is None and (RUN_MODE == Run_Mode.APPLY or (ASYNC_CONCURRENCY < 1 and PROCESSES < 2)):
+        KOHA = KohaRESTAPIClient(os.getenv("KOHA_URL"), os.getenv("KOHA_CLIENT_ID"), os.getenv("KOHA_CLIENT_SECRET"),
+                                 pool_maxsize=max(KOHA_POOL_SIZE, ADAPTIVE_MAX_CONCURRENCY if LIMITER is not None else WORKERS * 2), max_retries=KOHA_MAX_RETRIES, backoff_factor=KOHA_BACKOFF_FACTOR,
+                                 connect_timeout=KOHA_CONNECT_TIMEOUT, read_timeout=KOHA_READ_TIMEOUT, limiter=LIMITER, metrics=METRICS,
+                                 token_refresh_margin=KOHA_TOKEN_REFRESH_MARGIN, **KOHA_CACHE_SETTINGS)
+        # Leave if failed to connect to Koha
+        if KOHA.status != Koha_Api_Status.SUCCESS:
+            print(r"/!\ Failed to connect to Koha /!\ ")
+            exit()
+    # Authority check : index every authority before processing records
+    if AUTHORITY_CHECK is not None:
+        AUTHORITIES = load_authority_index()
+        if AUTHORITIES is None:
+            print(r"/!\ Failed to build the authority index /!\ ")
+            exit()
+    REPORT_SETTINGS = {
+        "format":REPORT_FORMAT,
+        "compression":REPORT_COMPRESSION,
+        "buffer_size":REPORT_BUFFER_SIZE,
+        "flush_interval":REPORT_FLUSH_INTERVAL,
+        "append":RESUME
+    }
+    try:
+        JOURNAL = Journal(os.path.join(OUTPUT_PATH, "KRSD_journal.txt"), INPUT_FILE_PATH, RESUME, JOURNAL_SYNC_EVERY, JOURNAL_SYNC_INTERVAL,
+                          retry_outcomes=[Outcome.NOT_SENT.value])
+    except ValueError as e:
+        print(rf"/!\ Can not resume : {e} /!\ ")
+        exit()
+    ERRORS_FILE_PATH = os.path.join(OUTPUT_PATH, "KRSD_errors.csv")
+    DELETED_FIELD_FILE_PATH = os.path.join(OUTPUT_PATH, "KRSD_deleted_fields.csv")
+    UPDATED_BIBNB_FILE_PATH = os.path.join(OUTPUT_PATH, "KRSD_update_bibnb.txt")
+    OUTPUT_MARC_FILE_PATH = None
+    if INPUT_MARC_FILE_PATH is not None:
+        DUMP_FORMAT = detect_dump_format(INPUT_MARC_FILE_PATH)
+        OUTPUT_MARC_FILE_PATH = os.path.join(OUTPUT_PATH, "KRSD_updated_records." + DUMP_FORMAT.value)
+    # When resuming, removes what was written after the last journal checkpoint
+    JOURNAL.restore_files([get_report_path(path, REPORT_FORMAT, REPORT_COMPRESSION) for path in [ERRORS_FILE_PATH, DELETED_FIELD_FILE_PATH, UPDATED_BIBNB_FILE_PATH]]
+                          + [path for path in [OUTPUT_MARC_FILE_PATH] if path is not None])
+    ERRORS_FILE = Error_File(ERRORS_FILE_PATH, **REPORT_SETTINGS)
+    DELETED_FIELD_FILE = Report_Deleted_Fields_File(DELETED_FIELD_FILE_PATH, **REPORT_SETTINGS)
+    UPDATED_BIBNB_FILE = Report_Updated_Bibnb_File(UPDATED_BIBNB_FILE_PATH, **REPORT_SETTINGS)
+    OUTPUT_MARC_FILE = None
+    if OUTPUT_MARC_FILE_PATH is not None:
+        OUTPUT_MARC_FILE = Marc_Dump_Writer(OUTPUT_MARC_FILE_PATH, DUMP_FORMAT, append=RESUME)
+    # A new plan replaces the previous one
+    STAGING = None
+    if RUN_MODE != Run_Mode.RUN:
+        STAGING = Staging_Store(STAGING_FILE_PATH, reset=RUN_MODE == Run_Mode.PLAN and not RESUME)
+    # Reports & updated records are written to disk before the journal lists them
+    JOURNAL.watch([file for file in [ERRORS_FILE, DELETED_FIELD_FILE, UPDATED_BIBNB_FILE, OUTPUT_MARC_FILE] if file is not None])
+    LOG.big_message(Level.INFO, "Execution settings")
+    LOG.message_data(Level.INFO, "Input file", INPUT_FILE_PATH)
+    LOG.message_data(Level.INFO, "Mode", RUN_MODE.value)
+    if STAGING is not None:
+        LOG.message_data(Level.INFO, "Staging file", STAGING.path)
+    LOG.message_data(Level.INFO, "Report deleted fields file", DELETED_FIELD_FILE.path)
+    LOG.message_data(Level.INFO, "Updated biblionumbers file", UPDATED_BIBNB_FILE.path)
+    LOG.message_data(Level.INFO, "Errors file", ERRORS_FILE.path)
+    LOG.message_data(Level.INFO, "Reports format", f"{REPORT_FORMAT.value}, compression : {REPORT_COMPRESSION.name.lower()}")
+    if OUTPUT_MARC_FILE is not None:
+        LOG.message_data(Level.INFO, "Offline mode, updated records file", OUTPUT_MARC_FILE.path)
+    LOG.message_data(Level.INFO, "Maximum of records to process", RECORD_NB_LIMIT)
+    LOG.message_data(Level.INFO, "Journal", JOURNAL.path)
+    if RESUME:
+        LOG.message_data(Level.INFO, "Resuming, records already processed", JOURNAL.nb_completed)
+    LOG.message_data(Level.INFO, "Tags to process", ", ".join(SUBJECT_TAGS))
+    LOG.message_data(Level.INFO, "Workers", WORKERS)
+    LOG.message_data(Level.INFO, "Processes", PROCESSES)
+    LOG.message_data(Level.INFO, "Pre-scan raw records", PRESCAN)
+    LOG.message_data(Level.INFO, "Async concurrency", ASYNC_CONCURRENCY)
+    LOG.message_data(Level.INFO, "Batch size", BATCH_SIZE)
+    LOG.message_data(Level.INFO, "Adaptive limiter maximum concurrency", ADAPTIVE_MAX_CONCURRENCY)
+    if LIMITER is not None:
+        LOG.message_data(Level.INFO, "Adaptive limiter minimum concurrency", ADAPTIVE_MIN_CONCURRENCY)
+    LOG.message_data(Level.INFO, "Authority check", AUTHORITY_CHECK.value if AUTHORITY_CHECK is not None else "none")
+    if AUTHORITIES is not None:
+        LOG.message_data(Level.INFO, "Authorities indexed", len(AUTHORITIES))
+        if AUTHORITY_INDEX_FILE:
+            LOG.message_data(Level.INFO, "Authority index file", AUTHORITY_INDEX_FILE)
+    if KOHA_CACHE_FILE and OUTPUT_MARC_FILE is None:
+        LOG.message_data(Level.INFO, "Record cache file", KOHA_CACHE_FILE)
+        if KOHA_CACHE_ONLY:
+            LOG.message_data(Level.WARNING, "Cache only", "Koha will not be contacted, edited records are not sent")
+    LOG.message_data(Level.INFO, "Progress interval (seconds)", PROGRESS_INTERVAL)
+    if METRICS_PROMETHEUS_FILE:
+        LOG.message_data(Level.INFO, "Prometheus metrics file", METRICS_PROMETHEUS_FILE)
+    if PROFILER.enabled:
+        LOG.message_data(Level.INFO, "Profiling", PROFILE_MODE.value)
+    LOG.big_message(Level.INFO, "Starting main script")
+
+    # ----------------- Main -----------------
+    PROFILER.start()
+    # Iterate through all records to fix
+    if OUTPUT_MARC_FILE is not None:
+        if PROCESSES > 1:
+            run_sharded_offline(INPUT_MARC_FILE_PATH, OUTPUT_MARC_FILE, PROCESSES)
+        else:
+            run_offline(INPUT_MARC_FILE_PATH, OUTPUT_MARC_FILE)
+    elif RUN_MODE == Run_Mode.APPLY:
+        PROGRESS.total = min(STAGING.count().get(Staged_Status.PLANNED.value, 0), RECORD_NB_LIMIT)
+        run_apply(WORKERS, BATCH_SIZE if BATCH_SIZE > 0 else 100)
+    else:
+        with open(INPUT_FILE_PATH, mode="r") as f:
+            file_lines = f.readlines()
+        PROGRESS.total = max(min(len(file_lines), RECORD_NB_LIMIT) - JOURNAL.nb_completed, 0)
+        if PROCESSES > 1:
+            run_sharded_list(file_lines, PROCESSES)
+        elif ASYNC_CONCURRENCY > 0:
+            asyncio.run(run_async(file_lines, ASYNC_CONCURRENCY))
+        elif WORKERS > 1:
+            run_pipeline(file_lines, WORKERS, BATCH_SIZE)
+        else:
+            run_sequential(file_lines, BATCH_SIZE)
+
+    for profile_file_path in PROFILER.stop():
+        LOG.message_data(Level.INFO, "Profiling report", profile_file_path)
+
+    # Journal first : it flushes the other files
+    JOURNAL.close()
+    ERRORS_FILE.close()
+    DELETED_FIELD_FILE.close()   
+    UPDATED_BIBNB_FILE.close() 
+    if OUTPUT_MARC_FILE is not None:
+        OUTPUT_MARC_FILE.close()
+    if KOHA is not None:
+        KOHA.close()
+    if STAGING is not None:
+        for status, nb in STAGING.count().items():
+            LOG.message_data(Level.INFO, f"Staged records {status}", nb)
+        STAGING.close()
+
+    # Performance summary
+    PROGRESS.report()
+    METRICS_FILE_PATH = os.path.join(OUTPUT_PATH, "KRSD_metrics.json")
+    METRICS.write_json(METRICS_FILE_PATH, extra={"records":PROGRESS.done, "records_per_second":round(PROGRESS.rate(), 3)})
+    if METRICS_PROMETHEUS_FILE:
+        METRICS.write_prometheus(METRICS_PROMETHEUS_FILE)
+    LOG.message_data(Level.INFO, "Metrics summary file", METRICS_FILE_PATH)
+
+    LOG.big_message(Level.INFO, "<(^-^)> <(^-^)> Script fully executed without FATAL errors <(^-^)> <(^-^)>")
\ No newline at end of file
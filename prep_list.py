@@ -1,66 +1,231 @@
-# -*- coding: utf-8 -*- 
+# -*- coding: utf-8 -*-
 
 # external imports
 import os
 from dotenv import load_dotenv
 import csv
+import io
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple
 
 # Internal import
+from api.Koha_REST_API_Client import validate_int
+from api.profiling import Profiler, get_profile_mode
+from dedupe import parse_tag, parse_tags
+from sharding import iter_ordered_results
 
 load_dotenv()
 
 FILE_IN = os.getenv("PREP_LIST_INPUT_FILE")
 FILE_OUT = os.getenv("PREP_LIST_OUTPUT_FILE")
 FIELD_SEPARATOR = os.getenv("PREP_LIST_FIELD_SEPARATOR")
+# Separator between the $9 of the same field, None if each field has only one ID
+INFIELD_SEPARATOR = os.getenv("PREP_LIST_INFIELD_SEPARATOR") or None
+# Tags of the per tag columns to use, all of them if SUBJECTS_TAG is not set
+TAGS = parse_tags(os.getenv("SUBJECTS_TAG"))
+# File with the expected number of deleted fields for each biblionumber
+EXPECTED_DUPES_FILE = os.getenv("PREP_LIST_EXPECTED_DUPES_FILE") or None
+# Number of worker processes, 1 reads the file in the main process
+PROCESSES = max(validate_int(os.getenv("PREP_LIST_PROCESSES"), 1), 1)
+# Approximative size in bytes of the input file chunks handled by worker processes
+CHUNK_SIZE = max(validate_int(os.getenv("PREP_LIST_CHUNK_SIZE"), 16777216), 1)
+# Size of the read & write buffers
+IO_BUFFER_SIZE = 1048576
 
-class Bibnb(object):
-    def __init__(self, row:dict) -> None:
-        self.bibnb:str = row["biblionumber"]
-        self.input_ids:str = row["subfield"]
-        # Filter -> list removes empty elements
-        self.id_list = list(filter(None, self.input_ids.split(FIELD_SEPARATOR)))
-        self.id_dict = {}
-        self.analyse_input_ids()
-
-    def analyse_input_ids(self):
-        for authid in self.id_list:
-            if not authid in self.id_dict:
-                self.id_dict[authid] = 1
-            else:
-                self.id_dict[authid] += 1
-    
-    def to_dict(self):
-        """Returns this bibnb as a dict"""
-        output = {
-            "biblinoumber":self.bibnb,
-            "dupes":[]
-        }
-        no_dupes = []
-        dupes = []
-        for authid in self.id_dict:
-            if self.id_dict[authid] < 2:
-                no_dupes.append(authid)
-            else:
-                dupes.append(f"{authid} ({self.id_dict[authid]})")                
-        output["dupes"] = ", ".join(dupes)
+def has_dupes(input_ids:str, separator:str|None=FIELD_SEPARATOR) -> bool:
+    """Returns True if an authority ID appears multiple times in input_ids.
+    Empty elements are ignored"""
+    ids = input_ids.split(separator)
+    # Quick exit : no ID is repeated, even counting empty elements
+    nb_unique = len(set(ids))
+    if nb_unique == len(ids):
+        return False
+    if "" in ids:
+        # Only empty elements can be repeated
+        return nb_unique - 1 != len(ids) - ids.count("")
+    return True
+
+class Dupes_Rule(object):
+    """Finds the fields main.py will delete in a row, using the same rule as dedupe.dedupe_record() :
+    for each tag, fields sharing the same authority ID (all $9 joined with "-", see dedupe.get_auth_id()) are duplicates.
+
+    Input columns are either :
+    - one column per tag, named after the tag (606, 607...). Only SUBJECTS_TAG columns are used if tags is set
+    - a single subfield column (all tags mixed)
+    In each column, fields are separated by separator. If infield_separator is set, it separates
+    the $9 of the same field (compound IDs)
+
+    Raises a ValueError if headers have no biblionumber column, or no column to read authority IDs from"""
+    def __init__(self, headers:List[str], separator:str|None=FIELD_SEPARATOR, infield_separator:str|None=INFIELD_SEPARATOR, tags:List[str]=TAGS) -> None:
+        self.separator = separator
+        self.infield_separator = infield_separator
+        if "biblionumber" not in headers:
+            raise ValueError(f"The input file has no biblionumber column. Columns : {', '.join(headers)}")
+        self.bibnb_index = headers.index("biblionumber")
+        self.columns:List[Tuple[str|None, int]] = []
+        for index, name in enumerate(headers):
+            tag = parse_tag(name) if name.strip().isdigit() else None
+            if tag is not None and (not tags or tag in tags):
+                self.columns.append((tag, index))
+        if not self.columns:
+            if "subfield" not in headers:
+                raise ValueError(f"No column of the input file matches SUBJECTS_TAG ({', '.join(tags) or 'not set'}) and there is no subfield column. Columns : {', '.join(headers)}")
+            self.columns.append((None, headers.index("subfield")))
+        self.min_length = max([self.bibnb_index] + [index for tag, index in self.columns]) + 1
+
+    def get_auth_ids(self, value:str) -> List[str]:
+        """Returns the authority ID of each field of a column, all $9 joined like dedupe.get_auth_id() (empty ones included).
+        A field whose first $9 is empty has no authority ID (""), as dedupe.dedupe_record() skips it"""
+        if self.infield_separator is None:
+            return value.split(self.separator)
+        output = []
+        for field in value.split(self.separator):
+            koha_ids = field.split(self.infield_separator)
+            output.append("-".join(koha_ids) if koha_ids[0] else "")
+        return output
+
+    def get_dupes(self, row:List[str]) -> List[Tuple[str|None, str, int]]:
+        """Returns (tag, authority ID, number of fields) for each authority ID used by multiple fields of the same tag.
+        tag is None for a subfield column"""
+        output = []
+        for tag, index in self.columns:
+            value = row[index]
+            # Quick exit, if no element is repeated, no ID is
+            if self.infield_separator is None and not has_dupes(value, self.separator):
+                continue
+            counts = {}
+            for auth_id in self.get_auth_ids(value):
+                # Fields without authority ID are never deleted
+                if auth_id:
+                    counts[auth_id] = counts.get(auth_id, 0) + 1
+            output += [(tag, auth_id, nb) for auth_id, nb in counts.items() if nb > 1]
         return output
 
-output = []
-# Open input file
-# Since Koha 24.11 BZ33635 CSV exports include BOM, so use utf-8-sig
-with open(FILE_IN, "r", encoding="utf-8-sig") as f:
-    reader = csv.DictReader(f, delimiter=";")
+def format_dupes(dupes:List[Tuple[str|None, str, int]]) -> str:
+    """Returns dupes as 606 12 (2), 607 14-15 (3)"""
+    return ", ".join(f"{tag} {auth_id} ({nb})" if tag else f"{auth_id} ({nb})" for tag, auth_id, nb in dupes)
 
-    # For each line
+def filter_rows(reader:Iterable, writer, rule:Dupes_Rule, expected_writer=None, profiler:Profiler=None) -> Tuple[int, int]:
+    """Writes the biblionumber of each row with duplicate authority IDs.
+    If expected_writer is set, also writes the number of fields main.py should delete & the duplicate IDs.
+    Returns the number of rows read & the number of biblionumbers written"""
+    nb_rows = 0
+    nb_dupes = 0
     for row in reader:
-        # Get row data
-        data = Bibnb(row).to_dict()
-        if data["dupes"] != "":
-            data.pop("dupes")
-            output.append(data)
-
-# Write lines with duplicates to a new CSV file
-with open(FILE_OUT, "w", encoding='utf-8', newline="") as f:
-    headers = ["biblinoumber"]
-    writer = csv.DictWriter(f, fieldnames=headers)
-    writer.writerows(output)
+        nb_rows += 1
+        if profiler is not None:
+            profiler.tick()
+        if len(row) < rule.min_length:
+            continue
+        dupes = rule.get_dupes(row)
+        if not dupes:
+            continue
+        bibnb = row[rule.bibnb_index]
+        writer.writerow([bibnb])
+        if expected_writer is not None:
+            expected_writer.writerow([bibnb, sum(nb - 1 for tag, auth_id, nb in dupes), format_dupes(dupes)])
+        nb_dupes += 1
+    return nb_rows, nb_dupes
+
+def get_expected_dupes_file_path(file_out:str) -> str:
+    """Returns the default expected duplicates file path, next to the output file"""
+    return os.path.splitext(file_out)[0] + "_expected_dupes.csv"
+
+def open_expected_dupes_file(path:str):
+    """Opens the expected duplicates file & writes its header"""
+    f = open(path, "w", encoding="utf-8", newline="", buffering=IO_BUFFER_SIZE)
+    csv.writer(f).writerow(["biblionumber", "expected_deleted_fields", "duplicates"])
+    return f
+
+def prep_list(file_in:str, file_out:str, separator:str|None=FIELD_SEPARATOR, profiler:Profiler=None,
+              infield_separator:str|None=INFIELD_SEPARATOR, tags:List[str]=TAGS, expected_dupes_file:str=None) -> Tuple[int, int]:
+    """Writes the biblionumber of each row of file_in with duplicate authority IDs to file_out.
+    Also writes the expected deleted fields to expected_dupes_file (defaults to <file_out>_expected_dupes.csv).
+    Streams the files : memory use does not depend on the number of rows.
+    Returns the number of rows read & the number of biblionumbers written"""
+    # Since Koha 24.11 BZ33635 CSV exports include BOM, so use utf-8-sig
+    with open(file_in, "r", encoding="utf-8-sig", newline="", buffering=IO_BUFFER_SIZE) as f_in, \
+            open(file_out, "w", encoding="utf-8", newline="", buffering=IO_BUFFER_SIZE) as f_out, \
+            open_expected_dupes_file(expected_dupes_file or get_expected_dupes_file_path(file_out)) as f_expected:
+        reader = csv.reader(f_in, delimiter=";")
+        rule = Dupes_Rule(next(reader, []), separator, infield_separator, tags)
+        return filter_rows(reader, csv.writer(f_out), rule, csv.writer(f_expected), profiler)
+
+# ----------------- Parallel processing -----------------
+def iter_chunks(file_in:str, start:int, chunk_size:int=CHUNK_SIZE):
+    """Yields (start, end) byte ranges of about chunk_size bytes from start to the end of the file.
+    Each range ends after a line feed, so no line is split between two chunks.
+    Line feeds inside quoted values are not supported"""
+    with open(file_in, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        while start < file_size:
+            end = start + chunk_size
+            if end >= file_size:
+                end = file_size
+            else:
+                # Move the end after the next line feed
+                f.seek(end - 1)
+                f.readline()
+                end = f.tell()
+            yield start, end
+            start = end
+
+def process_chunk(chunk:Tuple[int, int], file_in:str, rule:Dupes_Rule) -> Tuple[int, int, str, str]:
+    """Filters the rows of a byte range of file_in in a worker process.
+    Returns the number of rows read, the number of biblionumbers, the output lines & the expected duplicates lines"""
+    start, end = chunk
+    with open(file_in, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    output = io.StringIO(newline="")
+    expected_output = io.StringIO(newline="")
+    # Only the first chunk starts with the BOM, and it is always in the header line read by the main process
+    reader = csv.reader(io.StringIO(data.decode("utf-8"), newline=""), delimiter=";")
+    nb_rows, nb_dupes = filter_rows(reader, csv.writer(output), rule, csv.writer(expected_output))
+    return nb_rows, nb_dupes, output.getvalue(), expected_output.getvalue()
+
+def prep_list_parallel(file_in:str, file_out:str, separator:str|None=FIELD_SEPARATOR, nb_processes:int=PROCESSES,
+                       chunk_size:int=CHUNK_SIZE, profiler:Profiler=None, infield_separator:str|None=INFIELD_SEPARATOR,
+                       tags:List[str]=TAGS, expected_dupes_file:str=None) -> Tuple[int, int]:
+    """Same as prep_list(), but chunks of the input file are filtered by nb_processes worker processes.
+    The output keeps the input file order.
+    Returns the number of rows read & the number of biblionumbers written"""
+    # Header is read in the main process, decoding the BOM
+    with open(file_in, "rb") as f:
+        header_line = f.readline()
+    headers = next(csv.reader([header_line.decode("utf-8-sig")], delimiter=";"), [])
+    rule = Dupes_Rule(headers, separator, infield_separator, tags)
+    nb_rows = 0
+    nb_dupes = 0
+    with ProcessPoolExecutor(max_workers=nb_processes) as executor, \
+            open(file_out, "w", encoding="utf-8", newline="", buffering=IO_BUFFER_SIZE) as f_out, \
+            open_expected_dupes_file(expected_dupes_file or get_expected_dupes_file_path(file_out)) as f_expected:
+        chunks = iter_chunks(file_in, len(header_line), chunk_size)
+        for chunk_rows, chunk_dupes, output, expected_output in iter_ordered_results(executor, process_chunk, chunks, nb_processes * 2, file_in, rule):
+            f_out.write(output)
+            f_expected.write(expected_output)
+            nb_rows += chunk_rows
+            nb_dupes += chunk_dupes
+            if profiler is not None:
+                profiler.tick(chunk_rows)
+    return nb_rows, nb_dupes
+
+if __name__ == "__main__":
+    # Profiling files are written next to the output file
+    PROFILER = Profiler(get_profile_mode(os.getenv("PROFILE")), os.path.dirname(os.path.abspath(FILE_OUT)), "prep_list_profile",
+                        top=validate_int(os.getenv("PROFILE_TOP"), 30), snapshot_every=validate_int(os.getenv("PROFILE_MEMORY_EVERY"), 1000))
+    PROFILER.start()
+    try:
+        if PROCESSES > 1:
+            nb_rows, nb_dupes = prep_list_parallel(FILE_IN, FILE_OUT, FIELD_SEPARATOR, PROCESSES, CHUNK_SIZE, PROFILER if PROFILER.enabled else None,
+                                                   INFIELD_SEPARATOR, TAGS, EXPECTED_DUPES_FILE)
+        else:
+            nb_rows, nb_dupes = prep_list(FILE_IN, FILE_OUT, FIELD_SEPARATOR, PROFILER if PROFILER.enabled else None,
+                                          INFIELD_SEPARATOR, TAGS, EXPECTED_DUPES_FILE)
+    # Invalid input file columns
+    except ValueError as e:
+        print(rf"/!\ {e} /!\ ")
+        exit()
+    print(f"{nb_dupes} biblionumbers with duplicates out of {nb_rows} rows")
+    for profile_file_path in PROFILER.stop():
+        print(f"Profiling report : {profile_file_path}")
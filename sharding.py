@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# external imports
+from collections import deque
+from concurrent.futures import Executor
+from typing import Iterable, List, Tuple
+import pymarc
+
+# Internal imports
+from api.Koha_REST_API_Client import KohaRESTAPIClient, Content_Type, Status as Koha_Api_Status
+from api.authority_index import Authority_Index
+from api.cl_log import Level
+from api.marc_dump import Dump_Format, marcxml_to_record, serialize_record
+import dedupe
+from dedupe import Error_Types, Outcome, Record_Report, Dead_Auth_Policy
+
+# Functions run by worker processes of main.py multi-core mode
+# Workers never write output files : they return one Record_Report per record,
+# which the main process writes in input order
+
+# Number of records sent at once to a worker process
+SHARD_SIZE = 200
+
+# Koha client of this worker process, see init_list_worker()
+KOHA:KohaRESTAPIClient = None
+# Authority index of this worker process, see init_dump_worker() & init_list_worker()
+# Sent once to each worker instead of with every shard
+AUTHORITIES:Authority_Index|None = None
+
+# ----------------- Shards management -----------------
+def iter_shards(items:Iterable, shard_size:int=SHARD_SIZE):
+    """Yields lists of at most shard_size items"""
+    shard = []
+    for item in items:
+        shard.append(item)
+        if len(shard) >= shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+def iter_ordered_results(executor:Executor, func, shards:Iterable, max_pending:int, *args):
+    """Submits func(shard, *args) for each shard & yields the results in the shards order.
+    At most max_pending shards are submitted at once, so the input is never fully loaded in memory"""
+    pending = deque()
+    for shard in shards:
+        pending.append(executor.submit(func, shard, *args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# ----------------- MARC dump -----------------
+def init_dump_worker(authorities:Authority_Index|None=None):
+    """Process pool initializer : sets the authority index of the worker process"""
+    global AUTHORITIES
+    AUTHORITIES = authorities
+
+def process_dump_shard(shard:List[Tuple[int, bytes]], tags:List[str], dump_format:Dump_Format, prescan:bool=False, log_level:Level=Level.DEBUG, dead_auth_policy:Dead_Auth_Policy=Dead_Auth_Policy.FLAG) -> List[Tuple[Record_Report, bytes|None]]:
+    """Dedupes a shard of (index, record as it is in the dump).
+    prescan is only used for ISO 2709 dumps, see dedupe.process_raw_record()
+    dead_auth_policy is only used if the worker has an authority index, see dedupe.dedupe_record()
+    Returns a list of (report, edited record serialised for the output dump or None)"""
+    output = []
+    for index, data in shard:
+        report = Record_Report(index, log_level=log_level)
+        if dump_format == Dump_Format.MARCXML:
+            try:
+                with report.timer("parse"):
+                    record = marcxml_to_record(data)
+            except Exception:
+                report.error(Error_Types.FAILED_TO_PARSE_MARC)
+                report.log(Level.ERROR, "Failed to parse MARC record")
+                report.outcome = Outcome.ERROR
+                output.append((report, None))
+                continue
+            report.bibnb = dedupe.get_bibnb_from_record(record)
+            record = dedupe.process_record(record, tags, report, AUTHORITIES, dead_auth_policy)
+        else:
+            report.bibnb = dedupe.get_bibnb_from_record(data)
+            record = dedupe.process_raw_record(data, tags, report, prescan, AUTHORITIES, dead_auth_policy)
+        if record is None:
+            output.append((report, None))
+            continue
+        report.updated = True
+        report.log(Level.INFO, "Record was written without duplicates")
+        with report.timer("serialize"):
+            data = serialize_record(record, dump_format)
+        output.append((report, data))
+    return output
+
+# ----------------- Biblionumbers list -----------------
+def init_list_worker(koha_url:str, client_id:str, client_secret:str, client_kwargs:dict, authorities:Authority_Index|None=None):
+    """Process pool initializer : each worker process uses its own Koha client"""
+    global KOHA, AUTHORITIES
+    KOHA = KohaRESTAPIClient(koha_url, client_id, client_secret, **client_kwargs)
+    AUTHORITIES = authorities
+
+def process_list_shard(shard:List[Tuple[int, int]], tags:List[str], prescan:bool=False, log_level:Level=Level.DEBUG, plan:bool=False, dead_auth_policy:Dead_Auth_Policy=Dead_Auth_Policy.FLAG) -> List[Record_Report]:
+    """Retrieves, dedupes & updates a shard of (index, biblionumber).
+    If plan is True, edited records are returned in the reports (see dedupe.stage_record()) instead of being updated.
+    dead_auth_policy is only used if the worker has an authority index, see dedupe.dedupe_record()
+    Returns a report for each record"""
+    output = []
+    for index, bibnb in shard:
+        report = Record_Report(index, bibnb, log_level)
+        output.append(report)
+        if KOHA.status != Koha_Api_Status.SUCCESS:
+            report.error(Error_Types.REQUESTS_GET_ERROR, msg=KOHA.error.name)
+            report.log(Level.ERROR, f"Worker failed to connect to Koha : {KOHA.error.name}")
+            continue
+        with report.timer("get"):
+            response = KOHA.get_biblio(bibnb, Content_Type.RAW_MARC)
+        raw_record = dedupe.check_get_response(response, report)
+        if raw_record is None:
+            continue
+        record:pymarc.record.Record = dedupe.process_raw_record(raw_record, tags, report, prescan, AUTHORITIES, dead_auth_policy)
+        if record is None:
+            continue
+        if plan:
+            dedupe.stage_record(record, report)
+            continue
+        with report.timer("serialize"):
+            data = record.as_marc()
+        with report.timer("put"):
+            response = KOHA.update_biblio(bibnb, record=data)
+        dedupe.check_put_response(response, report)
+    return output